@@ -1,57 +1,102 @@
 import os
 
-from flask import Flask, render_template, redirect, request, session, g, flash, json
-from models import connect_db, db, Cert, Training, Employee, Location, employee_certification
-from forms import Login_Form, User_Form, Cert_Form, Training_Form, Location_Form, SignUp_Form, Edit_User_Form, Reset_Pwd_Form, Add_Cert_Form, Email_Form, Edit_Hours_Form, Add_Loc_Form
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Blueprint, Flask, Response, current_app, jsonify, render_template, redirect, request, session, g, flash, json, abort, send_from_directory, stream_with_context
+from models import connect_db, db, Cert, Training, Employee, Location, Job, employee_certification
+from forms import Login_Form, User_Form, Cert_Form, Training_Form, Location_Form, SignUp_Form, Edit_User_Form, Reset_Pwd_Form, Add_Cert_Form, Email_Form, Edit_Hours_Form, Add_Loc_Form, Import_Form, Enroll_Form, Record_Attendance_Form, Bulk_Cert_Form, Job_Form
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime, timedelta, date
-from flask_mail import Mail, Message
-from flask_bcrypt import Bcrypt
-import smtplib
-from email.message import EmailMessage
-
-bcrypt = Bcrypt()
+from datetime import timedelta, date
+from config import PROFILES, default_profile, engine_options
+import mailer
+import identity
+import due_dates
+import importer
+import compliance
+import sqlstats
+import passwords
+import cache
+from sqlstats import query_budget
+import reports
+import search
+import training_calendar
+import enrollment
+import hours
+import cert_assignment
+import cert_archive
+import replicas
+import assets
+import hours_series
+import forecast
+import jobs
+from pagination import paginate_request, sort_arg, arg_int, arg_date, arg_bool
 
 CURR_USER_KEY = "curr_user"
-EMAIL_ADDRESS = os.environ.get("EMAIL_USER")
-EMAIL_PASSWORD = os.environ.get("EMAIL_PASS")
     
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = (os.environ.get("DATABASE_URL", "postgres:///mycerts"))
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ECHO"] = True
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = True
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "You can do this")
-
-connect_db(app)
-#db.drop_all()
-#db.create_all()
-
-toolbar = DebugToolbarExtension(app)  
-
-
-@app.route("/")
+bp = Blueprint("mycerts", __name__)
+
+
+def create_app(config = None, **settings):
+    """Build the application.
+
+    config is a profile name from config.PROFILES or a config object; extra
+    keyword arguments override single settings. Development-only extensions
+    are imported here, so production workers never load them.
+    """
+
+    app = Flask(__name__)
+    profile = config or default_profile()
+    app.config.from_object(PROFILES[profile] if isinstance(profile, str) else profile)
+    app.config.update(settings)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+    connect_db(app)
+    replicas.init_app(app)
+    passwords.init_app(app)
+    sqlstats.init_app(app)
+    if app.config["LOAD_MIGRATE"] or os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    mailer.init_app(app)
+    identity.init_app(app)
+    cache.init_app(app)
+    importer.init_app(app)
+    compliance.init_app(app)
+    search.init_app(app)
+    training_calendar.init_app(app)
+    hours.init_app(app)
+    hours_series.init_app(app)
+    cert_assignment.init_app(app)
+    cert_archive.init_app(app)
+    forecast.init_app(app)
+    jobs.init_app(app)
+    assets.init_app(app)
+    app.register_blueprint(bp)
+
+    if app.config["DEBUG_TOOLBAR"]:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    return app
+
+
+@bp.route("/")
 def display():
     """Show Homepage, sign up and login buttons"""
 
     #still needs some cleanup on imagry and what the site is about. 
 
-    return render_template("index.html")   
+    # only the deploy changes this page; `flask build-assets` bumps "pages"
+    return cache.conditional(["pages"], [session.get(CURR_USER_KEY)], lambda: render_template("index.html"))
 
 ##################################################################
 # User signup/login/logout
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If user is logged in, add current user to Flask global."""
-
-    if CURR_USER_KEY in session:
-        g.user = Employee.query.get(session[CURR_USER_KEY])
+    """If user is logged in, add current user to Flask global.
+    The user is loaded from the identity cache the first time g.user is used."""
 
-    else:
-        g.user = None
+    g.user = identity.lazy_user(CURR_USER_KEY)
 
 def login(employee):
     """Login user."""
@@ -64,16 +109,20 @@ def logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
         
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login_user():
     """Login form to login"""
 
     form = Login_Form()
 
     if form.validate_on_submit():
-        employee = Employee.authenticate(
-            username = form.username.data, 
-            password = form.password.data)
+        try:
+            employee = Employee.authenticate(
+                username = form.username.data, 
+                password = form.password.data)
+        except passwords.PasswordCheckBusy:
+            flash("Too many people are logging in right now, please try again in a moment", "warning")
+            return render_template("login.html", form = form), 503
 
         if employee:
             login(employee)
@@ -84,7 +133,7 @@ def login_user():
 
     return render_template("login.html", form = form)
 
-@app.route("/sign-up", methods = ["GET", "POST"])
+@bp.route("/sign-up", methods = ["GET", "POST"])
 def sign_up():
     """Handle the signup of a new user, create a new user, add to DB, Redirect to mycerts page
     If the form is not valid, show form. If there is a user with the same email
@@ -105,35 +154,26 @@ def sign_up():
                 hire_date = form.hire_date.data,
                 is_admin = form.is_admin.data
                 )
+            mailer.queue_email(
+                recipient = employee.email,
+                subject = "BLAH",
+                text_body = "This is the plain text for the email",
+                html_body = "<h1> Welcome to My Certs!</h1>")
             
             db.session.commit()
 
         except IntegrityError:
-            flash("Email already in use", "danger")
+            db.session.rollback()
+            flash("Username or email already in use", "danger")
             return render_template("sign-up.html", form = form)
         login(employee)
-        msg = EmailMessage()
-        msg['Subject'] = "BLAH"
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = f"{employee.email}"
-        msg.set_content('This is the plain text for the email')
-        msg.add_alternative("""\
-            <h1> Welcome to My Certs!</h1>
-                """, subtype = "html")
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.ehlo()
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
         return redirect (f"/mycerts/{employee.id}")
 
     else:   
 
         return render_template("sign-up.html", form = form)
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout_user():
     """Logout user"""
 
@@ -142,7 +182,7 @@ def logout_user():
 
     return redirect("/login")
 
-@app.route("/password", methods = ["GET", "POST"])
+@bp.route("/password", methods = ["GET", "POST"])
 def email_search():
     """ Reset users password"""
     
@@ -157,7 +197,7 @@ def email_search():
     else:
         return render_template("password.html", form=form)
 
-@app.route("/password_reset/<int:employee_id>", methods = ["GET", "POST"])
+@bp.route("/password_reset/<int:employee_id>", methods = ["GET", "POST"])
 def reset_password(employee_id):
     """ Reset users password"""
 
@@ -168,30 +208,18 @@ def reset_password(employee_id):
 
     if form.validate_on_submit():
         employee.username = form.username.data
-        hashed_pwd = bcrypt.generate_password_hash(form.password.data).decode("UTF-8")
+        hashed_pwd = passwords.hash_password(form.password.data)
         employee.password = hashed_pwd
+        mailer.queue_email(
+            recipient = employee.email,
+            subject = "BLAH",
+            text_body = "This is the plain text for the email",
+            html_body = "<h1>Your Password has been reset! </h1>")
 
         db.session.commit()
-
-        
+        identity.invalidate(employee.id)
         
         flash("Your password has been reset", "success")
-        
-        msg = EmailMessage()
-        msg['Subject'] = "BLAH"
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = f'{employee.email}'
-        msg.set_content('This is the plain text for the email')
-        msg.add_alternative("""\
-            <h1>Your Password has been reset! </h1>
-            """, subtype = "html")
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.ehlo()
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
         return redirect("/login")
     else:
         return render_template("password.html", form=form)
@@ -199,9 +227,10 @@ def reset_password(employee_id):
 #######################################################################
 # user routes
 
-@app.route("/mycerts/<int:employee_id>")
+@bp.route("/mycerts/<int:employee_id>")
+@query_budget(4)
 def display_certs(employee_id):
-    """Display certs for user logged in"""
+    """Display certs for user logged in; older records are on the history page"""
 
     if not g.user:
         flash("Please Login to continue.", "danger")
@@ -209,43 +238,249 @@ def display_certs(employee_id):
 
     employee = Employee.query.get_or_404(employee_id)
    
-    certs = employee_certification.query.filter_by(employee_id = employee_id).all()
-    
-    all_certs = Cert.query.all()
+    certs = (db.session.query(Cert.cert_name, employee_certification)
+        .join(Cert, Cert.id == employee_certification.cert_id)
+        .filter(employee_certification.employee_id == employee_id)
+        .order_by(Cert.cert_name, employee_certification.received)
+        .all())
     
-    return render_template("users/display_cert.html", employee = employee, certs = certs, all_certs = all_certs)
+    return render_template("users/display_cert.html", employee = employee, certs = certs)
+
+@bp.route("/mycerts/<int:employee_id>/history")
+@query_budget(4)
+def display_cert_history(employee_id):
+    """Display the archived certification records of a user"""
 
-@app.route("/hours/<int:employee_id>")
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+
+    employee = Employee.query.get_or_404(employee_id)
+    certs = cert_archive.history(employee_id)
+
+    return render_template("users/cert_history.html", employee = employee, certs = certs)
+
+@bp.route("/hours/<int:employee_id>")
+@query_budget(4)
 def display_hours(employee_id):
-    """Display training hours with graph for user logged in"""
+    """Display this year's training hours by month against the hours required, from the rollups"""
 
     if not g.user:
         flash("Please Login to continue.", "danger")
         return redirect("/")
     
     employee = Employee.query.get_or_404(employee_id)
+    year = date.today().year
+    summary = hours.employee_hours(employee.id, year)
+    entries = hours.recent_entries(employee.id)
 
-    labels = json.dumps( ["Completed", "Required"])
-    data = json.dumps([employee.completed, employee.required])
+    labels = json.dumps(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+    data = json.dumps(summary["months"])
  
-    return render_template("users/display_hours.html", employee = employee, labels = labels, data = data)
+    return render_template("users/display_hours.html", employee = employee, labels = labels, data = data,
+        summary = summary, entries = entries, year = year)
 
-@app.route("/training")
+@bp.route("/api/hours/<scope>/<int:scope_id>")
+@query_budget(3)
+def hours_over_time(scope, scope_id):
+    """Hours earned per ?bucket (day, week or month) between ?from and ?to as JSON chart series,
+    at most ?points long. Employees see their own; admins see anyone's and every location's."""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+    if scope not in hours_series.SCOPES:
+        abort(404)
+    if g.user.is_admin == False and (scope != "employee" or scope_id != g.user.id):
+        abort(403)
+
+    config = current_app.config
+    end = arg_date("to") or date.today()
+    start = arg_date("from") or end - timedelta(days = config["HOURS_SERIES_DEFAULT_DAYS"])
+    points = arg_int("points")
+    points = config["HOURS_SERIES_DEFAULT_POINTS"] if points is None else points
+    bucket = request.args.get("bucket")
+    if (end < start or (end - start).days > config["HOURS_SERIES_MAX_DAYS"]
+            or not 1 <= points <= config["HOURS_SERIES_MAX_POINTS"] or bucket not in (None, *hours_series.BUCKETS)):
+        abort(400)
+
+    (Employee if scope == "employee" else Location).query.get_or_404(scope_id)
+    render = lambda: jsonify(hours_series.series(scope, scope_id, start, end, bucket, points))
+
+    return cache.conditional(hours_series.tags(scope, scope_id), [], render)
+
+@bp.route("/api/jobs")
+@query_budget(4)
+def list_jobs():
+    """Per-kind queue depth, throughput and timings, and the latest jobs, as JSON for admins"""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        abort(403)
+
+    return jsonify({"metrics": jobs.metrics(), "jobs": [jobs.describe(job) for job in jobs.recent()]})
+
+@bp.route("/api/jobs/<int:job_id>")
+@query_budget(2)
+def job_status(job_id):
+    """One job's status, progress and result as JSON for admins"""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        abort(403)
+
+    # progress is polled, so read it where the heartbeat writes it
+    with replicas.use_primary():
+        job = Job.query.get_or_404(job_id)
+
+    return jsonify(jobs.describe(job))
+
+@bp.route("/training")
+@query_budget(3)
 def display_training():
-    """Display training classes coming up"""
+    """Display training classes coming up, with seats left and enroll buttons"""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+
+    today = date.today()
+
+    def render():
+        trainings = training_calendar.upcoming().all()
+        return render_template("users/show_training.html", trainings = trainings,
+            enrolled = enrollment.enrolled_training_ids(g.user.id), form = Enroll_Form())
+
+    # the page carries the enroll forms' CSRF tokens, so their expiry is part of the ETag
+    return cache.conditional(["trainings", "enrollments"], [g.user.id, today, *cache.csrf_window()], render)
+
+@bp.route("/training/<int:training_id>/enroll", methods = ["POST"])
+def enroll_in_training(training_id):
+    """Take a seat in a training"""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+
+    form = Enroll_Form()
+    if form.validate_on_submit():
+        result = enrollment.enroll(training_id, g.user.id)
+        db.session.commit()
+
+        if result == enrollment.ENROLLED:
+            cache.invalidate("enrollments")
+            flash("You are enrolled!", "success")
+        elif result == enrollment.ALREADY_ENROLLED:
+            flash("You are already enrolled in that class", "info")
+        elif result == enrollment.FULL:
+            flash("Sorry, that class is full", "warning")
+        else:
+            abort(404)
+    else:
+        flash("That form has expired, please try again", "danger")
+
+    return redirect("/training")
+
+@bp.route("/training/<int:training_id>/cancel", methods = ["POST"])
+def cancel_training_enrollment(training_id):
+    """Give up a seat in a training"""
 
     if not g.user:
         flash("Please Login to continue.", "danger")
         return redirect("/")
 
-    trainings = Training.query.all()
+    form = Enroll_Form()
+    if form.validate_on_submit():
+        if enrollment.cancel(training_id, g.user.id):
+            db.session.commit()
+            cache.invalidate("enrollments")
+            flash("Your seat has been released", "success")
+        else:
+            flash("You are not enrolled in that class", "info")
+    else:
+        flash("That form has expired, please try again", "danger")
+
+    return redirect("/training")
+
+@bp.route("/api/trainings")
+@query_budget(4)
+def training_events():
+    """Trainings between ?start and ?end (YYYY-MM-DD, inclusive) as JSON calendar events,
+    optionally only those held in the city of ?location"""
+
+    if not g.user:
+        flash("Please Login to continue.", "danger")
+        return redirect("/")
+
+    start = arg_date("start")
+    end = arg_date("end")
+    if start is None or end is None or end < start or (end - start).days > current_app.config["CALENDAR_MAX_RANGE_DAYS"]:
+        abort(400)
+
+    query = training_calendar.trainings_between(start, end)
+    extra = []
+    location_id = arg_int("location")
+    if location_id is not None:
+        location = Location.query.get_or_404(location_id)
+        query = training_calendar.at_place(query, location.city, location.state)
+        extra = [location.city, location.state]
+
+    stamp = training_calendar.latest_change()
+    render = lambda: jsonify(events = [training_calendar.as_json(training) for training in query])
+
+    return cache.conditional([], [stamp, *extra], render, last_modified = stamp)
+
+@bp.route("/calendar/location/<int:location_id>.ics")
+@query_budget(3)
+def location_training_feed(location_id):
+    """iCalendar feed of the trainings held in a location's city"""
+
+    if not training_calendar.check_feed_token(request.args.get("token"), "location", location_id):
+        abort(404)
+
+    location = Location.query.get_or_404(location_id)
+    query = training_calendar.at_place(training_calendar.trainings_between(*training_calendar.feed_window()),
+        location.city, location.state)
+
+    return training_feed(f"{location.site_name} Training", query, [location.city, location.state])
+
+@bp.route("/calendar/employee/<int:employee_id>.ics")
+@query_budget(3)
+def employee_training_feed(employee_id):
+    """iCalendar feed of the trainings held where an employee works"""
+
+    if not training_calendar.check_feed_token(request.args.get("token"), "employee", employee_id):
+        abort(404)
+
+    places = training_calendar.employee_places(employee_id)
+    query = training_calendar.for_employee(training_calendar.trainings_between(*training_calendar.feed_window()),
+        employee_id)
 
-    return render_template("users/show_training.html", trainings = trainings)
+    return training_feed("My Training", query, places)
+
+def training_feed(name, query, extra):
+    """Stream query as an iCalendar feed, or answer 304 if the client's copy is current"""
+
+    stamp = training_calendar.latest_change()
+    # the window moves daily, so today is part of the version too
+    extra = [stamp, date.today(), *extra]
+
+    def render():
+        body = training_calendar.stream_ics(name, query, request.host)
+        return Response(stream_with_context(body), mimetype = "text/calendar",
+            headers = {"Content-Disposition": "inline; filename=training.ics"})
+
+    return cache.conditional([], extra, render, last_modified = stamp)
 
 ##########################################################################
 #admin dashboard routes
 
-@app.route("/administrator")
+@bp.route("/administrator")
+@query_budget(7)
 def show_all_information():
     """Display Admin options along with list of Users"""
     if not g.user:
@@ -255,12 +490,141 @@ def show_all_information():
         flash ("Unauthorized", "danger")
         return redirect("/login")
 
-    employees = Employee.query.all()
-    all_certs = employee_certification.query.all()
+    page = paginate_request(reports.employee_list_query(), reports.EMPLOYEE_SORTS, "name")
+    rows = reports.dashboard_rows(page.items)
+    sites = compliance.site_summary()
+    site_hours = hours.site_hours()
     
-    return render_template("admin.html", employees = employees, all_certs = all_certs)
+    return render_template("admin.html", rows = rows, page = page, sites = sites, buckets = compliance.BUCKETS,
+        site_hours = site_hours, year = date.today().year)
+
+@bp.route("/administrator/export/<fmt>")
+@query_budget(2)
+def export_certifications(fmt):
+    """Download every employee certification, due date and location as CSV or XLSX"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    rows = reports.compliance_export_rows()
+    filename = f"certifications-{date.today().isoformat()}.{fmt}"
+
+    if fmt == "csv":
+        body = reports.stream_csv(rows)
+        mimetype = "text/csv"
+    elif fmt == "xlsx":
+        body = reports.stream_xlsx(rows)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        abort(404)
+
+    return Response(stream_with_context(body), mimetype = mimetype,
+        headers = {"Content-Disposition": f"attachment; filename={filename}"})
 
-@app.route("/employees")
+@bp.route("/administrator/cache-stats")
+def show_cache_stats():
+    """Cache hit/miss counters for this worker"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    return cache.stats_response()
+
+@bp.route("/administrator/forecast")
+@query_budget(4)
+def show_forecast():
+    """Certifications coming due per month for the next year, by location or ?by=cert"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    by = request.args.get("by", "location")
+    if by not in forecast.GROUPS:
+        abort(400)
+
+    return render_template("admin/forecast.html", by = by, report = forecast.report(by))
+
+@bp.route("/administrator/jobs", methods = ["GET", "POST"])
+@query_budget(4)
+def show_jobs():
+    """Background jobs: queue and timings per kind, the latest runs, and reports to start"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    form = Job_Form()
+    form.action.choices = [(action, label) for action, (label, kind, args) in jobs.ADMIN_ACTIONS.items()]
+
+    if form.validate_on_submit():
+        label, kind, args = jobs.ADMIN_ACTIONS[form.action.data]
+        job = jobs.enqueue(kind, created_by = g.user.id, **args)
+        db.session.commit()
+        flash(f"{label}: job {job.id} queued", "success")
+        return redirect("/administrator/jobs")
+
+    return render_template("admin/jobs.html", form = form, metrics = jobs.metrics(), jobs = jobs.recent(),
+        states = (jobs.QUEUED, jobs.RUNNING), done = jobs.DONE)
+
+@bp.route("/administrator/jobs/<int:job_id>/download")
+@query_budget(2)
+def download_job_output(job_id):
+    """The report file a finished job wrote"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    job = Job.query.get_or_404(job_id)
+    result = jobs.result_of(job)
+    if job.status != jobs.DONE or not result or "file" not in result:
+        abort(404)
+
+    return send_from_directory(current_app.config["JOBS_OUTPUT_DIR"], result["file"],
+        as_attachment = True, attachment_filename = result["filename"])
+
+@bp.route("/administrator/sql-stats")
+def show_sql_stats():
+    """Per-endpoint query counts and database time for this worker"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    return sqlstats.summary_response()
+
+@bp.route("/api/employees/search")
+@query_budget(6)
+def search_employees():
+    """Type-ahead search over employee names, usernames, emails and site names"""
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    employees = search.search_employees(request.args.get("q", ""), limit = arg_int("limit") or 10)
+
+    return jsonify(results = [search.as_json(employee) for employee in employees])
+
+@bp.route("/employees")
+@query_budget(5)
 def show_all_employees():
     """Display Admin options along with list of Users"""
     if not g.user:
@@ -270,14 +634,21 @@ def show_all_employees():
         flash ("Unauthorized", "danger")
         return redirect("/login")
 
-    employees = Employee.query.all()
-    
-      
-    ## right now this is ALL users... 
+    query = reports.employee_list_query(
+        location_id = arg_int("location"),
+        cert_id = arg_int("cert"),
+        is_admin = arg_bool("admin"),
+        hired_from = arg_date("hired_from"),
+        hired_to = arg_date("hired_to"))
+    page = paginate_request(query, reports.EMPLOYEE_SORTS, "name")
+
+    locations = db.session.query(Location.id, Location.site_name).order_by(Location.site_name).all()
+    certs = db.session.query(Cert.id, Cert.cert_name).order_by(Cert.cert_name).all()
     
-    return render_template("employee_display.html", employees = employees)
+    return render_template("employee_display.html", employees = page.items, page = page, locations = locations, certs = certs)
 
-@app.route("/locations")
+@bp.route("/locations")
+@query_budget(2)
 def show_all_locations():
     """Display Admin options along with list of Users"""
     if not g.user:
@@ -287,13 +658,19 @@ def show_all_locations():
         flash ("Unauthorized", "danger")
         return redirect("/login")
 
-    locations = Location.query.all()
-      
-      ## this is ALL locations
+    def render_table():
+        query = reports.location_list_query(state = request.args.get("state"))
+        page = paginate_request(query, reports.LOCATION_SORTS, "name")
+        return render_template("locations_table.html", locations = page.items, page = page)
+
+    def render():
+        table = cache.fragment(f"locations:{request.full_path}", ["locations"], render_table)
+        return render_template("locations_display.html", table = table, sort = sort_arg(reports.LOCATION_SORTS, "name"))
     
-    return render_template("locations_display.html", locations = locations)
+    return cache.conditional(["locations"], [g.user.id], render)
 
-@app.route("/certifications")
+@bp.route("/certifications")
+@query_budget(2)
 def show_all_certifications():
     """Display Admin options along with list of Users"""
     if not g.user:
@@ -304,12 +681,19 @@ def show_all_certifications():
         return redirect("/login")
 
     
-    certs = Cert.query.all()
-    ## all possible certs...
+    def render_table():
+        query = reports.cert_list_query(expire = arg_bool("expire"), is_required = arg_bool("required"))
+        page = paginate_request(query, reports.CERT_SORTS, "name")
+        return render_template("certs_table.html", certs = page.items, page = page)
+
+    def render():
+        table = cache.fragment(f"certs:{request.full_path}", ["certs"], render_table)
+        return render_template("certs_display.html", table = table)
     
-    return render_template("certs_display.html", certs = certs)
+    return cache.conditional(["certs"], [g.user.id], render)
 
-@app.route("/trainings")
+@bp.route("/trainings")
+@query_budget(2)
 def show_all_training():
     """Display Admin options along with list of Users"""
     if not g.user:
@@ -319,18 +703,26 @@ def show_all_training():
         flash ("Unauthorized", "danger")
         return redirect("/login")
 
-    
-    training = Training.query.all()
+    def render_table():
+        query = reports.training_list_query(
+            date_from = arg_date("date_from"),
+            date_to = arg_date("date_to"),
+            state = request.args.get("state"))
+        page = paginate_request(query, reports.TRAINING_SORTS, "date")
+        return render_template("training_table.html", training = page.items, page = page)
 
-    
-    return render_template("training_display.html", training = training)
+    def render():
+        table = cache.fragment(f"trainings:{request.full_path}", ["trainings", "enrollments"], render_table)
+        return render_template("training_display.html", table = table, sort = sort_arg(reports.TRAINING_SORTS, "date"))
+
+    return cache.conditional(["trainings", "enrollments"], [g.user.id], render)
 
 
 
 #####################################################################################################
 #add and edit routes
 
-@app.route("/ad/add-user", methods = ["GET", "POST"])
+@bp.route("/ad/add-user", methods = ["GET", "POST"])
 def add_employee():
     """Setup a user for certs"""
 
@@ -361,7 +753,8 @@ def add_employee():
 
             db.session.commit()
         except IntegrityError:
-            flash("Email already in use", "danger")
+            db.session.rollback()
+            flash("Username or email already in use", "danger")
             return render_template("/admin/add_user.html", form = form)
 
         flash("Employee Added!", "success")
@@ -370,7 +763,37 @@ def add_employee():
 
         return render_template("/admin/add_user.html", form = form)
 
-@app.route("/ad/add-cert", methods = ["GET", "POST"])
+@bp.route("/ad/import", methods = ["GET", "POST"])
+def import_employees():
+    """Bulk import employees, their location and certification from a file"""
+
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    form = Import_Form()
+
+    if form.validate_on_submit():
+        upload = form.file.data
+        job = jobs.enqueue("import-employees", created_by = g.user.id, path = importer.save_upload(upload),
+            filename = upload.filename)
+        db.session.commit()
+        flash(f"{upload.filename} is being imported in the background (job {job.id})", "success")
+        return redirect(f"/ad/import?job={job.id}")
+
+    job = None
+    job_id = arg_int("job")
+    if job_id is not None:
+        job = Job.query.filter_by(id = job_id, kind = "import-employees").first_or_404()
+
+    return render_template("/admin/import_users.html", form = form, job = job, report = job and jobs.result_of(job),
+        states = (jobs.QUEUED, jobs.RUNNING))
+
+@bp.route("/ad/add-cert", methods = ["GET", "POST"])
 def add_cert():
     """Setup a user for certs"""
 
@@ -396,6 +819,7 @@ def add_cert():
         )
         db.session.add(cert)
         db.session.commit()
+        cache.invalidate("certs")
 
         flash("Certification Added!", "success")
         return redirect("/administrator")
@@ -404,7 +828,7 @@ def add_cert():
 
         return render_template("/admin/add_cert.html", form = form)
 
-@app.route("/ad/add-location", methods = ["GET", "POST"])
+@bp.route("/ad/add-location", methods = ["GET", "POST"])
 def add_location():
     """Setup a user for certs"""
 
@@ -427,7 +851,9 @@ def add_location():
             )
             db.session.add(location)
             db.session.commit()
+            cache.invalidate("locations")
         except IntegrityError:
+            db.session.rollback()
             flash("This location already exists", "danger")
             return render_template("/admin/add_location.html", form = form)
     
@@ -436,7 +862,7 @@ def add_location():
     else:
         return render_template("/admin/add_location.html", form = form)
 
-@app.route("/ad/add-training", methods = ["GET", "POST"])
+@bp.route("/ad/add-training", methods = ["GET", "POST"])
 def add_training():
     """Setup a user for certs"""
 
@@ -458,10 +884,12 @@ def add_training():
             room = form.room.data,
             hours = form.hours.data,
             date = form.date.data,
-            time = form.time.data
+            time = form.time.data,
+            capacity = form.capacity.data
         )
         db.session.add(training)
         db.session.commit()
+        cache.invalidate("trainings")
         
         flash("Training Added!", "success")
         return redirect("/administrator")
@@ -470,7 +898,7 @@ def add_training():
 
         return render_template("/admin/add_training.html", form = form)
 
-@app.route("/ad/edit-user/<int:employee_id>", methods = ["GET", "POST"])
+@bp.route("/ad/edit-user/<int:employee_id>", methods = ["GET", "POST"])
 def edit_employee(employee_id):
     """Setup a user for certs"""
 
@@ -491,14 +919,15 @@ def edit_employee(employee_id):
 
     if form.validate_on_submit():
         
-        employee.email = form.email.data, 
-        employee.first_name = form.first_name.data,
-        employee.last_name = form.last_name.data,
-        employee.hire_date = form.hire_date.data, 
+        employee.email = form.email.data
+        employee.first_name = form.first_name.data
+        employee.last_name = form.last_name.data
+        employee.hire_date = form.hire_date.data
         employee.is_admin = form.is_admin.data
 
         
         db.session.commit()
+        identity.invalidate(employee.id)
     
         flash(f"{employee.first_name} {employee.last_name} has been saved", "success")
         return redirect("/administrator")
@@ -506,7 +935,7 @@ def edit_employee(employee_id):
 
         return render_template("/admin/edit_user.html", employee = employee, form = form)
 
-@app.route("/ad/employee-certificaton/<int:employee_id>", methods = ["GET", "POST"])
+@bp.route("/ad/employee-certificaton/<int:employee_id>", methods = ["GET", "POST"])
 def edit_employee_certifications(employee_id):
     """Setup a user for certs"""
 
@@ -528,34 +957,22 @@ def edit_employee_certifications(employee_id):
     if form.validate_on_submit():
         
         cert = Cert.query.get(form.cert.data) 
-        
-
-        if cert.expire:
-            received = form.received.data
-            year = received.year
-            month = received.month
-            day = received.day
-
-            start_date = datetime(year = year, month = month, day = day)
-            change_unit = cert.good_for_unit
-            change_time = cert.good_for_time
-            
-            if change_unit == "days": 
-                delta = timedelta(days = change_time)
-            elif change_unit == "weeks":
-                delta = timedelta(days = change_time * 7)
-            elif change_unit == "months":
-                delta = timedelta(days = change_time * 30)
-            else:
-                delta = timedelta(days = change_time * 365)
-
-            due_date = start_date + delta
-            employees = employee_certification(employee_id = employee_id, cert_id = cert.id, received = received, due_date = due_date)
+        received = form.received.data
+        due_date = due_dates.due_date_for(cert, received)
+        previous = compliance.latest_due_date(employee_id, cert.id)
+        employees = employee_certification(employee_id = employee_id, cert_id = cert.id, received = received, due_date = due_date)
         
         #cert.employees.append(employee))
         #db.session.add(cert)
         #employee.certs.append(dates)
-        db.session.add(employees)
+        try:
+            with db.session.begin_nested():
+                db.session.add(employees)
+        except IntegrityError:
+            flash(f"{employee.first_name} {employee.last_name} already has {cert.cert_name} received on {received}", "warning")
+            return redirect("/administrator")
+        compliance.cert_recorded(employee_id, cert.id, due_date, previous)
+        hours.record_cert(employee_id, cert, received)
         db.session.commit()
     
         flash(f"{employee.first_name} {employee.last_name} has been saved", "success")
@@ -564,7 +981,51 @@ def edit_employee_certifications(employee_id):
 
         return render_template("/admin/employee_cert.html", employee = employee, form = form)
 
-@app.route("/ad/employee-location/<int:employee_id>", methods = ["GET", "POST"])
+@bp.route("/ad/cert-assign", methods = ["GET", "POST"])
+def bulk_assign_cert():
+    """Record one certification for everyone at a location, in a list or in a file"""
+
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    form = Bulk_Cert_Form()
+    form.cert.choices = db.session.query(Cert.id, Cert.cert_name).order_by(Cert.cert_name).all()
+    form.location.choices = [(0, "None")] + db.session.query(Location.id, Location.site_name).order_by(Location.site_name).all()
+    report = None
+
+    if form.validate_on_submit():
+        cert = Cert.query.get_or_404(form.cert.data)
+        employee_ids = cert_assignment.location_cohort(form.location.data) if form.location.data else []
+        identifiers = cert_assignment.parse_identifiers(form.employees.data)
+        if form.file.data:
+            identifiers += cert_assignment.file_identifiers(form.file.data.stream, form.file.data.filename)
+        found, unknown = cert_assignment.resolve(identifiers)
+
+        employee_ids = sorted(set(employee_ids + found))
+
+        if len(employee_ids) > current_app.config["JOBS_ASSIGN_INLINE_LIMIT"]:
+            job = jobs.enqueue("assign-cert", created_by = g.user.id, cert_id = cert.id,
+                received = form.received.data, employee_ids = employee_ids)
+            db.session.commit()
+            report = cert_assignment.AssignReport()
+            report.unknown = unknown
+            flash(f"{cert.cert_name} is being recorded for {len(employee_ids)} employees in the background "
+                f"(job {job.id} under Background Jobs)", "success")
+        else:
+            report = cert_assignment.assign(cert, form.received.data, employee_ids)
+            report.unknown = unknown
+            db.session.commit()
+            flash(f"{cert.cert_name} recorded for {report.assigned} employees ({report.already} already had it) "
+                f"in {report.elapsed:.2f} seconds", "success")
+
+    return render_template("/admin/bulk_cert.html", form = form, report = report)
+
+@bp.route("/ad/employee-location/<int:employee_id>", methods = ["GET", "POST"])
 def edit_employee_locations(employee_id):
     """Setup a user for certs"""
 
@@ -586,8 +1047,11 @@ def edit_employee_locations(employee_id):
     if form.validate_on_submit():
         
         location = Location.query.get(form.location.data) 
-        employee.locations.append(location)
-        db.session.add(employee)
+        if location not in employee.locations:
+            employee.locations.append(location)
+            db.session.add(employee)
+            compliance.location_added(employee.id, location.id)
+            hours.location_added(employee.id, location.id)
         
         db.session.commit()
 
@@ -599,7 +1063,7 @@ def edit_employee_locations(employee_id):
         
         return render_template("/admin/employee_cert.html", employee = employee, form = form)
 
-@app.route("/ad/edit-hours/<int:employee_id>", methods = ["GET", "POST"])
+@bp.route("/ad/edit-hours/<int:employee_id>", methods = ["GET", "POST"])
 def edit_employee_hours(employee_id):
     """Setup a user for certs"""
 
@@ -613,13 +1077,26 @@ def edit_employee_hours(employee_id):
 
     employee = Employee.query.get_or_404(employee_id)
     form = Edit_Hours_Form(obj = employee)
+    # classes held in the past year, newest first; older hours go in as adjustments
+    form.training.choices = [(0, "None (adjustment)")] + (db.session.query(Training.id, Training.name)
+        .filter(Training.date <= date.today(), Training.date > date.today() - timedelta(days = 365))
+        .order_by(Training.date.desc(), Training.id.desc()).all())
 
     if form.validate_on_submit():
         
-        employee.completed = form.completed.data, 
-        employee.required = form.required.data,
+        employee.required = form.required.data
+
+        if form.hours.data:
+            training = Training.query.get(form.training.data) if form.training.data else None
+            earned_on = form.earned_on.data or (training.date if training else date.today())
+            entry = hours.record(employee.id, form.hours.data, earned_on, hours.TRAINING if training else hours.ADJUSTMENT,
+                training_id = training.id if training else None, note = form.note.data or None)
+            if entry is None:
+                flash(f"{employee.first_name} {employee.last_name} was already credited for {training.name}; "
+                    "record a correction as an adjustment", "warning")
                 
         db.session.commit()
+        identity.invalidate(employee.id)
     
         flash(f"{employee.first_name} {employee.last_name} has been saved", "success")
         return redirect("/administrator")
@@ -627,7 +1104,7 @@ def edit_employee_hours(employee_id):
 
         return render_template("/admin/edit_hours.html", employee = employee, form = form)
 
-@app.route("/ad/edit-cert/<int:cert_id>")
+@bp.route("/ad/edit-cert/<int:cert_id>", methods = ["GET", "POST"])
 def edit_cert(cert_id):
     """Setup a user for certs"""
 
@@ -639,10 +1116,11 @@ def edit_cert(cert_id):
         flash ("Unauthorized", "danger")
         return redirect("/login")
 
-    cert = Certs.query.get_or_404(cert_id)
+    cert = Cert.query.get_or_404(cert_id)
     form = Cert_Form(obj=cert)
 
     if form.validate_on_submit():
+        period = (cert.expire, cert.good_for_time, cert.good_for_unit)
         cert.cert_name = form.cert_name.data
         cert.hours = form.hours.data
         cert.is_required = form.is_required.data
@@ -650,14 +1128,24 @@ def edit_cert(cert_id):
         cert.good_for_time = form.good_for_time.data
         cert.good_for_unit = form.good_for_unit.data
         
+        background = False
+        if period != (cert.expire, cert.good_for_time, cert.good_for_unit):
+            held = employee_certification.query.filter_by(cert_id = cert.id).count()
+            if held > current_app.config["JOBS_RECOMPUTE_INLINE_LIMIT"]:
+                jobs.enqueue("recompute-due-dates", created_by = g.user.id, cert_id = cert.id)
+                background = True
+            else:
+                due_dates.recompute_due_dates(cert)
+                compliance.rebuild(cert_id = cert.id)
 
         db.session.commit()
-        flash(f"{cert.cert_name} has been updated")
+        cache.invalidate("certs")
+        flash(f"{cert.cert_name} has been updated" + ("; due dates are being recomputed in the background" if background else ""))
         return redirect("/administrator")
 
     return render_template("/admin/edit_cert.html", form=form, cert = cert)
 
-@app.route("/ad/edit-location/<int:location_id>")
+@bp.route("/ad/edit-location/<int:location_id>", methods = ["GET", "POST"])
 def edit_locations(location_id):
     """Setup a user for certs"""
 
@@ -673,17 +1161,18 @@ def edit_locations(location_id):
     form = Location_Form(obj = location)
 
     if form.validate_on_submit():
-        location.site_name = form.site_name.data,
-        location.city = form.city.data,
+        location.site_name = form.site_name.data
+        location.city = form.city.data
         location.state = form.state.data
         
         db.session.commit()
-        flash(f"Location {site_name} has been updated")
+        cache.invalidate("locations")
+        flash(f"Location {location.site_name} has been updated")
         return redirect("/administrator")
     else:
         return render_template("/admin/edit_location.html", form = form, location = location)
 
-@app.route("/ad/edit-training/<int:training_id>")
+@bp.route("/ad/edit-training/<int:training_id>", methods = ["GET", "POST"])
 def edit_training(training_id):
     """Setup a user for certs"""
 
@@ -699,19 +1188,46 @@ def edit_training(training_id):
     form = Training_Form(obj = training)
 
     if form.validate_on_submit():
-        training.name = form.name.data,
-        training.city = form.city.data,
-        training.state = form.state.data,
-        training.room = form.room.data,
+        training.name = form.name.data
+        training.city = form.city.data
+        training.state = form.state.data
+        training.room = form.room.data
         training.hours = form.hours.data
+        training.date = form.date.data
+        training.time = form.time.data
+        training.capacity = form.capacity.data
 
         db.session.commit()
+        cache.invalidate("trainings")
         flash(f"{training.name} has been updated")
         return redirect("/administrator")
 
     else:
-        return render_template("/admin/edit_training.html", form = form, training = training)
+        return render_template("/admin/edit_training.html", form = form, training = training,
+            attendance_form = Record_Attendance_Form(), to_credit = len(hours.attendees_to_credit(training.id)))
+
+@bp.route("/ad/training/<int:training_id>/attendance", methods = ["POST"])
+def record_attendance(training_id):
+    """Credit the training's hours to every enrolled employee not credited yet"""
+
+    if not g.user:
+        flash("Please login to access", "danger")
+        return redirect("/")
+    
+    if g.user.is_admin == False:
+        flash ("Unauthorized", "danger")
+        return redirect("/login")
+
+    training = Training.query.get_or_404(training_id)
+    form = Record_Attendance_Form()
+
+    if form.validate_on_submit():
+        credited = hours.record_training(training, hours.attendees_to_credit(training.id))
+        db.session.commit()
+        flash(f"{training.hours} hours credited to {credited} employees for {training.name}", "success")
+
+    return redirect(f"/ad/edit-training/{training.id}")
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
-  return render_template("/404.html")
\ No newline at end of file
+  return render_template("/404.html"), 404
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file under static/ into ASSETS_DIR
+(static/dist) with a content hash in its name (mycerts.css becomes
+mycerts.1a2b3c4d5e6f.css), writes gzip and, when the brotli package is
+installed, brotli variants of the text files next to it, and records the
+mapping in manifest.json. Local url(...) references inside stylesheets are
+rewritten to the fingerprinted names before the stylesheet is hashed.
+
+Templates link assets with asset_url("mycerts.css"). With ASSETS_FINGERPRINT
+on and a manifest present that is /assets/mycerts.1a2b3c4d5e6f.css, served
+with the best encoding the browser accepts and a one-year immutable
+Cache-Control, so repeat page views do not ask for it again; a changed file
+gets a new name. Otherwise asset_url falls back to the plain static URL, so
+development needs no build step. Run the build on every deploy; files of the
+previous build are kept so pages rendered by old workers still load theirs,
+and the "pages" cache tag is bumped so ETags of pages that link them change.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+
+import click
+from flask import abort, current_app, request, send_from_directory, url_for
+
+import cache
+
+log = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map", ".ico"}
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+IMMUTABLE = "public, max-age=31536000, immutable"
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class AssetState:
+    """The loaded manifest: logical name -> entry, fingerprinted name -> entry"""
+
+    def __init__(self, manifest = None):
+        self.assets = manifest or {}
+        self.by_path = {entry["path"]: entry for entry in self.assets.values()}
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+
+
+def _fingerprinted(name, content):
+    root, extension = posixpath.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def _compress(content):
+    """{encoding: bytes} for the variants worth keeping"""
+
+    variants = {"gzip": gzip.compress(content, compresslevel = 9, mtime = 0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants["br"] = brotli.compress(content, quality = 11)
+
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(content)}
+
+
+def _rewrite_css(name, content, built):
+    """Point the stylesheet's local url(...) references at their fingerprinted names"""
+
+    base = posixpath.dirname(name)
+
+    def replace(match):
+        quote, target = match.groups()
+        if "://" in target or target.startswith(("data:", "#", "//")):
+            return match.group(0)
+        path, _, suffix = target.partition("?")
+        absolute = path.startswith("/static/")
+        logical = posixpath.normpath(path[len("/static/"):] if absolute else posixpath.join(base, path))
+        if logical not in built:
+            return match.group(0)
+        hashed = built[logical]["path"]
+        new = "/assets/" + hashed if absolute else posixpath.relpath(hashed, base or ".")
+        return f"url({quote}{new}{'?' + suffix if suffix else ''}{quote})"
+
+    return CSS_URL.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+
+def build(source, output):
+    """Fingerprint and compress every file under source into output; returns the manifest"""
+
+    names = []
+    for root, directories, files in os.walk(source):
+        # the output directory usually sits inside static/
+        directories[:] = [directory for directory in directories
+            if os.path.abspath(os.path.join(root, directory)) != os.path.abspath(output)]
+        for file in files:
+            names.append(posixpath.join(*os.path.relpath(os.path.join(root, file), source).split(os.sep)))
+
+    # stylesheets last, so the files they reference already have their names
+    names.sort(key = lambda name: (name.endswith(".css"), name))
+    os.makedirs(output, exist_ok = True)
+    previous = load_manifest(output) or {}
+    manifest = {}
+
+    for name in names:
+        with open(os.path.join(source, name), "rb") as stream:
+            content = stream.read()
+        if name.endswith(".css"):
+            content = _rewrite_css(name, content, manifest)
+
+        path = _fingerprinted(name, content)
+        target = os.path.join(output, *path.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        with open(target, "wb") as stream:
+            stream.write(content)
+
+        entry = {"path": path, "size": len(content), "encodings": {}}
+        if posixpath.splitext(name)[1].lower() in COMPRESSIBLE:
+            for encoding, data in _compress(content).items():
+                with open(target + dict(ENCODINGS)[encoding], "wb") as stream:
+                    stream.write(data)
+                entry["encodings"][encoding] = len(data)
+        manifest[name] = entry
+
+    keep = {MANIFEST}
+    for entry in list(manifest.values()) + list(previous.values()):
+        keep.add(entry["path"])
+        keep.update(entry["path"] + suffix for encoding, suffix in ENCODINGS if encoding in entry["encodings"])
+    for root, _, files in os.walk(output):
+        for file in files:
+            relative = posixpath.join(*os.path.relpath(os.path.join(root, file), output).split(os.sep))
+            if relative not in keep:
+                os.remove(os.path.join(root, file))
+
+    with open(os.path.join(output, MANIFEST), "w") as stream:
+        json.dump(manifest, stream, indent = 2, sort_keys = True)
+
+    return manifest
+
+
+def asset_url(filename):
+    """URL of a static file: fingerprinted when a build is loaded, the plain static URL otherwise"""
+
+    entry = current_app.extensions["assets"].assets.get(filename)
+    if entry is None:
+        return url_for("static", filename = filename)
+    return url_for("assets", filename = entry["path"])
+
+
+def serve(filename):
+    """A fingerprinted file in the best encoding the client accepts, cached for a year"""
+
+    entry = current_app.extensions["assets"].by_path.get(filename)
+    if entry is None:
+        abort(404)
+
+    stored, encoding = filename, None
+    for name, suffix in ENCODINGS:
+        if name in entry["encodings"] and request.accept_encodings[name]:
+            stored, encoding = filename + suffix, name
+            break
+
+    response = send_from_directory(current_app.config["ASSETS_DIR"], stored,
+        mimetype = mimetypes.guess_type(filename)[0], conditional = True)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if entry["encodings"]:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE
+
+    return response
+
+
+def init_app(app):
+    app.config.setdefault("ASSETS_FINGERPRINT", True)
+    app.config.setdefault("ASSETS_DIR", os.path.join(app.static_folder, "dist"))
+
+    manifest = load_manifest(app.config["ASSETS_DIR"]) if app.config["ASSETS_FINGERPRINT"] else None
+    if app.config["ASSETS_FINGERPRINT"] and manifest is None:
+        log.warning("No asset manifest in %s; serving plain static files. Run `flask build-assets`.",
+            app.config["ASSETS_DIR"])
+    app.extensions["assets"] = AssetState(manifest)
+
+    app.add_url_rule("/assets/<path:filename>", "assets", serve)
+    app.add_template_global(asset_url, "asset_url")
+
+    @app.cli.command("build-assets")
+    def build_assets():
+        """Fingerprint and precompress the static files."""
+
+        manifest = build(app.static_folder, app.config["ASSETS_DIR"])
+        app.extensions["assets"] = AssetState(manifest)
+        # pages revalidated by ETag under the "pages" tag link the old names
+        cache.invalidate("pages")
+        size = sum(entry["size"] for entry in manifest.values())
+        smallest = sum(min([entry["size"]] + list(entry["encodings"].values())) for entry in manifest.values())
+        click.echo(f"Built {len(manifest)} assets into {app.config['ASSETS_DIR']}: "
+            f"{size / 1024:.1f} KiB, {smallest / 1024:.1f} KiB compressed")
@@ -0,0 +1,107 @@
+"""Bytes and requests per page load with and without the asset build.
+
+Loads the login page through the Flask test client the way a browser with an
+HTTP cache would: the page, then every local stylesheet, script and image it
+references, honouring Cache-Control max-age and revalidating stale entries
+with If-None-Match / If-Modified-Since. A visitor makes a first visit,
+--views more page views the same day, then one visit a day for --days days.
+This runs once with the plain static files and once with a fresh
+`flask build-assets` output in a temporary directory, and reports asset
+requests and response body bytes for each. No database rows are needed.
+
+    python benchmarks/assets.py --days 7
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from app import create_app
+import assets
+
+ASSET_LINK = re.compile(r"""(?:href|src)\s*=\s*["'](/(?:static|assets)/[^"']+)["']""")
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class Browser:
+    """Just enough of an HTTP cache to count what a real browser would fetch"""
+
+    def __init__(self, client):
+        self.client = client
+        self.now = 0
+        self.cache = {}
+        self.requests = 0
+        self.bytes = 0
+
+    def fetch(self, url):
+        entry = self.cache.get(url)
+        if entry and entry["expires"] > self.now:
+            return
+
+        headers = {"Accept-Encoding": "gzip, br"}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.client.get(url, headers = headers)
+        body = response.get_data()
+        self.requests += 1
+        self.bytes += len(body)
+
+        max_age = MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        self.cache[url] = {"expires": self.now + (int(max_age.group(1)) if max_age else 0),
+            "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+    def view(self, page):
+        html = self.client.get(page).get_data(as_text = True)
+        for url in dict.fromkeys(ASSET_LINK.findall(html)):
+            self.fetch(url)
+
+
+def measure(app, args):
+    browser = Browser(app.test_client())
+    rows = []
+
+    def visits(label, count, apart):
+        requests, sent = browser.requests, browser.bytes
+        for _ in range(count):
+            browser.now += apart
+            browser.view("/login")
+        rows.append((label, browser.requests - requests, browser.bytes - sent))
+
+    visits("first visit", 1, 0)
+    visits(f"{args.views} more views same day", args.views, 60)
+    visits(f"{args.days} daily visits", args.days, 24 * 3600)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--views", type = int, default = 10)
+    parser.add_argument("--days", type = int, default = 7)
+    args = parser.parse_args()
+
+    settings = dict(DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False, MAIL_SENDER_THREAD = False)
+    plain = create_app("development", ASSETS_FINGERPRINT = False, **settings)
+
+    with tempfile.TemporaryDirectory() as output:
+        manifest = assets.build(plain.static_folder, output)
+        built = create_app("development", ASSETS_FINGERPRINT = True, ASSETS_DIR = output, **settings)
+        results = {"plain static": measure(plain, args), "fingerprinted": measure(built, args)}
+
+    print(f"{len(manifest)} assets built; /login as an anonymous visitor, asset requests and body bytes")
+    for label, rows in results.items():
+        print(f"{label}:")
+        for step, requests, sent in rows:
+            print(f"  {step:>26}: {requests:3d} requests, {sent / 1024:7.1f} KiB")
+        print(f"  {'total':>26}: {sum(row[1] for row in rows):3d} requests, {sum(row[2] for row in rows) / 1024:7.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Bulk certification assignment against one form post per employee.
+
+Creates a throwaway certification in the database in DATABASE_URL (seed it
+with benchmarks/seed.py), records it for --batch employees with
+cert_assignment.assign(), runs the same assignment again to show it adds
+nothing, and times --baseline employees the way edit_employee_certifications
+does it (a Cert lookup, one insert, the compliance and hours updates and a
+commit each). Exits non-zero if a row is missing or duplicated. The
+certification and everything recorded for it are removed afterwards.
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/seed.py --create --scale 0.2
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/bulk_assign.py --batch 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func
+
+from app import create_app
+from models import db, Cert, ComplianceSummary, Employee, HoursEntry, employee_certification
+import cert_assignment
+import compliance
+import due_dates
+import hours
+
+
+def one_at_a_time(cert_id, received, employee_ids):
+    for employee_id in employee_ids:
+        cert = Cert.query.get(cert_id)
+        due_date = due_dates.due_date_for(cert, received)
+        previous = compliance.latest_due_date(employee_id, cert.id)
+        db.session.add(employee_certification(employee_id = employee_id, cert_id = cert.id, received = received, due_date = due_date))
+        compliance.cert_recorded(employee_id, cert.id, due_date, previous)
+        hours.record_cert(employee_id, cert, received)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--batch", type = int, default = 10000)
+    parser.add_argument("--baseline", type = int, default = 300, help = "employees to assign one form post at a time")
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False)
+    with app.app_context():
+        employee_ids = [row[0] for row in db.session.query(Employee.id).order_by(Employee.id).limit(args.batch + args.baseline)]
+        if len(employee_ids) < args.batch + args.baseline:
+            sys.exit(f"Only {len(employee_ids)} employees in the database; seed more first")
+        batch, rest = employee_ids[:args.batch], employee_ids[args.batch:]
+
+        cert = Cert("Bulk assign benchmark", 4, True, True, 2, "years")
+        db.session.add(cert)
+        db.session.commit()
+        cert_id, received = cert.id, date.today()
+        print(f"{db.engine.dialect.name}, {db.session.query(func.count(employee_certification.id)).scalar()} emp_cert rows")
+
+        try:
+            first = cert_assignment.assign(cert, received, batch)
+            db.session.commit()
+            again = cert_assignment.assign(cert, received, batch)
+            db.session.commit()
+
+            started = time.perf_counter()
+            one_at_a_time(cert_id, received, rest)
+            baseline = time.perf_counter() - started
+
+            rows = db.session.query(func.count(employee_certification.id)).filter(employee_certification.cert_id == cert_id).scalar()
+            distinct = (db.session.query(func.count(func.distinct(employee_certification.employee_id)))
+                .filter(employee_certification.cert_id == cert_id).scalar())
+            credited = db.session.query(func.count(HoursEntry.id)).filter(HoursEntry.cert_id == cert_id).scalar()
+        finally:
+            db.session.rollback()
+            employee_certification.query.filter(employee_certification.cert_id == cert_id).delete(synchronize_session = False)
+            HoursEntry.query.filter(HoursEntry.cert_id == cert_id).delete(synchronize_session = False)
+            ComplianceSummary.query.filter(ComplianceSummary.cert_id == cert_id).delete(synchronize_session = False)
+            Cert.query.filter(Cert.id == cert_id).delete(synchronize_session = False)
+            hours.rebuild()
+            db.session.commit()
+
+    print(f"bulk assign:  {first.assigned} rows in {first.elapsed * 1000:.0f}ms ({first.rows_per_second:.0f} rows/s)")
+    print(f"re-run:       {again.assigned} rows, {again.already} skipped in {again.elapsed * 1000:.0f}ms")
+    print(f"one per post: {len(rest)} rows in {baseline * 1000:.0f}ms ({len(rest) / baseline:.0f} rows/s)")
+
+    checks = [
+        ("every employee got exactly one row", rows == distinct == len(employee_ids)),
+        ("re-run added nothing", again.assigned == 0 and again.already == len(batch)),
+        ("hours credited once per row", credited == rows),
+    ]
+    failed = False
+    for label, ok in checks:
+        print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+        failed = failed or not ok
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
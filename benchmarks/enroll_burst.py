@@ -0,0 +1,135 @@
+"""Enrollment burst: hundreds of employees enrolling in one class at once.
+
+Publishes a class with --capacity seats in the database in DATABASE_URL
+(seed it with benchmarks/seed.py), then has --threads workers enroll
+--employees different employees as fast as they can, with --duplicates of
+them clicking twice. Reports throughput and latency, then checks the
+invariants: seats_taken equals the enrollment rows, never exceeds capacity,
+every seat went to a distinct employee, and every refusal was "full" or
+"already enrolled". Exits non-zero if any check fails. The class is removed
+afterwards.
+
+    DATABASE_URL=postgresql:///mycerts_bench python benchmarks/enroll_burst.py --employees 1000 --capacity 150
+"""
+
+import argparse
+import os
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, time as clock, timedelta
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app
+from models import db, Employee, Enrollment, Training
+import enrollment
+
+
+def worker(app, attempts, training_id, results, latencies, errors):
+    with app.app_context():
+        while True:
+            try:
+                employee_id = attempts.get_nowait()
+            except queue.Empty:
+                break
+
+            started = time.perf_counter()
+            try:
+                result = enrollment.enroll(training_id, employee_id)
+                db.session.commit()
+            except OperationalError as exc:
+                # SQLite gives up on its file lock under enough contention; Postgres should never get here
+                db.session.rollback()
+                errors.append(str(exc.orig))
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append((employee_id, result))
+
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--employees", type = int, default = 500)
+    parser.add_argument("--capacity", type = int, default = 100)
+    parser.add_argument("--threads", type = int, default = 32)
+    parser.add_argument("--duplicates", type = float, default = 0.1, help = "fraction of employees who click twice")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False, DB_POOL_SIZE = args.threads, SQLALCHEMY_ECHO = False)
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        employee_ids = [row[0] for row in db.session.query(Employee.id).order_by(Employee.id).limit(args.employees)]
+        if len(employee_ids) < args.employees:
+            sys.exit(f"Only {len(employee_ids)} employees in the database; seed more first")
+
+        training = Training("Enrollment burst", "Benchmark", "OH", "Room 1", 1, date.today() + timedelta(days = 30),
+            clock(9, 0), capacity = args.capacity)
+        db.session.add(training)
+        db.session.commit()
+        training_id = training.id
+        dialect = db.engine.dialect.name
+
+    clicks = employee_ids + rng.sample(employee_ids, int(len(employee_ids) * args.duplicates))
+    rng.shuffle(clicks)
+    attempts = queue.Queue()
+    for employee_id in clicks:
+        attempts.put(employee_id)
+
+    results, latencies, errors = [], [], []
+    threads = [threading.Thread(target = worker, args = (app, attempts, training_id, results, latencies, errors))
+        for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        seats_taken = db.session.query(Training.seats_taken).filter(Training.id == training_id).scalar()
+        rows = [row[0] for row in db.session.query(Enrollment.employee_id).filter(Enrollment.training_id == training_id)]
+
+        counts = Counter(result for _, result in results)
+        enrolled = [employee_id for employee_id, result in results if result == enrollment.ENROLLED]
+        checks = [
+            ("seats_taken matches enrollment rows", seats_taken == len(rows)),
+            ("no oversell", seats_taken <= args.capacity),
+            ("class filled", seats_taken == min(args.capacity, len(employee_ids)) or bool(errors)),
+            ("one seat per employee", len(rows) == len(set(rows))),
+            ("every 'enrolled' answer has a row", sorted(enrolled) == sorted(rows)),
+            ("refusals are full or duplicate", set(counts) <= {enrollment.ENROLLED, enrollment.FULL, enrollment.ALREADY_ENROLLED}),
+        ]
+
+        Enrollment.query.filter(Enrollment.training_id == training_id).delete()
+        Training.query.filter(Training.id == training_id).delete()
+        db.session.commit()
+
+    latencies.sort()
+    print(f"{len(clicks)} clicks from {len(employee_ids)} employees for {args.capacity} seats, "
+        f"{args.threads} threads, {dialect}")
+    print(f"{len(results) / elapsed:.0f} enroll calls/s, p50 {statistics.median(latencies):.1f}ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)]:.1f}ms, max {latencies[-1]:.1f}ms")
+    print(", ".join(f"{result}: {count}" for result, count in counts.most_common()) + (f", lock errors: {len(errors)}" if errors else ""))
+    print(f"seats_taken {seats_taken}, enrollment rows {len(rows)}")
+
+    failed = False
+    for label, ok in checks:
+        print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+        failed = failed or not ok
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Before/after query plans for the hot lookup indexes (migration c47a0e9f5b21).
+
+Rebuilds the schema in a scratch database at the revision before the
+indexes, seeds it, times and explains the hot lookups, upgrades to the index
+revision and repeats. It stops there rather than at head so later indexes do
+not change the plans. Everything in DATABASE_URL is dropped, so never point
+it at real data.
+
+    DATABASE_URL=postgresql:///mycerts_bench python benchmarks/explain_indexes.py --rows 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from app import create_app
+from models import db
+
+BEFORE = "8b2e4d6a1c35"
+AFTER = "c47a0e9f5b21"
+
+# (label, SQL with {emp_cert} for the table name, params)
+QUERIES = [
+    ("login by username", "SELECT * FROM employees WHERE username = :username", {"username": "user77777"}),
+    ("certs for one employee", "SELECT * FROM {emp_cert} WHERE employee_id = :employee_id", {"employee_id": 4242}),
+    ("expiring in 30 days", "SELECT count(*) FROM {emp_cert} WHERE due_date BETWEEN :start AND :end",
+        {"start": date(2027, 1, 1), "end": date(2027, 1, 31)}),
+    ("holders of one cert", "SELECT count(*) FROM {emp_cert} WHERE cert_id = :cert_id", {"cert_id": 7}),
+    ("employees at one site", "SELECT count(*) FROM emp_loc WHERE location_id = :location_id", {"location_id": 12}),
+    ("trainings this month", "SELECT * FROM trainings WHERE date BETWEEN :start AND :end",
+        {"start": date(2027, 3, 1), "end": date(2027, 3, 31)}),
+]
+
+
+def seed(rows):
+    """Bulk insert rows employees with one cert and one location each"""
+
+    rng = random.Random(1)
+    conn = db.session.connection()
+    conn.execute(text("INSERT INTO locations (site_name, city, state) VALUES (:site_name, 'City', 'OH')"),
+        [{"site_name": f"Site {i}"} for i in range(200)])
+    conn.execute(text("INSERT INTO certs (cert_name, hours, is_required, expire, good_for_time, good_for_unit) "
+        "VALUES (:cert_name, 4, :req, :req, 2, 'years')"),
+        [{"cert_name": f"Cert {i}", "req": True} for i in range(50)])
+    conn.execute(text("INSERT INTO employees (username, password, email, first_name, last_name, hire_date, is_admin) "
+        "VALUES (:username, 'x', :email, 'First', :last_name, :hire_date, :is_admin)"),
+        [{"username": f"user{i}", "email": f"user{i}@example.com", "last_name": f"Last{i % 5000}",
+          "hire_date": date(2010, 1, 1) + timedelta(days = i % 4000), "is_admin": False} for i in range(rows)])
+
+    received = [date(2025, 1, 1) + timedelta(days = rng.randrange(730)) for _ in range(rows)]
+    conn.execute(text("INSERT INTO employee_certification (employee_id, cert_id, received, due_date) "
+        "VALUES (:employee_id, :cert_id, :received, :due_date)"),
+        [{"employee_id": i + 1, "cert_id": rng.randrange(1, 51), "received": r, "due_date": r + timedelta(days = 730)}
+         for i, r in enumerate(received)])
+    conn.execute(text("INSERT INTO emp_loc (employee_id, location_id) VALUES (:employee_id, :location_id)"),
+        [{"employee_id": i + 1, "location_id": rng.randrange(1, 201)} for i in range(rows)])
+    conn.execute(text("INSERT INTO trainings (name, city, state, room, hours, date, time) "
+        "VALUES ('Class', 'City', 'OH', '1', 2, :date, '09:00:00')"),
+        [{"date": date(2025, 1, 1) + timedelta(days = rng.randrange(1460))} for _ in range(rows // 10)])
+    db.session.commit()
+
+
+def explain(emp_cert):
+    postgres = db.engine.dialect.name == "postgresql"
+    prefix = "EXPLAIN ANALYZE " if postgres else "EXPLAIN QUERY PLAN "
+    conn = db.session.connection()
+    if postgres:
+        conn.execute(text("ANALYZE"))
+
+    timings = {}
+    for label, sql, params in QUERIES:
+        sql = sql.format(emp_cert = emp_cert)
+        start = time.perf_counter()
+        for _ in range(20):
+            conn.execute(text(sql), params).fetchall()
+        timings[label] = (time.perf_counter() - start) / 20 * 1000
+
+        print(f"--- {label}: {timings[label]:.2f} ms")
+        for row in conn.execute(text(prefix + sql), params):
+            print("   ", " | ".join(str(col) for col in row))
+
+    db.session.commit()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--rows", type = int, default = 100000)
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False)
+    with app.app_context():
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.execute(text("DROP TABLE IF EXISTS employee_certification"))
+        db.session.commit()
+        upgrade(revision = BEFORE)
+
+        print(f"Seeding {args.rows} employees...")
+        seed(args.rows)
+
+        print("\n=== before")
+        before = explain("employee_certification")
+
+        upgrade(revision = AFTER)
+        print("\n=== after")
+        after = explain("emp_cert")
+
+        print("\n=== summary (ms per query)")
+        for label, _, _ in QUERIES:
+            print(f"{label:28} {before[label]:9.2f} {after[label]:9.2f} {before[label] / max(after[label], 1e-6):7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Expiration forecast: vectorized NumPy against a row-by-row Python loop.
+
+Builds --rows synthetic certification standings (random employees, certs,
+locations and due dates from two years ago to two years ahead), then times
+forecast.forecast() against the same weekly / monthly / at-risk counts
+computed with a plain Python loop over the rows, and checks that the two
+agree. With --database it also times forecast.load() against the database
+in DATABASE_URL (seed it with benchmarks/seed.py --scale 5 for about a
+million emp_cert rows):
+
+    python benchmarks/forecast.py --rows 1000000
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/forecast.py --database
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+import compliance
+import forecast
+
+
+def synthetic(rows, employees, certs, locations, seed, today):
+    rng = np.random.default_rng(seed)
+    employee_id = rng.integers(1, employees + 1, rows, dtype = np.int32)
+    return forecast.CertTable(
+        employee_id,
+        rng.integers(1, certs + 1, rows, dtype = np.int32),
+        # every employee stays at one location, as most do
+        (employee_id % locations + 1).astype(np.int32),
+        rng.integers(-730, 730, rows, dtype = np.int32),
+        today)
+
+
+def python_forecast(table, weeks, months):
+    """The same counts with a loop over the rows"""
+
+    today = table.today
+    weekly, monthly, expired, due_soon, at_risk = Counter(), Counter(), Counter(), Counter(), defaultdict(set)
+    for employee_id, location_id, days in zip(table.employee_id.tolist(), table.location_id.tolist(), table.days.tolist()):
+        due = today + timedelta(days = days)
+        month = (due.year - today.year) * 12 + due.month - today.month
+        if 0 <= days < 7 * weeks:
+            weekly[location_id, days // 7] += 1
+        if days >= 0 and month < months:
+            monthly[location_id, month] += 1
+        if days < 0:
+            expired[location_id] += 1
+        elif days < compliance.DUE_SOON_DAYS:
+            due_soon[location_id] += 1
+        if days < compliance.DUE_SOON_DAYS:
+            at_risk[location_id].add(employee_id)
+
+    return weekly, monthly, expired, due_soon, at_risk
+
+
+def agrees(result, reference, weeks, months):
+    weekly, monthly, expired, due_soon, at_risk = reference
+    for index, location_id in enumerate(result.keys.tolist()):
+        if (any(result.weekly[index, week] != weekly[location_id, week] for week in range(weeks))
+                or any(result.monthly[index, month] != monthly[location_id, month] for month in range(months))
+                or result.expired[index] != expired[location_id] or result.due_soon[index] != due_soon[location_id]
+                or result.employees_at_risk[index] != len(at_risk[location_id])):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--rows", type = int, default = 1000000)
+    parser.add_argument("--employees", type = int, default = 50000)
+    parser.add_argument("--certs", type = int, default = 40)
+    parser.add_argument("--locations", type = int, default = 200)
+    parser.add_argument("--weeks", type = int, default = 52)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--database", action = "store_true", help = "also time forecast.load() on DATABASE_URL")
+    args = parser.parse_args()
+
+    today = date.today()
+    table = synthetic(args.rows, args.employees, args.certs, args.locations, args.seed, today)
+    names = np.array([f"Site {key}" for key in range(1, args.locations + 1)], dtype = object)
+
+    started = time.perf_counter()
+    result = forecast.forecast(table, "location", weeks = args.weeks, names = names)
+    vectorized = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reference = python_forecast(table, args.weeks, 12)
+    looped = time.perf_counter() - started
+
+    print(f"{len(table)} standings, {args.locations} locations, {args.weeks} weeks")
+    print(f"  numpy forecast  {vectorized * 1000:9.1f}ms")
+    print(f"  python loop     {looped * 1000:9.1f}ms  ({looped / vectorized:.0f}x slower)")
+    ok = agrees(result, reference, args.weeks, 12)
+    print(f"  {'ok  ' if ok else 'FAIL'} numpy and python counts agree")
+
+    if args.database:
+        from app import create_app
+
+        app = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False)
+        with app.app_context():
+            started = time.perf_counter()
+            loaded = forecast.load()
+            loading = time.perf_counter() - started
+            started = time.perf_counter()
+            forecast.forecast(loaded, "location")
+            computing = time.perf_counter() - started
+        print(f"database: {len(loaded)} standings loaded in {loading:.2f}s, forecast in {computing * 1000:.1f}ms")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
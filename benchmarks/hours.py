@@ -0,0 +1,88 @@
+"""Hours dashboard reads: rollup rows against summing the ledger.
+
+Times hours.employee_hours() and hours.site_hours() against the SUM ... GROUP
+BY queries over hours_ledger they replace, for random employees and the
+current year, in the database in DATABASE_URL. benchmarks/seed.py writes one
+ledger entry per certification, so --scale 1 gives a million entries:
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/seed.py --create
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/hours.py
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func
+
+from app import create_app
+from models import db, Employee, HoursEntry, Location, employee_location
+import hours
+
+
+def ledger_employee_hours(employee_id, year):
+    month = hours.period_sql("month", HoursEntry.earned_on)
+    months = dict(db.session.query(month, func.sum(HoursEntry.hours))
+        .filter(HoursEntry.employee_id == employee_id,
+            HoursEntry.earned_on >= date(year, 1, 1), HoursEntry.earned_on <= date(year, 12, 31))
+        .group_by(month))
+    total = db.session.query(func.sum(HoursEntry.hours)).filter(HoursEntry.employee_id == employee_id).scalar()
+    return total, months
+
+
+def ledger_site_hours(year):
+    return (db.session.query(Location.site_name, func.sum(HoursEntry.hours), func.count())
+        .join(employee_location, employee_location.c.location_id == Location.id)
+        .join(HoursEntry, HoursEntry.employee_id == employee_location.c.employee_id)
+        .filter(HoursEntry.earned_on >= date(year, 1, 1), HoursEntry.earned_on <= date(year, 12, 31))
+        .group_by(Location.site_name)
+        .order_by(Location.site_name)
+        .all())
+
+
+def timed(run, arguments):
+    timings = []
+    for argument in arguments:
+        started = time.perf_counter()
+        run(argument)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)], timings[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--reads", type = int, default = 200)
+    parser.add_argument("--site-reads", type = int, default = 5)
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False)
+    with app.app_context():
+        rng = random.Random(args.seed)
+        employee_ids = [row[0] for row in db.session.query(Employee.id)]
+        sample = [rng.choice(employee_ids) for _ in range(args.reads)]
+        year = date.today().year
+
+        print(f"{HoursEntry.query.count()} ledger entries, {len(employee_ids)} employees, {db.engine.dialect.name}")
+        print(f"{'':28} {'p50':>9} {'p95':>9} {'max':>9}")
+        for label, run, arguments in (
+                ("employee_hours (rollup)", lambda employee_id: hours.employee_hours(employee_id, year), sample),
+                ("employee SUM over ledger", lambda employee_id: ledger_employee_hours(employee_id, year), sample),
+                ("site_hours (rollup)", lambda _: hours.site_hours(year), range(args.site_reads)),
+                ("site SUM over ledger", lambda _: ledger_site_hours(year), range(args.site_reads))):
+            p50, p95, worst = timed(run, arguments)
+            print(f"{label:28} {p50:>7.2f}ms {p95:>7.2f}ms {worst:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Hours-over-time chart data: the series endpoint against shipping raw ledger rows.
+
+For the location with the most employees and the employee with the most
+ledger entries in DATABASE_URL, requests /api/hours/<scope>/<id> over the
+whole ledger history (--points points, each bucket size) as an administrator,
+cold (caches cleared) and warm, and compares response size and time with
+serialising every ledger row of the same range to JSON, which is what a
+client-side chart would need otherwise. Checks that every day and week series
+adds up to the ledger's total for the range. Seed with benchmarks/seed.py:
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/hours_series.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func
+
+from app import create_app, CURR_USER_KEY
+from models import db, Employee, HoursEntry, employee_location
+import cache
+
+BUCKETS = ["day", "week", "month"]
+
+
+def raw_rows(scope, scope_id, start, end):
+    query = (db.session.query(HoursEntry.earned_on, HoursEntry.hours)
+        .filter(HoursEntry.earned_on >= start, HoursEntry.earned_on <= end))
+    if scope == "employee":
+        query = query.filter(HoursEntry.employee_id == scope_id)
+    else:
+        query = (query.join(employee_location, employee_location.c.employee_id == HoursEntry.employee_id)
+            .filter(employee_location.c.location_id == scope_id))
+    return json.dumps([[earned_on.isoformat(), hours] for earned_on, hours in query]).encode("utf-8")
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--points", type = int, default = 200)
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False, HOURS_SERIES_MAX_DAYS = 100 * 366)
+    client = app.test_client()
+
+    with app.app_context():
+        admin = Employee.query.filter_by(is_admin = True).order_by(Employee.id).first()
+        start, end = db.session.query(func.min(HoursEntry.earned_on), func.max(HoursEntry.earned_on)).one()
+        if admin is None or start is None:
+            sys.exit("Seed the database first (benchmarks/seed.py)")
+        busiest = func.count().desc()
+        targets = [
+            ("location", db.session.query(employee_location.c.location_id)
+                .group_by(employee_location.c.location_id).order_by(busiest).first()[0]),
+            ("employee", db.session.query(HoursEntry.employee_id)
+                .group_by(HoursEntry.employee_id).order_by(busiest).first()[0]),
+        ]
+        print(f"{HoursEntry.query.count()} ledger entries from {start} to {end}, {db.engine.dialect.name}")
+
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = admin.id
+
+    failed = False
+    print(f"{'':28} {'bytes':>9} {'points':>7} {'cold':>9} {'warm':>9}")
+    for scope, scope_id in targets:
+        with app.app_context():
+            rows, raw_ms = timed(lambda: raw_rows(scope, scope_id, start, end), args.repeat)
+            expected = (db.session.query(func.sum(HoursEntry.hours))
+                .filter(HoursEntry.earned_on >= start, HoursEntry.earned_on <= end)
+                .filter(HoursEntry.employee_id == scope_id if scope == "employee" else
+                    HoursEntry.employee_id.in_(db.session.query(employee_location.c.employee_id)
+                        .filter(employee_location.c.location_id == scope_id)))
+                .scalar() or 0)
+        print(f"{scope} {scope_id}, raw ledger rows{'':>6} {len(rows):>9} {rows.count(b'],') + 1:>7} {raw_ms:>7.1f}ms")
+
+        for bucket in BUCKETS:
+            url = f"/api/hours/{scope}/{scope_id}?from={start}&to={end}&points={args.points}&bucket={bucket}"
+
+            def get():
+                response = client.get(url)
+                return response.get_data(), response.get_json()
+
+            cold = []
+            for _ in range(args.repeat):
+                cache.state.backend.clear()
+                (body, series), elapsed = timed(get, 1)
+                cold.append(elapsed)
+            _, warm = timed(get, args.repeat)
+
+            print(f"  {bucket + ' series':26} {len(body):>9} {len(series['labels']):>7} "
+                f"{statistics.median(cold):>7.1f}ms {warm:>7.1f}ms")
+            # month buckets cover whole months, so only day and week match the range exactly
+            if bucket != "month" and series["total"] != expected:
+                print(f"  FAIL {bucket} series total {series['total']} != ledger {expected}")
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Job queue throughput: several workers draining one queue.
+
+Queues --jobs jobs of a benchmark task that holds each job for --work
+milliseconds, then drains them with --workers JobWorker threads in one
+process, and reports jobs per second, the queue wait and run time per job
+from jobs.metrics(), and how often a claim found its candidate already taken
+by another worker. Checks that every job ran exactly once and ended done. On
+Postgres the claim is SELECT ... FOR UPDATE SKIP LOCKED; on SQLite it is the
+conditional UPDATE fallback. The benchmark's jobs are deleted afterwards.
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/jobs.py --workers 4
+    DATABASE_URL=postgresql:///mycerts python benchmarks/jobs.py --workers 16 --jobs 5000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+os.environ.setdefault("JOBS_WORKER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from app import create_app
+from models import db, Job
+import jobs
+
+KIND = "benchmark"
+runs = Counter()
+runs_lock = threading.Lock()
+
+
+@jobs.task(KIND)
+def benchmark_task(run, number, work):
+    time.sleep(work / 1000)
+    with runs_lock:
+        runs[number] += 1
+
+
+class CountingWorker(jobs.JobWorker):
+    """Counts the polls that found nothing it could claim while jobs were still queued"""
+
+    missed = 0
+
+    def run_one(self):
+        job_id = super().run_one()
+        if job_id is None and Job.query.filter_by(kind = KIND, status = jobs.QUEUED).count():
+            CountingWorker.missed += 1
+        return job_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--jobs", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--work", type = float, default = 5.0, help = "milliseconds each job takes")
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False, JOBS_POLL_INTERVAL = 0.05,
+        JOBS_HEARTBEAT_SECONDS = 1, JOBS_SCHEDULE = {})
+
+    with app.app_context():
+        Job.query.filter_by(kind = KIND).delete()
+        started = time.perf_counter()
+        for number in range(args.jobs):
+            jobs.enqueue(KIND, number = number, work = args.work)
+        db.session.commit()
+        queued = time.perf_counter() - started
+        dialect = db.engine.dialect.name
+
+    print(f"{args.jobs} jobs queued in {queued:.2f}s on {dialect}; {args.workers} workers, {args.work:g}ms each")
+
+    threads = [threading.Thread(target = CountingWorker(app, f"benchmark:{number}", schedule = False).run,
+            kwargs = {"once": True})
+        for number in range(args.workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        stats = next(kind for kind in jobs.metrics()["kinds"] if kind["kind"] == KIND)
+        statuses = Counter(status for (status,) in db.session.query(Job.status).filter_by(kind = KIND))
+        Job.query.filter_by(kind = KIND).delete()
+        db.session.commit()
+
+    ideal = args.jobs * args.work / 1000 / args.workers
+    print(f"  drained in {elapsed:.2f}s, {args.jobs / elapsed:.0f} jobs/s (sleeping alone would take {ideal:.2f}s)")
+    print(f"  queue wait p50 {stats['wait_ms']['p50']}ms p95 {stats['wait_ms']['p95']}ms, "
+        f"run p50 {stats['run_ms']['p50']}ms p95 {stats['run_ms']['p95']}ms")
+    print(f"  {CountingWorker.missed} polls came back empty while jobs were still queued")
+
+    twice = sum(1 for count in runs.values() if count > 1)
+    checks = [
+        (len(runs) == args.jobs, f"every job ran ({len(runs)} of {args.jobs})"),
+        (twice == 0, f"no job ran twice ({twice} did)"),
+        (statuses == Counter({jobs.DONE: args.jobs}), f"every job is done ({dict(statuses)})"),
+    ]
+    for ok, label in checks:
+        print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+
+    if not all(ok for ok, _ in checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Shift-change login storm against a running server.
+
+Starts --logins concurrent login attempts (--concurrency at a time) while a
+second set of threads keeps requesting a cheap page, then reports logins per
+second and the page-view latency seen during the burst next to a quiet
+baseline. Create the accounts first, e.g. with
+`flask import-employees` or benchmarks/seed.py, all sharing --password.
+
+    gunicorn -c gunicorn.conf.py -w 4 wsgi:app &
+    python benchmarks/login_burst.py --url http://127.0.0.1:8000 --users 500
+"""
+
+import argparse
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def login(base_url, username, password):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    page = opener.open(f"{base_url}/login").read().decode("utf-8")
+    match = CSRF.search(page)
+    data = {"username": username, "password": password}
+    if match:
+        data["csrf_token"] = match.group(1)
+
+    started = time.perf_counter()
+    try:
+        response = opener.open(f"{base_url}/login", urllib.parse.urlencode(data).encode("utf-8"))
+        ok = "/mycerts/" in response.geturl()
+    except urllib.error.HTTPError:
+        ok = False
+
+    return ok, time.perf_counter() - started
+
+
+def page_views(base_url, path, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        urllib.request.urlopen(f"{base_url}{path}").read()
+        latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def measure_pages(base_url, path, threads):
+    stop = threading.Event()
+    latencies = []
+    workers = [threading.Thread(target = page_views, args = (base_url, path, stop, latencies)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    return stop, workers, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--url", default = "http://127.0.0.1:5000")
+    parser.add_argument("--users", type = int, default = 200, help = "log in as user0 .. userN-1")
+    parser.add_argument("--username-format", default = "user{}")
+    parser.add_argument("--password", default = "password123")
+    parser.add_argument("--concurrency", type = int, default = 50)
+    parser.add_argument("--page", default = "/")
+    parser.add_argument("--page-threads", type = int, default = 4)
+    args = parser.parse_args()
+
+    stop, workers, quiet = measure_pages(args.url, args.page, args.page_threads)
+    time.sleep(3)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    stop, workers, busy = measure_pages(args.url, args.page, args.page_threads)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = args.concurrency) as pool:
+        results = list(pool.map(lambda n: login(args.url, args.username_format.format(n), args.password), range(args.users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    succeeded = [latency for ok, latency in results if ok]
+    print(f"logins: {len(succeeded)}/{len(results)} succeeded in {elapsed:.1f}s -> {len(succeeded) / elapsed:.1f} logins/sec")
+    if succeeded:
+        print(f"login latency p50 {percentile(succeeded, 50):.0f}ms  p95 {percentile(succeeded, 95):.0f}ms")
+    print(f"page {args.page} quiet  p50 {percentile(quiet, 50):.1f}ms  p95 {percentile(quiet, 95):.1f}ms  ({len(quiet)} requests)")
+    print(f"page {args.page} burst  p50 {percentile(busy, 50):.1f}ms  p95 {percentile(busy, 95):.1f}ms  ({len(busy)} requests)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Mixed read/write load with and without the read replica.
+
+Runs --readers threads pulling admin reports (the first dashboard page and the
+compliance export) and --writers threads appending training-hours ledger
+entries, for --seconds each, twice: once with every statement on the primary
+in DATABASE_URL, once with the reports routed to DATABASE_REPLICA_URL through
+replicas.use_replica(). For a SQLite primary with no DATABASE_REPLICA_URL the
+database file is copied next to itself and used as the replica. Reports reads
+and writes per second, write latency and lock errors for each run, then
+checks that every write landed on the primary and none on the replica. The
+ledger entries are removed and the rollups rebuilt afterwards.
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/replica.py
+    DATABASE_URL=postgresql:///mycerts DATABASE_REPLICA_URL=postgresql://standby/mycerts python benchmarks/replica.py
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import threading
+import time
+from datetime import date
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+
+from app import create_app
+from models import db, Employee, HoursEntry
+from pagination import paginate
+import hours
+import replicas
+import reports
+
+NOTE = "replica benchmark"
+
+
+def reader(app, stop, counts, errors):
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                with replicas.use_replica():
+                    page = paginate(reports.employee_list_query(), reports.EMPLOYEE_SORTS["name"])
+                    reports.dashboard_rows(page.items)
+                    for _ in reports.compliance_export_rows():
+                        pass
+                db.session.rollback()
+                counts.append(1)
+            except OperationalError as exc:
+                db.session.rollback()
+                errors.append(str(exc.orig))
+        db.session.remove()
+
+
+def writer(app, stop, employee_ids, seed, latencies, errors):
+    rng = random.Random(seed)
+    with app.app_context():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                hours.record(rng.choice(employee_ids), 1, date.today(), hours.ADJUSTMENT, note = NOTE)
+                db.session.commit()
+            except OperationalError as exc:
+                # SQLite gives up on its file lock when readers hold it too long
+                db.session.rollback()
+                errors.append(str(exc.orig))
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+        db.session.remove()
+
+
+def run(app, employee_ids, args):
+    stop = threading.Event()
+    reads, read_errors, latencies, write_errors = [], [], [], []
+    threads = ([threading.Thread(target = reader, args = (app, stop, reads, read_errors)) for _ in range(args.readers)]
+        + [threading.Thread(target = writer, args = (app, stop, employee_ids, seed, latencies, write_errors))
+            for seed in range(args.writers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    writes = len(latencies)
+    latencies = sorted(latencies) or [0.0]
+    return {"reads/s": len(reads) / args.seconds, "writes/s": writes / args.seconds,
+        "write p50": statistics.median(latencies), "write p95": latencies[int(len(latencies) * 0.95)],
+        "lock errors": len(read_errors) + len(write_errors), "writes": writes}
+
+
+def ledger_count(engine):
+    return engine.execute(select([func.count()]).where(HoursEntry.note == NOTE)).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--readers", type = int, default = 4)
+    parser.add_argument("--writers", type = int, default = 4)
+    parser.add_argument("--seconds", type = float, default = 10)
+    args = parser.parse_args()
+
+    primary_url = os.environ.get("DATABASE_URL", "postgres:///mycerts")
+    replica_url = os.environ.get("DATABASE_REPLICA_URL")
+    if replica_url is None:
+        url = make_url(primary_url)
+        if url.drivername != "sqlite" or not url.database:
+            sys.exit("Set DATABASE_REPLICA_URL to a replica of DATABASE_URL")
+        copy = url.database + ".replica"
+        shutil.copyfile(url.database, copy)
+        replica_url = f"sqlite:///{copy}"
+
+    pool = args.readers + args.writers
+    primary_only = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False, DB_POOL_SIZE = pool,
+        DATABASE_REPLICA_URL = None)
+    routed = create_app("development", DEBUG_TOOLBAR = False, SQLALCHEMY_ECHO = False, DB_POOL_SIZE = pool,
+        DATABASE_REPLICA_URL = replica_url)
+
+    with primary_only.app_context():
+        employee_ids = [row[0] for row in db.session.query(Employee.id).order_by(Employee.id).limit(1000)]
+        dialect = db.engine.dialect.name
+
+    results = {}
+    for label, app in (("primary only", primary_only), ("with replica", routed)):
+        results[label] = run(app, employee_ids, args)
+
+    with routed.app_context():
+        on_primary = ledger_count(db.get_engine(routed))
+        on_replica = ledger_count(db.get_engine(routed, bind = replicas.REPLICA))
+        checks = [
+            ("every write on the primary", on_primary == sum(result["writes"] for result in results.values())),
+            ("no write on the replica", on_replica == 0),
+            ("replica served the reports", replicas.health.healthy),
+        ]
+
+        HoursEntry.query.filter(HoursEntry.note == NOTE).delete(synchronize_session = False)
+        hours.rebuild()
+        db.session.commit()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s per run, {dialect}")
+    for label, result in results.items():
+        print(f"{label:>13}: {result['reads/s']:.1f} reports/s, {result['writes/s']:.0f} writes/s, "
+            f"write p50 {result['write p50']:.1f}ms, p95 {result['write p95']:.1f}ms, lock errors {result['lock errors']}")
+
+    failed = False
+    for label, ok in checks:
+        print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+        failed = failed or not ok
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
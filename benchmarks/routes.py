@@ -0,0 +1,195 @@
+"""Route-level latency and query-count benchmark.
+
+Drives every GET route of the app through the Flask test client as a logged-in
+administrator, against whatever DATABASE_URL holds (seed it with
+benchmarks/seed.py). The session is set up again before each route, /logout is
+left out, and every measured response must have the route's expected status
+(200 unless EXPECTED_STATUS says otherwise), so a redirect to the login page
+is never timed as if it were the page. For each route it records the cold
+first request (caches cleared), the p50/p95 of the following requests, and the
+SQL statement count from sqlstats' endpoint totals, which include what a
+streamed body ran. Compare against a stored baseline to catch regressions
+before deploying:
+
+    python benchmarks/routes.py --save-baseline benchmarks/baseline.json
+    python benchmarks/routes.py --compare benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func
+
+from app import create_app, CURR_USER_KEY
+from models import db, Cert, Employee, Location, Training
+import cache
+import identity
+import sqlstats
+import training_calendar
+
+# routes whose single request is a bulk job rather than a page view
+SLOW_ROUTES = re.compile(r"^/administrator/export")
+
+# ends the session every later route depends on
+SKIPPED_ROUTES = {"/logout"}
+
+EXPECTED_STATUS = {}
+
+# query strings a route needs to answer with its page rather than a 400 or 403
+QUERY_STRINGS = {
+    "/api/trainings": "start={start}&end={end}",
+    "/api/employees/search": "q=la",
+    "/calendar/location/<int:location_id>.ics": "token={location_token}",
+    "/calendar/employee/<int:employee_id>.ics": "token={employee_token}",
+}
+
+
+class UnexpectedStatus(Exception):
+    """A measured response did not have the status its route should return"""
+
+
+def sample_values():
+    """A real id for every URL parameter the routes use"""
+
+    admin = Employee.query.filter_by(is_admin = True).order_by(Employee.id).first()
+    employee_id = db.session.query(func.max(Employee.id)).scalar()
+    location_id = db.session.query(func.min(Location.id)).scalar()
+
+    return admin.id, {
+        "employee_id": employee_id,
+        "cert_id": db.session.query(func.min(Cert.id)).scalar(),
+        "location_id": location_id,
+        "training_id": db.session.query(func.min(Training.id)).scalar(),
+        "fmt": "csv",
+        "scope": "location",
+        "scope_id": location_id,
+        "start": date.today().isoformat(),
+        "end": (date.today() + timedelta(days = 30)).isoformat(),
+        "location_token": training_calendar.feed_token("location", location_id),
+        "employee_token": training_calendar.feed_token("employee", employee_id),
+    }
+
+
+def get_routes(app, values):
+    """(label, endpoint, url) for every GET rule whose parameters can be filled in"""
+
+    routes = []
+    for rule in sorted(app.url_map.iter_rules(), key = lambda rule: rule.rule):
+        if "GET" not in rule.methods or rule.endpoint == "static" or rule.rule.startswith("/_debug_toolbar"):
+            continue
+        if rule.rule in SKIPPED_ROUTES:
+            continue
+        if any(values.get(argument) is None for argument in rule.arguments):
+            continue
+        url = rule.rule
+        for argument in rule.arguments:
+            url = re.sub(rf"<(?:[^:>]+:)?{argument}>", str(values[argument]), url)
+        if rule.rule in QUERY_STRINGS:
+            url += "?" + QUERY_STRINGS[rule.rule].format(**values)
+        routes.append((rule.rule, rule.endpoint, url))
+
+    return routes
+
+
+def login(client, admin_id):
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = admin_id
+
+
+def queries_so_far(endpoint):
+    return sqlstats.endpoint_totals.summary().get(endpoint, {}).get("queries", 0)
+
+
+def measure(client, route, endpoint, url, iterations, expected):
+    cache.state.backend.clear()
+    identity.snapshots.clear()
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        before = queries_so_far(endpoint)
+        started = time.perf_counter()
+        # buffered reads the whole body and closes the response, which is when sqlstats totals it
+        response = client.get(url, buffered = True)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != expected:
+            raise UnexpectedStatus(f"{route}: {url} returned {response.status_code}, expected {expected}")
+        queries.append(queries_so_far(endpoint) - before)
+
+    warm = sorted(timings[1:]) or timings
+    return {
+        "status": response.status_code,
+        "cold_ms": round(timings[0], 2),
+        "p50_ms": round(statistics.median(warm), 2),
+        "p95_ms": round(warm[min(len(warm) - 1, int(len(warm) * 0.95))], 2),
+        "cold_queries": queries[0],
+        "warm_queries": max(queries[1:] or queries),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing every route that got slower or ran more SQL than the baseline"""
+
+    problems = []
+    for route, now in results.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        if now["cold_queries"] > before["cold_queries"] or now["warm_queries"] > before["warm_queries"]:
+            problems.append(f"{route}: queries {before['cold_queries']}/{before['warm_queries']} -> {now['cold_queries']}/{now['warm_queries']}")
+        if now["p50_ms"] > before["p50_ms"] * tolerance and now["p50_ms"] - before["p50_ms"] > 1:
+            problems.append(f"{route}: p50 {before['p50_ms']}ms -> {now['p50_ms']}ms")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--iterations", type = int, default = 20)
+    parser.add_argument("--save-baseline", metavar = "PATH")
+    parser.add_argument("--compare", metavar = "PATH")
+    parser.add_argument("--tolerance", type = float, default = 1.5, help = "allowed p50 slowdown factor")
+    args = parser.parse_args()
+
+    app = create_app("testing", SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgres:///mycerts"),
+        SQL_BUDGET_STRICT = False)
+    client = app.test_client()
+
+    with app.app_context():
+        admin_id, values = sample_values()
+        routes = get_routes(app, values)
+
+    results = {}
+    print(f"{'route':45} {'status':>6} {'cold':>9} {'p50':>9} {'p95':>9} {'queries':>8}")
+    for route, endpoint, url in routes:
+        iterations = 2 if SLOW_ROUTES.match(url) else args.iterations
+        login(client, admin_id)
+        result = results[route] = measure(client, route, endpoint, url, iterations, EXPECTED_STATUS.get(route, 200))
+        print(f"{route:45} {result['status']:>6} {result['cold_ms']:>7.1f}ms {result['p50_ms']:>7.1f}ms "
+            f"{result['p95_ms']:>7.1f}ms {result['cold_queries']:>4}/{result['warm_queries']:<3}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent = 2, sort_keys = True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            problems = compare(results, json.load(baseline_file), args.tolerance)
+        for problem in problems:
+            print("REGRESSION", problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Type-ahead search against ILIKE scans.
+
+Runs the same type-ahead queries (the first 2-5 letters of real last names,
+usernames and site names) through search.search_employees() and through the
+naive "any column ILIKE '%x%'" query the employee list would otherwise need,
+against the database in DATABASE_URL. Seed it first, e.g.
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/seed.py --create --scale 0.1 --employees 100000
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/search.py
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import or_
+
+from app import create_app
+from models import db, Employee, Location
+import search
+
+
+def sample_queries(count, rng):
+    employees = Employee.query.order_by(Employee.id).limit(5000).all()
+    sites = [row[0] for row in db.session.query(Location.site_name)]
+
+    queries = []
+    for _ in range(count):
+        kind = rng.randrange(3)
+        if kind == 0:
+            source = rng.choice(employees).last_name
+        elif kind == 1:
+            source = rng.choice(employees).username
+        else:
+            source = rng.choice(sites)
+        queries.append(source[:rng.randint(2, 5)])
+
+    return queries
+
+
+def ilike_scan(query, limit):
+    pattern = f"%{query}%"
+    return (Employee.query
+        .outerjoin(Employee.locations)
+        .filter(or_(Employee.first_name.ilike(pattern), Employee.last_name.ilike(pattern),
+            Employee.username.ilike(pattern), Employee.email.ilike(pattern), Location.site_name.ilike(pattern)))
+        .order_by(Employee.last_name, Employee.first_name, Employee.id)
+        .limit(limit)
+        .all())
+
+
+def timed(run, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        run(query)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)], timings[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--limit", type = int, default = 10)
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    app = create_app("development", DEBUG_TOOLBAR = False)
+    with app.app_context():
+        search.create_indexes()
+        db.session.commit()
+
+        queries = sample_queries(args.queries, random.Random(args.seed))
+        employees = Employee.query.count()
+        print(f"{employees} employees, {len(queries)} queries, top {args.limit}, {db.engine.dialect.name}")
+        print(f"{'':24} {'p50':>9} {'p95':>9} {'max':>9}")
+        for label, run in (("search_employees", lambda query: search.search_employees(query, args.limit)),
+                ("ILIKE '%x%' scan", lambda query: ilike_scan(query, args.limit))):
+            p50, p95, worst = timed(run, queries)
+            print(f"{label:24} {p50:>7.2f}ms {p95:>7.2f}ms {worst:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
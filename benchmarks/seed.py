@@ -0,0 +1,147 @@
+"""Synthetic production-scale data.
+
+Fills the database in DATABASE_URL (SQLite or Postgres) with locations,
+certifications, employees, their locations and certification history (each
+certification also credits its hours to the training-hours ledger), and
+trainings, using chunked bulk inserts. All accounts share one password
+(--password) so the login benchmarks can use them; "admin" is an
+administrator.
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/seed.py --create
+    DATABASE_URL=postgresql:///mycerts_bench python benchmarks/seed.py --scale 0.1
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, time as clock, timedelta
+
+os.environ.setdefault("MAIL_SENDER_THREAD", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask import current_app
+
+from app import create_app
+from models import db, Cert, Employee, HoursEntry, Location, Training, employee_certification, employee_location
+import compliance
+import due_dates
+import hours
+import passwords
+
+FULL_SCALE = {
+    "employees": 50000,
+    "locations": 500,
+    "certs": 200,
+    "employee_certs": 1000000,
+    "trainings": 10000,
+}
+
+CHUNK = 10000
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria", "Wei", "Aisha"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Nguyen"]
+STATES = ["OH", "PA", "MI", "IN", "KY", "WV", "NY", "IL", "TX", "CA"]
+CERT_KINDS = ["CPR", "First Aid", "Forklift", "HAZWOPER", "Confined Space", "Fall Protection", "Lockout Tagout",
+    "Respirator Fit", "Crane Operator", "Bloodborne Pathogens"]
+PERIODS = [(1, "years"), (2, "years"), (3, "years"), (6, "months"), (18, "months"), (90, "days"), (52, "weeks")]
+
+
+def insert(table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+    db.session.commit()
+
+
+def seed(counts, password, rng):
+    today = date.today()
+
+    insert(Location.__table__, [{"site_name": f"Site {i:04d}", "city": f"City {i % 97}", "state": rng.choice(STATES)}
+        for i in range(counts["locations"])])
+
+    certs = []
+    for i in range(counts["certs"]):
+        expire = rng.random() < 0.85
+        good_for_time, good_for_unit = rng.choice(PERIODS) if expire else (None, None)
+        certs.append({"cert_name": f"{CERT_KINDS[i % len(CERT_KINDS)]} {i // len(CERT_KINDS) + 1}", "hours": rng.choice([2, 4, 8, 16]),
+            "is_required": rng.random() < 0.5, "expire": expire, "good_for_time": good_for_time, "good_for_unit": good_for_unit})
+    insert(Cert.__table__, certs)
+
+    hashed = passwords.hash_with_cost(password, current_app.config["BCRYPT_LOG_ROUNDS"])
+    employees = [{"username": "admin", "password": hashed, "email": "admin@example.com", "first_name": "Site",
+        "last_name": "Admin", "hire_date": date(2015, 1, 1), "is_admin": True, "required": 40}]
+    for i in range(1, counts["employees"]):
+        employees.append({"username": f"user{i}", "password": hashed, "email": f"user{i}@example.com",
+            "first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+            "hire_date": today - timedelta(days = rng.randrange(20 * 365)), "is_admin": rng.random() < 0.01,
+            "required": 40})
+    insert(Employee.__table__, employees)
+
+    employee_ids = [row[0] for row in db.session.query(Employee.id).order_by(Employee.id)]
+    location_ids = [row[0] for row in db.session.query(Location.id)]
+    cert_rows = Cert.query.all()
+
+    emp_loc = []
+    for employee_id in employee_ids:
+        for location_id in rng.sample(location_ids, 2 if rng.random() < 0.1 else 1):
+            emp_loc.append({"employee_id": employee_id, "location_id": location_id})
+    insert(employee_location, emp_loc)
+
+    emp_cert, ledger, seen = [], [], set()
+    for _ in range(counts["employee_certs"]):
+        cert = rng.choice(cert_rows)
+        employee_id = rng.choice(employee_ids)
+        received = today - timedelta(days = rng.randrange(5 * 365))
+        # emp_cert is unique on (employee_id, cert_id, received)
+        if (employee_id, cert.id, received) in seen:
+            continue
+        seen.add((employee_id, cert.id, received))
+        emp_cert.append({"employee_id": employee_id, "cert_id": cert.id, "received": received,
+            "due_date": due_dates.due_date_for(cert, received)})
+        ledger.append({"employee_id": employee_id, "hours": cert.hours, "earned_on": received, "source": hours.CERT,
+            "cert_id": cert.id})
+        if len(emp_cert) >= CHUNK:
+            insert(employee_certification.__table__, emp_cert)
+            insert(HoursEntry.__table__, ledger)
+            emp_cert, ledger = [], []
+    insert(employee_certification.__table__, emp_cert)
+    insert(HoursEntry.__table__, ledger)
+
+    insert(Training.__table__, [{"name": f"{rng.choice(CERT_KINDS)} class", "city": f"City {rng.randrange(97)}",
+        "state": rng.choice(STATES), "room": f"Room {rng.randrange(1, 30)}", "hours": rng.choice([2, 4, 8]),
+        "date": today + timedelta(days = rng.randrange(-730, 365)), "time": clock(rng.choice([8, 9, 13, 15]), 0)}
+        for _ in range(counts["trainings"])])
+
+    compliance.rebuild()
+    hours.rebuild()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--scale", type = float, default = 1.0, help = "fraction of the full production-sized data set")
+    parser.add_argument("--password", default = "password123")
+    parser.add_argument("--create", action = "store_true", help = "drop and recreate all tables first (scratch databases only)")
+    parser.add_argument("--seed", type = int, default = 1)
+    for name, count in FULL_SCALE.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type = int, help = f"override the row count (full scale: {count})")
+    args = parser.parse_args()
+
+    counts = {name: getattr(args, name) or max(1, int(count * args.scale)) for name, count in FULL_SCALE.items()}
+
+    app = create_app("development", DEBUG_TOOLBAR = False)
+    with app.app_context():
+        if args.create:
+            db.drop_all()
+            db.create_all()
+
+        started = time.perf_counter()
+        seed(counts, args.password, random.Random(args.seed))
+        print(", ".join(f"{count} {name}" for name, count in counts.items()) + f" in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Startup time and per-worker memory.
+
+Measures, in fresh interpreters, how long importing the app and calling
+create_app() takes for each config profile and how many modules it loads.
+Then starts gunicorn with and without --preload against DATABASE_URL, warms
+every worker with a few requests, and reads each worker's memory from
+/proc/<pid>/smaps_rollup (Linux): RSS, PSS (shared pages split between the
+processes using them) and USS (pages private to the worker).
+
+    DATABASE_URL=sqlite:////tmp/mycerts_bench.db python benchmarks/startup.py --workers 4
+"""
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+STARTUP_SNIPPET = """
+import json, resource, sys, time
+started = time.perf_counter()
+from app import create_app
+create_app(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({"ms": elapsed * 1000, "modules": len(sys.modules),
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "toolbar": "flask_debugtoolbar" in sys.modules, "alembic": "alembic" in sys.modules}))
+"""
+
+
+def startup(profile, runs):
+    env = dict(os.environ, MAIL_SENDER_THREAD = "0")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET, profile], cwd = ROOT, env = env,
+            check = True, capture_output = True, text = True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = dict(samples[-1])
+    result["ms"] = statistics.median(sample["ms"] for sample in samples)
+    return result
+
+
+def smaps(pid):
+    """RSS, PSS and USS of one process in MB"""
+
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps_file:
+        for line in smaps_file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+
+    return {
+        "rss": values.get("Rss", 0) / 1024,
+        "pss": values.get("Pss", 0) / 1024,
+        "uss": (values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024,
+    }
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # the command name may contain spaces; the parent pid follows its closing paren
+                if int(stat_file.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    found.append(int(entry))
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+
+    return found
+
+
+def gunicorn_memory(workers, preload, port, requests):
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}", "wsgi:app"]
+    env = dict(os.environ, MYCERTS_CONFIG = "production", MAIL_SENDER_THREAD = "0",
+        GUNICORN_PRELOAD = "1" if preload else "0")
+
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd = ROOT, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}/login"
+        while True:
+            try:
+                urllib.request.urlopen(url, timeout = 1).read()
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError("gunicorn exited; is DATABASE_URL reachable?")
+                time.sleep(0.05)
+        ready_ms = (time.perf_counter() - started) * 1000
+
+        # spread enough requests that every worker has rendered templates and connected
+        for _ in range(requests * workers):
+            urllib.request.urlopen(url, timeout = 5).read()
+
+        worker_pids = children(server.pid)
+        memory = [smaps(pid) for pid in worker_pids]
+        return {
+            "ready_ms": ready_ms,
+            "master": smaps(server.pid),
+            "workers": len(memory),
+            "worker_rss": statistics.mean(entry["rss"] for entry in memory),
+            "worker_pss": statistics.mean(entry["pss"] for entry in memory),
+            "worker_uss": statistics.mean(entry["uss"] for entry in memory),
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout = 30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--runs", type = int, default = 5)
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--requests", type = int, default = 25, help = "warm-up requests per worker")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--skip-gunicorn", action = "store_true")
+    args = parser.parse_args()
+
+    print(f"{'profile':12} {'startup':>9} {'modules':>8} {'max RSS':>9}  toolbar  alembic")
+    for profile in ("development", "testing", "production"):
+        result = startup(profile, args.runs)
+        print(f"{profile:12} {result['ms']:>7.0f}ms {result['modules']:>8} {result['maxrss_kb'] / 1024:>7.1f}MB  "
+            f"{'yes' if result['toolbar'] else 'no':7}  {'yes' if result['alembic'] else 'no'}")
+
+    if args.skip_gunicorn:
+        return
+
+    print(f"\ngunicorn, {args.workers} workers, production profile (MB per worker)")
+    print(f"{'mode':12} {'ready':>9} {'RSS':>8} {'PSS':>8} {'USS':>8} {'master RSS':>11}")
+    for preload in (False, True):
+        result = gunicorn_memory(args.workers, preload, args.port, args.requests)
+        print(f"{'preload' if preload else 'no preload':12} {result['ready_ms']:>7.0f}ms {result['worker_rss']:>8.1f} "
+            f"{result['worker_pss']:>8.1f} {result['worker_uss']:>8.1f} {result['master']['rss']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
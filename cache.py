@@ -0,0 +1,220 @@
+"""Caching for read-mostly pages.
+
+Values are stored under keys that embed the current generation of each tag
+they depend on ("trainings", "certs", "locations"). A write route calls
+invalidate(tag), which bumps the generation; every key built on the old
+generation stops matching and ages out. The same generations make cheap
+ETags, so a client revalidating with If-None-Match gets a 304 without the
+view touching the database.
+
+The store is process-local by default, so other workers may serve the old
+version for up to CACHE_DEFAULT_TTL seconds after a write. Set
+CACHE_REDIS_URL to share entries and generations between workers through
+Redis (needs the redis package).
+"""
+
+import hashlib
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app, jsonify, make_response, request, session
+from markupsafe import Markup
+
+
+class LocalCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize = 2048, ttl = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def counter(self, key):
+        # counters live outside the LRU so a generation can never be evicted and reset
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCache:
+    """The LocalCache interface on top of a Redis server"""
+
+    def __init__(self, url, ttl = 60, prefix = "mycerts:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl = None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex = int(ttl or self.ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class _State:
+    def __init__(self):
+        self.backend = LocalCache()
+        self.stats = Counter()
+
+
+state = _State()
+
+
+def generation(tag):
+    count = state.backend.counter(f"gen:{tag}")
+    if isinstance(state.backend, LocalCache):
+        # other workers never see a local invalidate(); rolling the generation
+        # every TTL bounds how long they can keep serving the old version
+        return f"{count}.{int(time.time() // state.backend.ttl)}"
+    return str(count)
+
+
+def invalidate(*tags):
+    """Call after a write that changes what the tagged pages show"""
+
+    for tag in tags:
+        state.backend.incr(f"gen:{tag}")
+
+
+def _versioned_key(key, tags):
+    versions = ",".join(f"{tag}={generation(tag)}" for tag in tags)
+    return f"{key}|{versions}"
+
+
+def cached(key, tags, build, ttl = None):
+    """Return the cached value for key, calling build() on a miss"""
+
+    namespace = key.split(":", 1)[0]
+    full_key = _versioned_key(key, tags)
+
+    value = state.backend.get(full_key)
+    if value is not None:
+        state.stats[f"{namespace}.hit"] += 1
+        return value
+
+    state.stats[f"{namespace}.miss"] += 1
+    value = build()
+    state.backend.set(full_key, value, ttl)
+
+    return value
+
+
+def fragment(key, tags, render, ttl = None):
+    """cached() for rendered HTML; the result can be dropped into a template as is"""
+
+    return Markup(cached(f"fragment:{key}", tags, lambda: str(render()), ttl))
+
+
+def etag(tags, *extra):
+    """ETag for a response that depends on tags and on extra values (user, URL)"""
+
+    raw = _versioned_key("|".join(str(value) for value in extra), tags)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def csrf_window():
+    """ETag values for a page that embeds CSRF tokens.
+
+    They change with the session's CSRF secret and every half
+    WTF_CSRF_TIME_LIMIT, so a revalidated copy never holds a token with less
+    than half its lifetime left, whatever the tag generations do.
+    """
+
+    config = current_app.config
+    limit = config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    secret = session.get(config.get("WTF_CSRF_FIELD_NAME", "csrf_token"))
+    return [secret, int(time.time() // max(1, limit // 2)) if limit else None]
+
+
+def conditional(tags, extra, render, last_modified = None):
+    """Answer 304 if the client's copy is current, otherwise render with an ETag.
+
+    render is only called on a miss, so a revalidation costs no database work.
+    Pass last_modified (a UTC datetime) to also honour If-Modified-Since.
+    """
+
+    tag = etag(tags, request.full_path, *extra)
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond = 0)
+    if session.get("_flashes"):
+        # a message is waiting to be shown, so the client's copy cannot be current
+        fresh = False
+    elif request.if_none_match:
+        fresh = tag in request.if_none_match
+    else:
+        since = request.if_modified_since
+        fresh = last_modified is not None and since is not None and last_modified <= since.replace(tzinfo = None)
+
+    if fresh:
+        state.stats["etag.304"] += 1
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+    response.set_etag(tag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    return response
+
+
+def stats_response():
+    return jsonify(dict(state.stats))
+
+
+def init_app(app):
+    app.config.setdefault("CACHE_DEFAULT_TTL", 300)
+    app.config.setdefault("CACHE_REDIS_URL", None)
+
+    if app.config["CACHE_REDIS_URL"]:
+        state.backend = RedisCache(app.config["CACHE_REDIS_URL"], ttl = app.config["CACHE_DEFAULT_TTL"])
+    else:
+        state.backend = LocalCache(ttl = app.config["CACHE_DEFAULT_TTL"])
@@ -0,0 +1,145 @@
+"""Archival of certification history.
+
+emp_cert only ever grows: every renewal adds a row and the old one stays. The
+archive job moves two kinds of rows into emp_cert_history:
+
+- superseded: a later record of the same cert exists for the employee, and
+  this one is no longer valid (its due date has passed, or it never had one)
+- expired: the latest record of a cert whose due date passed more than
+  CERT_ARCHIVE_EXPIRED_DAYS ago
+
+so emp_cert keeps only what decides each employee's current standing, and the
+per-employee pages, dashboard, exports and compliance summary read only that.
+
+On Postgres emp_cert_history is partitioned by due_date, one partition per
+year created as rows arrive, plus a default partition for certs that never
+expire. Elsewhere it is a plain table. Rows are moved in batches of
+CERT_ARCHIVE_BATCH, each its own transaction, by `flask archive-certs`, which
+is meant to run nightly after `flask reconcile-compliance`; the default
+JOBS_SCHEDULE in jobs.py queues both.
+"""
+
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, bindparam, case, exists, func, literal, or_, select, text
+from sqlalchemy.orm import aliased
+
+from models import db, Cert, CertHistory, employee_certification
+import compliance
+import replicas
+
+SUPERSEDED = "superseded"
+EXPIRED = "expired"
+HISTORY_COLUMNS = ["id", "employee_id", "cert_id", "received", "due_date", "reason", "archived_at"]
+
+
+def _criteria(today):
+    """(where clause, reason expression) selecting the emp_cert rows ready to move"""
+
+    current = employee_certification.__table__
+    newer = aliased(current)
+    superseded = exists().where(and_(
+        newer.c.employee_id == current.c.employee_id,
+        newer.c.cert_id == current.c.cert_id,
+        or_(newer.c.received > current.c.received, and_(newer.c.received == current.c.received, newer.c.id > current.c.id))))
+
+    cutoff = today - timedelta(days = current_app.config["CERT_ARCHIVE_EXPIRED_DAYS"])
+    # anything due before the cutoff goes whether superseded or not, so the
+    # EXISTS only runs for rows the due date alone cannot decide
+    where = or_(
+        current.c.due_date < cutoff,
+        and_(or_(current.c.due_date.is_(None), current.c.due_date < today), superseded))
+    reason = case([(superseded, literal(SUPERSEDED))], else_ = literal(EXPIRED))
+
+    return where, reason
+
+
+def _partitioned():
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('emp_cert_history')")).first() is not None
+
+
+def ensure_partitions(years):
+    """Create the yearly emp_cert_history partitions that rows due in years need"""
+
+    for year in sorted(years):
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS emp_cert_history_y{year:04d} PARTITION OF emp_cert_history "
+            f"FOR VALUES FROM ('{year:04d}-01-01') TO ('{year + 1:04d}-01-01')"))
+
+
+def archive(today = None, dry_run = False):
+    """Move archivable emp_cert rows to emp_cert_history; returns {reason: count}"""
+
+    today = today or date.today()
+    current = employee_certification.__table__
+    where, reason = _criteria(today)
+    batch_size = current_app.config["CERT_ARCHIVE_BATCH"]
+
+    if dry_run:
+        with replicas.use_replica():
+            counts = db.session.execute(select([reason, func.count()]).where(where).group_by(reason))
+            return Counter({row_reason: count for row_reason, count in counts})
+
+    partitioned = _partitioned()
+    moved = Counter()
+    ids = bindparam("ids", expanding = True)
+    copy = (CertHistory.__table__.insert().from_select(HISTORY_COLUMNS,
+        select([current.c.id, current.c.employee_id, current.c.cert_id, current.c.received, current.c.due_date,
+            reason, literal(datetime.utcnow())]).where(current.c.id.in_(ids))))
+    delete = current.delete().where(current.c.id.in_(ids))
+
+    last_id = 0
+    while True:
+        # keyset on id so rows already looked at are not scanned again
+        rows = db.session.execute(select([current.c.id, current.c.due_date, reason])
+            .where(and_(current.c.id > last_id, where)).order_by(current.c.id).limit(batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        if partitioned:
+            ensure_partitions({due_date.year for _, due_date, _ in rows if due_date})
+        batch = {"ids": [row_id for row_id, _, _ in rows]}
+        db.session.execute(copy, batch)
+        db.session.execute(delete, batch)
+        db.session.commit()
+        moved.update(row_reason for _, _, row_reason in rows)
+
+    if moved:
+        compliance.rebuild()
+        db.session.commit()
+
+    return moved
+
+
+def history(employee_id):
+    """[(cert_name, archived row)] for one employee, newest first"""
+
+    return (db.session.query(Cert.cert_name, CertHistory)
+        .join(Cert, Cert.id == CertHistory.cert_id)
+        .filter(CertHistory.employee_id == employee_id)
+        .order_by(CertHistory.received.desc(), CertHistory.id.desc())
+        .all())
+
+
+def init_app(app):
+    app.config.setdefault("CERT_ARCHIVE_EXPIRED_DAYS", 3 * 365)
+    app.config.setdefault("CERT_ARCHIVE_BATCH", 5000)
+
+    @app.cli.command("archive-certs")
+    @click.option("--dry-run", is_flag = True, help = "Only count the rows that would move.")
+    def archive_certs(dry_run):
+        """Move superseded and long-expired certification records to the archive."""
+
+        started = time.perf_counter()
+        moved = archive(dry_run = dry_run)
+        verb = "would move" if dry_run else "moved"
+        click.echo(f"Archive {verb} {moved[SUPERSEDED]} superseded and {moved[EXPIRED]} expired records "
+            f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,186 @@
+"""Bulk certification assignment.
+
+Records one certification, received on one date, for a whole cohort of
+employees: everyone at a location, a list of usernames or emails, or the
+username/email column of a CSV or XLSX file. The due date is computed once,
+then the emp_cert rows are written with one INSERT ... SELECT per BATCH_SIZE
+employees. The SELECT skips employees who already hold the cert with the same
+received date, and the unique (employee_id, cert_id, received) index turns a
+row another transaction inserted meanwhile into a skipped one (ON CONFLICT DO
+NOTHING on Postgres, INSERT OR IGNORE on SQLite), so running the same
+assignment twice, even at once, adds nothing.
+
+Afterwards the compliance summary of the cert is rebuilt in one statement and
+the cert's hours are credited with hours.record_for_employees().
+"""
+
+import re
+import time
+
+import click
+from sqlalchemy import Date, Integer, and_, bindparam, exists, literal, or_, select
+
+from models import db, Cert, Employee, Location, employee_certification, employee_location
+import compliance
+import due_dates
+import hours
+import importer
+
+BATCH_SIZE = 5000
+
+
+class AssignReport:
+    """Outcome of a bulk assignment"""
+
+    def __init__(self):
+        self.assigned = 0
+        self.already = 0
+        self.unknown = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.assigned / self.elapsed if self.elapsed else 0.0
+
+
+def location_cohort(location_id):
+    """Ids of every employee assigned to the location"""
+
+    return [employee_id for (employee_id,) in db.session.query(employee_location.c.employee_id)
+        .filter(employee_location.c.location_id == location_id)
+        .distinct()]
+
+
+def parse_identifiers(text):
+    """Usernames or emails separated by commas, semicolons or whitespace"""
+
+    return [word for word in re.split(r"[\s,;]+", text or "") if word]
+
+
+def file_identifiers(stream, filename):
+    """The username (or else email) of every row of a CSV or XLSX file"""
+
+    rows = importer.read_rows(stream, filename, is_header = lambda names: "username" in names or "email" in names)
+    return [record.get("username") or record.get("email") for _, record in rows
+        if record.get("username") or record.get("email")]
+
+
+def resolve(identifiers):
+    """(employee ids, identifiers that match no username or email)"""
+
+    identifiers = list(dict.fromkeys(identifiers))
+    lookup = select([Employee.id, Employee.username, Employee.email]).where(or_(
+        Employee.username.in_(bindparam("batch", expanding = True)), Employee.email.in_(bindparam("batch", expanding = True))))
+
+    found = {}
+    for start in range(0, len(identifiers), BATCH_SIZE):
+        for employee_id, username, email in db.session.execute(lookup, {"batch": identifiers[start:start + BATCH_SIZE]}):
+            found[username] = found[email] = employee_id
+
+    return list(dict.fromkeys(found[value] for value in identifiers if value in found)), \
+        [value for value in identifiers if value not in found]
+
+
+def _insert_new(table, rows):
+    """INSERT ... SELECT of rows that skips any conflicting with the unique (employee_id, cert_id, received)"""
+
+    columns = ["employee_id", "cert_id", "received", "due_date"]
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return (insert(table).from_select(columns, rows)
+            .on_conflict_do_nothing(index_elements = ["employee_id", "cert_id", "received"])
+            .returning(table.c.employee_id))
+
+    return table.insert().prefix_with("OR IGNORE", dialect = "sqlite").from_select(columns, rows)
+
+
+def _inserted_ids(table, result):
+    """Employee ids of the rows an _insert_new() statement added"""
+
+    if result.returns_rows:
+        return [employee_id for (employee_id,) in result]
+    if not result.rowcount:
+        return []
+
+    # SQLite holds the write lock and numbers the rows of one INSERT ... SELECT consecutively
+    last = result.lastrowid
+    return [employee_id for (employee_id,) in db.session.execute(select([table.c.employee_id])
+        .where(table.c.id.between(last - result.rowcount + 1, last)))]
+
+
+def assign(cert, received, employee_ids, progress = None):
+    """Record cert, received on received, for every employee in employee_ids; callers commit.
+
+    progress, if given, is called with (employees done, total) after each batch.
+    """
+
+    report = AssignReport()
+    started = time.perf_counter()
+    due_date = due_dates.due_date_for(cert, received)
+    employee_ids = sorted(set(employee_ids))
+    table = employee_certification.__table__
+
+    held = exists().where(and_(table.c.employee_id == Employee.id, table.c.cert_id == cert.id,
+        table.c.received == received))
+
+    # an expanding IN is compiled once, however many ids each batch carries
+    missing = and_(Employee.id.in_(bindparam("batch", expanding = True)), ~held)
+    rows = select([Employee.id, literal(cert.id, Integer), literal(received, Date), literal(due_date, Date)]).where(missing)
+    insert = _insert_new(table, rows)
+
+    added = []
+    for start in range(0, len(employee_ids), BATCH_SIZE):
+        result = db.session.execute(insert, {"batch": employee_ids[start:start + BATCH_SIZE]})
+        added += _inserted_ids(table, result)
+        if progress:
+            progress(min(start + BATCH_SIZE, len(employee_ids)), len(employee_ids))
+
+    report.assigned = len(added)
+    report.already = len(employee_ids) - len(added)
+
+    if added:
+        compliance.rebuild(cert_id = cert.id)
+        if cert.hours:
+            hours.record_for_employees(added, cert.hours, received, hours.CERT, cert_id = cert.id)
+
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def init_app(app):
+    @app.cli.command("assign-cert")
+    @click.argument("cert_name")
+    @click.argument("received", type = click.DateTime(formats = ["%Y-%m-%d"]))
+    @click.option("--location", help = "Assign to everyone at this site.")
+    @click.option("--employees", help = "Comma-separated usernames or emails.")
+    @click.option("--file", "path", type = click.Path(exists = True, dir_okay = False),
+        help = "CSV or XLSX file with a username or email column.")
+    def assign_cert_command(cert_name, received, location, employees, path):
+        """Record one certification for many employees at once."""
+
+        cert = Cert.query.filter_by(cert_name = cert_name).first()
+        if cert is None:
+            raise click.ClickException(f"No certification named {cert_name!r}")
+
+        employee_ids, unknown = [], []
+        if location:
+            site = Location.query.filter_by(site_name = location).first()
+            if site is None:
+                raise click.ClickException(f"No location named {location!r}")
+            employee_ids += location_cohort(site.id)
+        identifiers = parse_identifiers(employees)
+        if path:
+            with open(path, "rb") as stream:
+                identifiers += file_identifiers(stream, path)
+        if identifiers:
+            found, unknown = resolve(identifiers)
+            employee_ids += found
+
+        report = assign(cert, received.date(), employee_ids)
+        report.unknown = unknown
+        db.session.commit()
+        click.echo(f"{cert.cert_name}: {report.assigned} assigned, {report.already} already held it, "
+            f"in {report.elapsed:.2f}s ({report.rows_per_second:.0f} rows/s)")
+        for value in report.unknown:
+            click.echo(f"  unknown employee {value!r}")
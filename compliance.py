@@ -0,0 +1,170 @@
+"""Site-level compliance counts.
+
+compliance_summary holds, for every (location, cert), how many employees at
+that location fall in each due-date bucket. An employee's standing for a cert
+is the latest due date among their rows for it. The write routes keep the
+counts current with small deltas; buckets are relative to today, so rebuild()
+runs nightly (`flask reconcile-compliance`) to move rows across bucket edges
+and to correct any drift.
+"""
+
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import click
+from sqlalchemy import and_, case, func, literal
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Cert, ComplianceSummary, Location, employee_certification, employee_location
+
+BUCKETS = OrderedDict([
+    ("expired", "Expired"),
+    ("due_30", "Due in 30 days"),
+    ("current", "Current"),
+    ("no_expiry", "Does not expire"),
+])
+
+DUE_SOON_DAYS = 30
+
+
+def bucket_for(due_date, today = None):
+    """Bucket of a single due date"""
+
+    today = today or date.today()
+    if due_date is None:
+        return "no_expiry"
+    if due_date < today:
+        return "expired"
+    if due_date < today + timedelta(days = DUE_SOON_DAYS):
+        return "due_30"
+    return "current"
+
+
+def bucket_sql(due_date, today = None):
+    """SQL version of bucket_for()"""
+
+    today = today or date.today()
+    return case([
+        (due_date.is_(None), literal("no_expiry")),
+        (due_date < today, literal("expired")),
+        (due_date < today + timedelta(days = DUE_SOON_DAYS), literal("due_30")),
+        ], else_ = literal("current"))
+
+
+def bump(location_id, cert_id, bucket, delta):
+    """Add delta to one summary count, creating the row if needed"""
+
+    table = ComplianceSummary.__table__
+    where = and_(table.c.location_id == location_id, table.c.cert_id == cert_id, table.c.bucket == bucket)
+
+    result = db.session.execute(table.update().where(where).values(count = table.c.count + delta))
+    if result.rowcount or delta < 0:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(location_id = location_id, cert_id = cert_id, bucket = bucket, count = delta))
+    except IntegrityError:
+        # another transaction created the row first
+        db.session.execute(table.update().where(where).values(count = table.c.count + delta))
+
+
+def _employee_locations(employee_id):
+    return [location_id for (location_id,) in db.session.query(employee_location.c.location_id)
+        .filter(employee_location.c.employee_id == employee_id)]
+
+
+def latest_due_date(employee_id, cert_id):
+    """(has_cert, latest due date) for one employee and cert"""
+
+    count, due_date = (db.session.query(func.count(employee_certification.id), func.max(employee_certification.due_date))
+        .filter(employee_certification.employee_id == employee_id, employee_certification.cert_id == cert_id)
+        .one())
+
+    return count > 0, due_date
+
+
+def cert_recorded(employee_id, cert_id, due_date, previous):
+    """Update counts after an employee_certification row was added.
+
+    previous is latest_due_date() as it was before the insert.
+    """
+
+    had_cert, old_due = previous
+    new_due = max(old_due, due_date) if old_due and due_date else (old_due or due_date)
+
+    old_bucket = bucket_for(old_due) if had_cert else None
+    new_bucket = bucket_for(new_due)
+    if old_bucket == new_bucket:
+        return
+
+    for location_id in _employee_locations(employee_id):
+        if old_bucket:
+            bump(location_id, cert_id, old_bucket, -1)
+        bump(location_id, cert_id, new_bucket, 1)
+
+
+def location_added(employee_id, location_id):
+    """Update counts after an employee was assigned to another location"""
+
+    latest = (db.session.query(employee_certification.cert_id, func.max(employee_certification.due_date))
+        .filter(employee_certification.employee_id == employee_id)
+        .group_by(employee_certification.cert_id))
+
+    for cert_id, due_date in latest:
+        bump(location_id, cert_id, bucket_for(due_date), 1)
+
+
+def rebuild(cert_id = None, today = None):
+    """Recompute the summary from emp_cert and emp_loc in one INSERT ... SELECT.
+
+    With cert_id only that certification's rows are replaced (used after its
+    due dates were recomputed).
+    """
+
+    table = ComplianceSummary.__table__
+
+    latest = db.session.query(
+            employee_certification.employee_id.label("employee_id"),
+            employee_certification.cert_id.label("cert_id"),
+            func.max(employee_certification.due_date).label("due_date"))
+    if cert_id is not None:
+        latest = latest.filter(employee_certification.cert_id == cert_id)
+    latest = latest.group_by(employee_certification.employee_id, employee_certification.cert_id).subquery()
+
+    bucket = bucket_sql(latest.c.due_date, today)
+    counts = (db.session.query(employee_location.c.location_id, latest.c.cert_id, bucket, func.count())
+        .join(latest, latest.c.employee_id == employee_location.c.employee_id)
+        .group_by(employee_location.c.location_id, latest.c.cert_id, bucket))
+
+    delete = table.delete()
+    if cert_id is not None:
+        delete = delete.where(table.c.cert_id == cert_id)
+    db.session.execute(delete)
+    db.session.execute(table.insert().from_select(["location_id", "cert_id", "bucket", "count"], counts.subquery().select()))
+
+
+def site_summary():
+    """[(site_name, cert_name, {bucket: count})] straight from the summary table"""
+
+    rows = (db.session.query(Location.site_name, Cert.cert_name, ComplianceSummary.bucket, ComplianceSummary.count)
+        .join(Location, Location.id == ComplianceSummary.location_id)
+        .join(Cert, Cert.id == ComplianceSummary.cert_id)
+        .filter(ComplianceSummary.count > 0)
+        .order_by(Location.site_name, Cert.cert_name))
+
+    summary = OrderedDict()
+    for site_name, cert_name, bucket, count in rows:
+        summary.setdefault((site_name, cert_name), dict.fromkeys(BUCKETS, 0))[bucket] = count
+
+    return [(site_name, cert_name, counts) for (site_name, cert_name), counts in summary.items()]
+
+
+def init_app(app):
+    @app.cli.command("reconcile-compliance")
+    def reconcile_compliance():
+        """Rebuild the compliance summary table from scratch."""
+
+        rebuild()
+        db.session.commit()
+        click.echo(f"Compliance summary rebuilt: {ComplianceSummary.query.count()} rows")
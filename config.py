@@ -0,0 +1,89 @@
+"""Configuration profiles for create_app().
+
+Pick one by name ("development", "testing", "production") or let
+MYCERTS_CONFIG choose; it defaults to development when FLASK_ENV says so and
+to production otherwise. Values read from the environment here can still be
+overridden per app with create_app(profile, KEY = value).
+"""
+
+import os
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgres:///mycerts")
+    # read-only copy of the database for GET handlers and reports, see replicas.py
+    DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get("SECRET_KEY", "You can do this")
+
+    # flask_debugtoolbar is only imported when this is on
+    DEBUG_TOOLBAR = False
+    # Flask-Migrate pulls in alembic; web workers only need it for `flask db`
+    LOAD_MIGRATE = True
+
+    # connection pool for server databases; SQLite keeps SQLAlchemy's own pools
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = True
+
+    # serve the `flask build-assets` output (assets.py); off, templates link the plain static files
+    ASSETS_FINGERPRINT = True
+
+
+class DevelopmentConfig(Config):
+    SQLALCHEMY_ECHO = os.environ.get("SQLALCHEMY_ECHO") == "1"
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+    ASSETS_FINGERPRINT = False
+    # run background jobs inside `flask run`; elsewhere `flask jobs-worker` does
+    JOBS_WORKER_THREAD = os.environ.get("JOBS_WORKER_THREAD", "1") != "0"
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "sqlite://")
+    DATABASE_REPLICA_URL = os.environ.get("TEST_DATABASE_REPLICA_URL")
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    MAIL_SENDER_THREAD = False
+    JOBS_WORKER_THREAD = False
+    ASSETS_FINGERPRINT = False
+
+
+class ProductionConfig(Config):
+    LOAD_MIGRATE = False
+
+
+PROFILES = {
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+    "production": ProductionConfig,
+}
+
+
+def default_profile():
+    default = "development" if os.environ.get("FLASK_ENV") == "development" else "production"
+    return os.environ.get("MYCERTS_CONFIG", default)
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if uri.startswith("sqlite"):
+        return options
+
+    options.setdefault("pool_size", config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+    options.setdefault("pool_pre_ping", config["DB_POOL_PRE_PING"])
+    if uri.startswith("postgres"):
+        # psycopg2 batches executemany() into multi-row INSERT ... VALUES for the bulk loaders
+        options.setdefault("executemany_mode", "values")
+
+    return options
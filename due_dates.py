@@ -0,0 +1,107 @@
+"""Due-date engine for employee certifications.
+
+Periods are calendar-correct: adding months or years keeps the day of the
+month and clamps to the last day when the target month is shorter, the same
+rule Postgres uses for date + interval. recompute_due_dates() re-derives
+every stored due date for a cert in one UPDATE statement.
+"""
+
+import calendar
+from datetime import timedelta
+
+from sqlalchemy import Date, bindparam, case, cast, func, literal
+
+from models import db, employee_certification
+
+BATCH_SIZE = 5000
+
+
+def period_parts(good_for_time, good_for_unit):
+    """Split a cert validity period into (months, days)"""
+
+    if good_for_unit == "days":
+        return 0, good_for_time
+    if good_for_unit == "weeks":
+        return 0, good_for_time * 7
+    if good_for_unit == "months":
+        return good_for_time, 0
+
+    return good_for_time * 12, 0
+
+
+def add_months(start, months):
+    """start plus a number of calendar months, clamped to the end of the month"""
+
+    year, month = divmod(start.month - 1 + months, 12)
+    year += start.year
+    month += 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+
+    return start.replace(year = year, month = month, day = day)
+
+
+def due_date_for(cert, received):
+    """Due date of cert when issued on received, or None if it never expires"""
+
+    if not cert.expire or not cert.good_for_time:
+        return None
+
+    months, days = period_parts(cert.good_for_time, cert.good_for_unit)
+    if months:
+        return add_months(received, months)
+
+    return received + timedelta(days = days)
+
+
+def due_date_sql(cert, received):
+    """SQL expression computing the due date from the received column"""
+
+    months, days = period_parts(cert.good_for_time, cert.good_for_unit)
+    dialect = db.engine.dialect.name
+
+    if dialect == "postgresql":
+        return cast(received + func.make_interval(0, months, 0, days), Date)
+
+    if dialect == "sqlite":
+        if days:
+            return func.date(received, literal(f"+{days} days"))
+        shifted = func.date(received, literal(f"+{months} months"))
+        # sqlite rolls Jan 31 + 1 month over to Mar 3; clamp to the month end instead
+        month_end = func.date(received, literal("start of month"), literal(f"+{months + 1} months"), literal("-1 day"))
+        return case(
+            [(func.strftime("%d", shifted) == func.strftime("%d", received), shifted)],
+            else_ = month_end)
+
+    return None
+
+
+def recompute_due_dates(cert):
+    """Re-derive due_date for every employee_certification row of cert.
+
+    One set-based UPDATE on Postgres and SQLite; other databases fall back to
+    computing dates in Python and writing them back in executemany batches.
+    Returns the number of rows updated.
+    """
+
+    table = employee_certification.__table__
+
+    if not cert.expire or not cert.good_for_time:
+        result = db.session.execute(table.update().where(table.c.cert_id == cert.id).values(due_date = None))
+        return result.rowcount
+
+    expression = due_date_sql(cert, table.c.received)
+    if expression is not None:
+        result = db.session.execute(table.update().where(table.c.cert_id == cert.id).values(due_date = expression))
+        return result.rowcount
+
+    update = (table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(due_date = bindparam("new_due_date")))
+    rows = db.session.execute(db.select([table.c.id, table.c.received]).where(table.c.cert_id == cert.id)).fetchall()
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = [{"row_id": row_id, "new_due_date": due_date_for(cert, received)}
+            for row_id, received in rows[start:start + BATCH_SIZE]]
+        db.session.execute(update, batch)
+
+    return len(rows)
@@ -0,0 +1,86 @@
+"""Training enrollment with seat limits.
+
+A seat is taken with one conditional UPDATE:
+
+    UPDATE trainings SET seats_taken = seats_taken + 1
+    WHERE id = :id AND (capacity IS NULL OR seats_taken < capacity)
+
+The database re-checks the condition under the row lock, so concurrent
+enrollments in the same class queue only on that one row, for as long as
+their transaction lasts, and can never push seats_taken past capacity.
+Nothing else is locked. The unique (training_id, employee_id) constraint
+turns a double submit into a no-op instead of a second seat.
+
+Callers commit; each function works inside a savepoint so a refused
+enrollment leaves the rest of the session alone.
+"""
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Enrollment, Training
+
+ENROLLED = "enrolled"
+ALREADY_ENROLLED = "already enrolled"
+FULL = "full"
+NOT_FOUND = "not found"
+
+
+def _change_seats(training_id, delta, condition = None):
+    trainings = Training.__table__
+    update = (trainings.update()
+        .where(trainings.c.id == training_id)
+        # seat changes are not edits of the class; keep calendar ETags stable
+        .values(seats_taken = trainings.c.seats_taken + delta, updated_at = trainings.c.updated_at))
+    if condition is not None:
+        update = update.where(condition)
+
+    return db.session.execute(update).rowcount
+
+
+def enroll(training_id, employee_id):
+    """Take a seat in the training for the employee; returns ENROLLED, ALREADY_ENROLLED, FULL or NOT_FOUND"""
+
+    trainings = Training.__table__
+    seats = db.session.query(Training.capacity, Training.seats_taken).filter(Training.id == training_id).first()
+    if seats is None:
+        return NOT_FOUND
+    # once a class fills, the rest of a burst is turned away by this plain read
+    # instead of queueing for the row lock; the UPDATE below stays the real check
+    if seats.capacity is not None and seats.seats_taken >= seats.capacity:
+        enrolled = (db.session.query(Enrollment.id)
+            .filter(Enrollment.training_id == training_id, Enrollment.employee_id == employee_id).first())
+        return ALREADY_ENROLLED if enrolled else FULL
+
+    savepoint = db.session.begin_nested()
+    try:
+        # the insert goes first: a duplicate fails here before any seat is counted
+        db.session.execute(Enrollment.__table__.insert().values(training_id = training_id, employee_id = employee_id))
+    except IntegrityError:
+        savepoint.rollback()
+        return ALREADY_ENROLLED
+
+    if not _change_seats(training_id, 1, or_(trainings.c.capacity.is_(None), trainings.c.seats_taken < trainings.c.capacity)):
+        savepoint.rollback()
+        return FULL
+
+    savepoint.commit()
+    return ENROLLED
+
+
+def cancel(training_id, employee_id):
+    """Give the employee's seat back; returns True if they were enrolled"""
+
+    savepoint = db.session.begin_nested()
+    deleted = (Enrollment.query
+        .filter(Enrollment.training_id == training_id, Enrollment.employee_id == employee_id)
+        .delete(synchronize_session = False))
+    if deleted:
+        _change_seats(training_id, -1)
+    savepoint.commit()
+
+    return bool(deleted)
+
+
+def enrolled_training_ids(employee_id):
+    return {row[0] for row in db.session.query(Enrollment.training_id).filter(Enrollment.employee_id == employee_id)}
@@ -1,6 +1,7 @@
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, TimeField, SelectMultipleField, DateField, RadioField, IntegerField, SelectField
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, BooleanField, TimeField, SelectMultipleField, DateField, RadioField, IntegerField, SelectField, TextAreaField
 from wtforms.validators import InputRequired, Email, Optional, Length
 
 class Login_Form(FlaskForm):
@@ -21,7 +22,6 @@ class User_Form(FlaskForm):
     hire_date = DateField("Date of Hire", validators=[InputRequired()])
     location = SelectField("Location", validators=[InputRequired()], coerce = int, choices = []) ## choices are the location already added 
     certs = SelectField("Certifications (Select all that Apply)", validators=[InputRequired()], coerce= int) ## choices are the certifications already added
-    completed = IntegerField("Training Hours Completed", default = 0)
     required = IntegerField("Training Hours Required", validators=[InputRequired()])
 
 
@@ -46,6 +46,11 @@ class Training_Form(FlaskForm):
     hours = IntegerField("How many hours?", validators=[InputRequired()])
     date = DateField("Date training offered")
     time = TimeField("Time training offered")
+    capacity = IntegerField("Seats (leave blank for no limit)", validators=[Optional()])
+
+
+class Enroll_Form(FlaskForm):
+    """Enroll in or leave a training; only carries the CSRF token"""
 
 
 class Location_Form(FlaskForm):
@@ -84,10 +89,31 @@ class Add_Cert_Form(FlaskForm):
     received = DateField("Date Issued")
     #employees = SelectField("Employee", validators=[InputRequired()], coerce= int) ## choices are the certifications already added
 
+class Bulk_Cert_Form(FlaskForm):
+    """Record one certification for a location, a list of employees and/or a file of them"""
+
+    cert = SelectField("Certification", validators=[InputRequired()], coerce = int, choices = [])
+    received = DateField("Date Issued", validators=[InputRequired()])
+    location = SelectField("Everyone at Location", coerce = int, choices = []) ## 0 is no location
+    employees = TextAreaField("Usernames or Emails", validators=[Optional()])
+    file = FileField("Or a file with a username or email column (.csv or .xlsx)", validators=[FileAllowed(["csv", "xlsx"], "CSV or XLSX files only")])
+
+class Job_Form(FlaskForm):
+    """Start a background report or scan"""
+
+    action = SelectField("Run in the background", validators=[InputRequired()], choices = [])
+
 class Edit_Hours_Form(FlaskForm):
+    """Annual target, plus an optional ledger entry; negative hours correct an earlier entry"""
 
-    completed = IntegerField("Training Hours Completed", default = 0)
-    required = IntegerField("Training Hours Required", validators=[InputRequired()])
+    required = IntegerField("Training Hours Required per Year", validators=[InputRequired()])
+    training = SelectField("Training Attended", coerce = int, choices = []) ## 0 is an adjustment not tied to a class
+    hours = IntegerField("Hours to Add", validators=[Optional()])
+    earned_on = DateField("Date Earned", validators=[Optional()])
+    note = StringField("Note", validators=[Optional(), Length(max = 200)])
+
+class Record_Attendance_Form(FlaskForm):
+    """Only the CSRF token; crediting a class to its enrolled employees takes no input"""
 
 
 class Add_Loc_Form(FlaskForm):
@@ -104,4 +130,9 @@ class Reset_Pwd_Form(FlaskForm):
 class Email_Form(FlaskForm):
     """Email entered to search user"""
 
-    email = StringField("Email", validators=[InputRequired(), Email(message="Invalid Email"), Length(max = 50)])
\ No newline at end of file
+    email = StringField("Email", validators=[InputRequired(), Email(message="Invalid Email"), Length(max = 50)])
+
+class Import_Form(FlaskForm):
+    """Upload a CSV or XLSX file of employees"""
+
+    file = FileField("Employee file (.csv or .xlsx)", validators=[FileRequired(), FileAllowed(["csv", "xlsx"], "CSV or XLSX files only")])
@@ -0,0 +1,37 @@
+"""gunicorn settings for production.
+
+The app is imported once in the master (preload_app) and forked into the
+workers, so the interpreter, SQLAlchemy, WTForms and the templates are shared
+copy-on-write instead of loaded once per worker. Database connections are
+created lazily in each worker after the fork, as are the workers' bcrypt
+pools (BCRYPT_POOL_WORKERS processes each). Each worker runs GUNICORN_THREADS
+threads, so page views keep being served while a login waits on its pool.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    flask jobs-worker --concurrency 2
+
+The web workers do not run background jobs (JOBS_WORKER_THREAD is off outside
+development), so start `flask jobs-worker` next to gunicorn.
+
+GUNICORN_PRELOAD=0 turns preloading off (benchmarks/startup.py compares both).
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    # objects the master built are never freed in the workers; keeping the
+    # collector away from them stops it dirtying (and so copying) their pages
+    gc.collect()
+    gc.freeze()
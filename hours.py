@@ -0,0 +1,371 @@
+"""Training-hours ledger and its rollups.
+
+hours_ledger is append-only: a training attended, a certification earned, an
+admin adjustment or the opening balance carried over from the old `completed`
+column each add one row, and a correction is another row with negative hours.
+
+hours_rollup holds the ledger summed per employee and per location for three
+kinds of period: "all", the year ("2026") and the month ("2026-10"). record()
+bumps the matching rows in the same transaction as the entry, so a dashboard
+or year-to-date report reads a handful of primary-key rows no matter how long
+the ledger gets. A location's rollup counts every hour of the employees
+currently assigned to it. `flask rebuild-hours` recomputes the rollups from
+the ledger.
+
+An employee is credited for a training at most once: the ledger's unique
+(training_id, employee_id, source) index turns a second credit, say from two
+admins recording the same attendance, into "already credited". Cached hours
+series are dropped once the writing transaction commits, so no request can
+cache the old rollups again between the invalidation and the commit.
+"""
+
+from collections import Counter
+from datetime import date
+
+import click
+from sqlalchemy import and_, bindparam, event, func, literal_column, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from models import db, Enrollment, HoursEntry, HoursRollup, Location, employee_location
+import cache
+import hours_series
+
+TRAINING = "training"
+CERT = "cert"
+ADJUSTMENT = "adjustment"
+OPENING_BALANCE = "opening balance"
+
+ALL_TIME = "all"
+ROLLUP_COLUMNS = ["scope", "scope_id", "period", "hours", "entries"]
+BATCH_SIZE = 5000
+# a write touching more scopes than this drops every cached series at once
+INVALIDATE_EACH_LIMIT = 100
+# session.info key of the cache tags to invalidate when the session commits
+PENDING_KEY = "hours.invalidate"
+
+
+def periods_for(day):
+    """Rollup periods an entry earned on day counts toward"""
+
+    return [ALL_TIME, f"{day.year:04d}", f"{day.year:04d}-{day.month:02d}"]
+
+
+def period_sql(kind, column):
+    """SQL version of periods_for() for one kind of period: "all", "year" or "month" """
+
+    if kind == "all":
+        return literal_column(f"'{ALL_TIME}'")
+
+    postgres_format, sqlite_format = {"year": ("YYYY", "%Y"), "month": ("YYYY-MM", "%Y-%m")}[kind]
+    if db.engine.dialect.name == "postgresql":
+        return func.to_char(column, literal_column(f"'{postgres_format}'"))
+    return func.strftime(literal_column(f"'{sqlite_format}'"), column)
+
+
+def bump(scope, scope_id, period, hours, entries = 1):
+    """Add to one rollup row, creating it if needed"""
+
+    table = HoursRollup.__table__
+    where = and_(table.c.scope == scope, table.c.scope_id == scope_id, table.c.period == period)
+    update = table.update().where(where).values(hours = table.c.hours + hours, entries = table.c.entries + entries)
+
+    if db.session.execute(update).rowcount:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(scope = scope, scope_id = scope_id, period = period,
+                hours = hours, entries = entries))
+    except IntegrityError:
+        # another transaction created the row first
+        db.session.execute(update)
+
+
+def _invalidate_on_commit(*tags):
+    db.session.info.setdefault(PENDING_KEY, set()).update(tags)
+
+
+def _changed(scopes):
+    """Drop the cached hours series of the (scope, scope_id) pairs just written, once they are committed"""
+
+    scopes = set(scopes)
+    if len(scopes) > INVALIDATE_EACH_LIMIT:
+        _invalidate_on_commit("hours")
+    else:
+        _invalidate_on_commit(*(hours_series.scope_tag(scope, scope_id) for scope, scope_id in scopes))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # releasing a savepoint commits too; wait for the real transaction
+    if session.transaction is not None and session.transaction.nested:
+        return
+    tags = session.info.pop(PENDING_KEY, None)
+    if tags:
+        cache.invalidate(*tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    if session.transaction is None or not session.transaction.nested:
+        session.info.pop(PENDING_KEY, None)
+
+
+def _employee_locations(employee_id):
+    return [location_id for (location_id,) in db.session.query(employee_location.c.location_id)
+        .filter(employee_location.c.employee_id == employee_id)]
+
+
+def record(employee_id, hours, earned_on, source, training_id = None, cert_id = None, note = None):
+    """Append a ledger entry and bump the employee's and their locations' rollups; callers commit.
+
+    Returns the entry, or None when the employee was already credited for the training.
+    """
+
+    entry = HoursEntry(employee_id, hours, earned_on, source, training_id = training_id, cert_id = cert_id, note = note)
+    if training_id is None:
+        db.session.add(entry)
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.add(entry)
+        except IntegrityError:
+            return None
+
+    scopes = [("employee", employee_id)] + [("location", location_id) for location_id in _employee_locations(employee_id)]
+    for period in periods_for(earned_on):
+        for scope, scope_id in scopes:
+            bump(scope, scope_id, period, hours)
+    _changed(scopes)
+
+    return entry
+
+
+def bump_many(deltas):
+    """bump() for many rows at once; deltas maps (scope, scope_id, period) to (hours, entries).
+
+    One SELECT per scope finds the rows that exist, then they are updated with
+    one executemany UPDATE and the rest created with one executemany INSERT.
+    """
+
+    if not deltas:
+        return
+
+    table = HoursRollup.__table__
+    existing = set()
+    lookup = (select([table.c.scope, table.c.scope_id, table.c.period])
+        .where(and_(table.c.scope == bindparam("scope"), table.c.scope_id.in_(bindparam("ids", expanding = True)),
+            table.c.period.in_(bindparam("periods", expanding = True)))))
+    for scope in sorted({key[0] for key in deltas}):
+        ids = sorted({key[1] for key in deltas if key[0] == scope})
+        periods = sorted({key[2] for key in deltas if key[0] == scope})
+        for start in range(0, len(ids), BATCH_SIZE):
+            existing.update(tuple(row) for row in
+                db.session.execute(lookup, {"scope": scope, "ids": ids[start:start + BATCH_SIZE], "periods": periods}))
+
+    found = [key for key in deltas if key in existing]
+    missing = [key for key in deltas if key not in existing]
+
+    if found:
+        update = (table.update()
+            .where(and_(table.c.scope == bindparam("b_scope"), table.c.scope_id == bindparam("b_scope_id"),
+                table.c.period == bindparam("b_period")))
+            .values(hours = table.c.hours + bindparam("b_hours"), entries = table.c.entries + bindparam("b_entries")))
+        db.session.execute(update, [{"b_scope": scope, "b_scope_id": scope_id, "b_period": period,
+            "b_hours": deltas[scope, scope_id, period][0], "b_entries": deltas[scope, scope_id, period][1]}
+            for scope, scope_id, period in found])
+
+    if missing:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), [dict(zip(ROLLUP_COLUMNS, key + deltas[key])) for key in missing])
+        except IntegrityError:
+            # another transaction created some of them first
+            for key in missing:
+                bump(*key, *deltas[key])
+
+
+def record_many(entries, new_employees = False):
+    """Bulk version of record() for a list of ledger rows given as column dicts.
+
+    Deltas are summed per rollup row first and applied with bump_many(). With
+    new_employees the employees cannot have rollup rows yet, so theirs are
+    written with one bulk insert.
+    """
+
+    if not entries:
+        return
+
+    db.session.execute(HoursEntry.__table__.insert(), entries)
+    employee_ids = sorted({entry["employee_id"] for entry in entries})
+
+    locations = {}
+    for start in range(0, len(employee_ids), BATCH_SIZE):
+        for employee_id, location_id in db.session.execute(
+                select([employee_location.c.employee_id, employee_location.c.location_id])
+                    .where(employee_location.c.employee_id.in_(bindparam("ids", expanding = True))),
+                {"ids": employee_ids[start:start + BATCH_SIZE]}):
+            locations.setdefault(employee_id, []).append(location_id)
+
+    employee_deltas, location_deltas = Counter(), Counter()
+    for entry in entries:
+        for period in periods_for(entry["earned_on"]):
+            employee_deltas["employee", entry["employee_id"], period] += entry["hours"]
+            employee_deltas["count", entry["employee_id"], period] += 1
+            for location_id in locations.get(entry["employee_id"], []):
+                location_deltas["location", location_id, period] += entry["hours"]
+                location_deltas["count", location_id, period] += 1
+
+    def paired(counter, scope):
+        return {key: (hours, counter["count", key[1], key[2]]) for key, hours in counter.items() if key[0] == scope}
+
+    employee_rows = paired(employee_deltas, "employee")
+    if new_employees:
+        table = HoursRollup.__table__
+        # scope_id has no foreign key, so rows of a deleted employee can outlive it on a reused id
+        for start in range(0, len(employee_ids), BATCH_SIZE):
+            db.session.execute(table.delete().where(and_(table.c.scope == "employee",
+                table.c.scope_id.in_(bindparam("ids", expanding = True)))), {"ids": employee_ids[start:start + BATCH_SIZE]})
+        db.session.execute(table.insert(), [dict(zip(ROLLUP_COLUMNS, key + delta)) for key, delta in employee_rows.items()])
+    else:
+        bump_many(employee_rows)
+    location_rows = paired(location_deltas, "location")
+    bump_many(location_rows)
+    _changed([("employee", employee_id) for employee_id in employee_ids] + [key[:2] for key in location_rows])
+
+
+def record_for_employees(employee_ids, hours, earned_on, source, training_id = None, cert_id = None, note = None):
+    """record() for many employees credited the same hours on the same day"""
+
+    record_many([{"employee_id": employee_id, "hours": hours, "earned_on": earned_on, "source": source,
+        "training_id": training_id, "cert_id": cert_id, "note": note} for employee_id in employee_ids])
+
+
+def record_cert(employee_id, cert, received = None):
+    """Credit the hours of a certification the employee just earned, if it carries any"""
+
+    if not cert.hours:
+        return None
+    return record(employee_id, cert.hours, received or date.today(), CERT, cert_id = cert.id)
+
+
+def attendees_to_credit(training_id):
+    """Employees enrolled in the training who have no ledger entry for it yet"""
+
+    credited = (db.session.query(HoursEntry.id)
+        .filter(HoursEntry.training_id == training_id, HoursEntry.employee_id == Enrollment.employee_id,
+            HoursEntry.source == TRAINING))
+
+    return [employee_id for (employee_id,) in db.session.query(Enrollment.employee_id)
+        .filter(Enrollment.training_id == training_id, ~credited.exists())
+        .order_by(Enrollment.employee_id)]
+
+
+def record_training(training, employee_ids):
+    """Credit the training's hours to each employee; returns how many were credited.
+
+    Employees credited meanwhile by another transaction count as already credited.
+    """
+
+    employee_ids = list(employee_ids)
+    while employee_ids:
+        try:
+            with db.session.begin_nested():
+                record_for_employees(employee_ids, training.hours, training.date, TRAINING, training_id = training.id)
+            return len(employee_ids)
+        except IntegrityError:
+            credited = {employee_id for (employee_id,) in db.session.query(HoursEntry.employee_id)
+                .filter(HoursEntry.training_id == training.id, HoursEntry.source == TRAINING)}
+            employee_ids = [employee_id for employee_id in employee_ids if employee_id not in credited]
+
+    return 0
+
+
+def location_added(employee_id, location_id):
+    """Update rollups after an employee was assigned to another location"""
+
+    rows = (db.session.query(HoursRollup.period, HoursRollup.hours, HoursRollup.entries)
+        .filter(HoursRollup.scope == "employee", HoursRollup.scope_id == employee_id))
+
+    for period, hours, entries in rows.all():
+        bump("location", location_id, period, hours, entries)
+    _changed([("location", location_id)])
+
+
+def employee_hours(employee_id, year = None):
+    """{"total", "year", "months"} hours for one employee, read from at most 14 rollup rows"""
+
+    year = year or date.today().year
+    rows = (db.session.query(HoursRollup.period, HoursRollup.hours)
+        .filter(HoursRollup.scope == "employee", HoursRollup.scope_id == employee_id,
+            or_(HoursRollup.period.in_([ALL_TIME, f"{year:04d}"]), HoursRollup.period.like(f"{year:04d}-%"))))
+
+    summary = {"total": 0, "year": 0, "months": [0] * 12}
+    for period, hours in rows:
+        if period == ALL_TIME:
+            summary["total"] = hours
+        elif len(period) == 4:
+            summary["year"] = hours
+        else:
+            summary["months"][int(period[5:]) - 1] = hours
+
+    return summary
+
+
+def site_hours(year = None):
+    """[(location_id, site_name, hours, entries)] for the year straight from the rollup table"""
+
+    year = year or date.today().year
+    return (db.session.query(Location.id, Location.site_name, HoursRollup.hours, HoursRollup.entries)
+        .join(HoursRollup, and_(HoursRollup.scope == "location", HoursRollup.scope_id == Location.id))
+        .filter(HoursRollup.period == f"{year:04d}")
+        .order_by(Location.site_name)
+        .all())
+
+
+def recent_entries(employee_id, limit = 10):
+    """The employee's newest ledger entries, newest first (served by ix_hours_ledger_employee_earned)"""
+
+    return (HoursEntry.query
+        .options(joinedload(HoursEntry.training), joinedload(HoursEntry.cert))
+        .filter(HoursEntry.employee_id == employee_id)
+        .order_by(HoursEntry.earned_on.desc(), HoursEntry.id.desc())
+        .limit(limit)
+        .all())
+
+
+def rebuild():
+    """Recompute every rollup from the ledger, one INSERT ... SELECT per scope and kind of period"""
+
+    table = HoursRollup.__table__
+    ledger = HoursEntry.__table__
+    db.session.execute(table.delete())
+
+    for kind in ("all", "year", "month"):
+        period = period_sql(kind, ledger.c.earned_on)
+        # a constant cannot appear in GROUP BY on Postgres
+        grouping = [] if kind == "all" else [period]
+
+        by_employee = (select([literal_column("'employee'"), ledger.c.employee_id, period,
+                func.sum(ledger.c.hours), func.count()])
+            .group_by(ledger.c.employee_id, *grouping))
+        by_location = (select([literal_column("'location'"), employee_location.c.location_id, period,
+                func.sum(ledger.c.hours), func.count()])
+            .select_from(ledger.join(employee_location, employee_location.c.employee_id == ledger.c.employee_id))
+            .group_by(employee_location.c.location_id, *grouping))
+
+        for query in (by_employee, by_location):
+            db.session.execute(table.insert().from_select(ROLLUP_COLUMNS, query))
+
+    _invalidate_on_commit("hours")
+
+
+def init_app(app):
+    @app.cli.command("rebuild-hours")
+    def rebuild_hours():
+        """Rebuild the training-hours rollups from the ledger."""
+
+        rebuild()
+        db.session.commit()
+        click.echo(f"Hours rollups rebuilt: {HoursRollup.query.count()} rows from {HoursEntry.query.count()} ledger entries")
@@ -0,0 +1,176 @@
+"""Training hours over time for charts.
+
+series() returns the hours one employee or one location earned per day, week
+or month between two dates. Month buckets come from the month rows of
+hours_rollup for the months the range covers whole; a partial first or last
+month, like day and week buckets, is one GROUP BY over hours_ledger, served
+by ix_hours_ledger_employee_earned. Empty buckets are filled with
+zeros, and when there are more buckets than the point budget, runs of
+neighbouring buckets are summed into one point, so a chart gets at most
+`points` points however long the range. A location counts the hours of the
+employees currently assigned to it, as its rollups do.
+
+Results are cached under the "hours" tag and a per-scope tag
+("hours:employee:12") that hours.py bumps when it writes the ledger.
+"""
+
+import math
+from datetime import date, timedelta
+
+from sqlalchemy import Date, and_, cast, func, literal_column, select
+
+from models import db, HoursEntry, HoursRollup, employee_location
+import cache
+
+SCOPES = ("employee", "location")
+BUCKETS = ("day", "week", "month")
+
+
+def scope_tag(scope, scope_id):
+    return f"hours:{scope}:{scope_id}"
+
+
+def tags(scope, scope_id):
+    return ["hours", scope_tag(scope, scope_id)]
+
+
+def bucket_start(bucket, day):
+    if bucket == "week":
+        return day - timedelta(days = day.weekday())
+    if bucket == "month":
+        return day.replace(day = 1)
+    return day
+
+
+def next_bucket(bucket, start):
+    if bucket == "week":
+        return start + timedelta(days = 7)
+    if bucket == "month":
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days = 1)
+
+
+def bucket_count(bucket, start, end):
+    start, end = bucket_start(bucket, start), bucket_start(bucket, end)
+    if bucket == "month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return (end - start).days // (7 if bucket == "week" else 1) + 1
+
+
+def choose_bucket(start, end, points):
+    """The finest bucket that fits the range into points, or months"""
+
+    for bucket in BUCKETS:
+        if bucket_count(bucket, start, end) <= points:
+            return bucket
+    return "month"
+
+
+def bucket_sql(bucket, column):
+    """SQL for the first day of column's bucket (weeks start on Monday)"""
+
+    if db.engine.dialect.name == "postgresql":
+        if bucket == "day":
+            return column
+        return cast(func.date_trunc(literal_column(f"'{bucket}'"), column), Date)
+
+    modifiers = {"day": [], "week": ["'weekday 0'", "'-6 days'"], "month": ["'start of month'"]}[bucket]
+    return func.date(column, *(literal_column(modifier) for modifier in modifiers))
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _ledger_buckets(scope, scope_id, bucket, start, end):
+    ledger = HoursEntry.__table__
+    period = bucket_sql(bucket, ledger.c.earned_on)
+    query = select([period, func.sum(ledger.c.hours)])
+
+    if scope == "employee":
+        query = query.where(ledger.c.employee_id == scope_id)
+    else:
+        query = (query.select_from(ledger.join(employee_location, employee_location.c.employee_id == ledger.c.employee_id))
+            .where(employee_location.c.location_id == scope_id))
+
+    query = query.where(and_(ledger.c.earned_on >= start, ledger.c.earned_on <= end)).group_by(period)
+    return {_as_date(start_day): hours for start_day, hours in db.session.execute(query)}
+
+
+def _rollup_months(scope, scope_id, start, end):
+    rows = (db.session.query(HoursRollup.period, HoursRollup.hours)
+        .filter(HoursRollup.scope == scope, HoursRollup.scope_id == scope_id,
+            HoursRollup.period >= f"{start.year:04d}-{start.month:02d}",
+            HoursRollup.period <= f"{end.year:04d}-{end.month:02d}",
+            HoursRollup.period.like("____-__")))
+    return {date(int(period[:4]), int(period[5:]), 1): hours for period, hours in rows}
+
+
+def _month_sums(scope, scope_id, start, end):
+    first = start if start.day == 1 else next_bucket("month", bucket_start("month", start))
+    stop = bucket_start("month", end + timedelta(days = 1))
+    if first >= stop:
+        return _ledger_buckets(scope, scope_id, "month", start, end)
+
+    sums = _rollup_months(scope, scope_id, first, stop - timedelta(days = 1))
+    # a rollup row holds the whole month, so the days of a partial month outside the range would count
+    if start < first:
+        sums.update(_ledger_buckets(scope, scope_id, "month", start, first - timedelta(days = 1)))
+    if stop <= end:
+        sums.update(_ledger_buckets(scope, scope_id, "month", stop, end))
+    return sums
+
+
+def downsample(buckets, points):
+    """Sum runs of neighbouring (start, hours) buckets so at most points remain; returns (points, width)"""
+
+    width = max(1, math.ceil(len(buckets) / points))
+    if width == 1:
+        return buckets, 1
+    return [(buckets[index][0], sum(hours for _, hours in buckets[index:index + width]))
+        for index in range(0, len(buckets), width)], width
+
+
+def build(scope, scope_id, start, end, bucket, points):
+    if bucket == "month":
+        sums = _month_sums(scope, scope_id, start, end)
+    else:
+        sums = _ledger_buckets(scope, scope_id, bucket, start, end)
+
+    buckets = []
+    current = bucket_start(bucket, start)
+    while current <= end:
+        buckets.append((current, sums.get(current, 0)))
+        current = next_bucket(bucket, current)
+    buckets, width = downsample(buckets, points)
+
+    cumulative, running = [], 0
+    for _, hours in buckets:
+        running += hours
+        cumulative.append(running)
+
+    return {"scope": scope, "id": scope_id, "bucket": bucket, "width": width,
+        "from": start.isoformat(), "to": end.isoformat(), "total": running,
+        "labels": [start_day.isoformat() for start_day, _ in buckets],
+        "hours": [hours for _, hours in buckets],
+        "cumulative": cumulative}
+
+
+def series(scope, scope_id, start, end, bucket = None, points = 120):
+    """{"labels", "hours", "cumulative", ...} for the scope between start and end, at most points long.
+
+    cumulative counts from start. bucket defaults to the finest that fits in
+    points; "width" says how many buckets each point sums after downsampling.
+    """
+
+    bucket = bucket or choose_bucket(start, end, points)
+    key = f"hours_series:{scope}:{scope_id}:{bucket}:{start}:{end}:{points}"
+
+    return cache.cached(key, tags(scope, scope_id), lambda: build(scope, scope_id, start, end, bucket, points))
+
+
+def init_app(app):
+    app.config.setdefault("HOURS_SERIES_DEFAULT_DAYS", 365)
+    app.config.setdefault("HOURS_SERIES_MAX_DAYS", 20 * 366)
+    app.config.setdefault("HOURS_SERIES_DEFAULT_POINTS", 120)
+    app.config.setdefault("HOURS_SERIES_MAX_POINTS", 1000)
@@ -0,0 +1,70 @@
+"""Cached identity for the logged-in employee.
+
+g.user is a lazy proxy: routes that never look at it never hit the database,
+and routes that do get a lightweight snapshot from a process-local TTL/LRU
+cache keyed by the employee id stored in the session. Routes that change a
+cached field call invalidate(); other worker processes pick the change up
+within IDENTITY_CACHE_TTL seconds.
+"""
+
+from collections import namedtuple
+
+from flask import session
+from werkzeug.local import LocalProxy
+
+import cache
+from models import db, Employee
+
+UserSnapshot = namedtuple("UserSnapshot", ["id", "username", "email", "first_name", "last_name", "is_admin"])
+
+
+snapshots = cache.LocalCache()
+
+
+def load_snapshot(employee_id):
+    """Return the UserSnapshot for employee_id, or None if there is no such employee"""
+
+    snapshot = snapshots.get(employee_id)
+    if snapshot is not None:
+        cache.state.stats["identity.hit"] += 1
+        return snapshot
+
+    cache.state.stats["identity.miss"] += 1
+
+    row = (db.session.query(*(getattr(Employee, field) for field in UserSnapshot._fields))
+        .filter(Employee.id == employee_id)
+        .first())
+    if row is None:
+        return None
+
+    snapshot = UserSnapshot(*row)
+    snapshots.set(employee_id, snapshot)
+
+    return snapshot
+
+
+def invalidate(employee_id):
+    """Drop a cached snapshot after the employee row changed"""
+
+    snapshots.delete(employee_id)
+
+
+def lazy_user(session_key):
+    """A proxy that loads the logged-in user's snapshot on first use within the request"""
+
+    # kept with the proxy, which is made per request, rather than in g: g lives
+    # in the app context, which outlasts the request when one is already pushed
+    loaded = []
+
+    def load():
+        if not loaded:
+            employee_id = session.get(session_key)
+            loaded.append(load_snapshot(employee_id) if employee_id is not None else None)
+        return loaded[0]
+
+    return LocalProxy(load)
+
+
+def init_app(app):
+    snapshots.maxsize = app.config.setdefault("IDENTITY_CACHE_SIZE", 2048)
+    snapshots.ttl = app.config.setdefault("IDENTITY_CACHE_TTL", 60)
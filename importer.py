@@ -0,0 +1,340 @@
+"""Bulk employee import from CSV or XLSX.
+
+Rows are streamed from the file in chunks. Each chunk is validated with the
+SignUp_Form rules, its passwords are hashed across a long-lived process pool,
+and the employees, their location and their certification (plus its hours in
+the training-hours ledger) are written with bulk inserts in a single
+transaction per chunk, together with the compliance summary counts the new
+rows add. Bad rows are reported with their row number and skipped; they never
+abort the rest of the import.
+
+Uploads from /ad/import are saved with save_upload() and imported by the
+import-employees background job, never inside the web request.
+
+Recognised columns (header matching ignores case, spaces, dashes and
+underscores): username, password, email, first_name, last_name, hire_date,
+is_admin, location (site name), cert (cert name) and received.
+"""
+
+import codecs
+import csv
+import io
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import click
+from werkzeug.datastructures import MultiDict
+
+from forms import SignUp_Form
+from models import db, Cert, Employee, Location, employee_certification, employee_location
+import compliance
+import due_dates
+import hours
+import passwords
+
+CHUNK_SIZE = 1000
+
+HEADER_ALIASES = {
+    "username": "username",
+    "password": "password",
+    "email": "email",
+    "firstname": "first_name",
+    "lastname": "last_name",
+    "hiredate": "hire_date",
+    "isadmin": "is_admin",
+    "admin": "is_admin",
+    "location": "location",
+    "sitename": "location",
+    "cert": "cert",
+    "certname": "cert",
+    "certification": "cert",
+    "received": "received",
+    "datereceived": "received",
+}
+
+TRUE_VALUES = {"1", "y", "yes", "true", "t", "x"}
+
+
+class _HashPool:
+    """One hashing pool per process, kept between imports instead of forked for each one"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._key = None
+
+    def get(self, workers):
+        with self._lock:
+            # a pool inherited across fork is unusable in the child
+            if self._executor is None or self._key != (os.getpid(), workers):
+                if self._executor is not None and self._key[0] == os.getpid():
+                    self._executor.shutdown(wait = False)
+                self._executor = ProcessPoolExecutor(max_workers = workers)
+                self._key = (os.getpid(), workers)
+            return self._executor
+
+
+_hash_pool = _HashPool()
+
+
+class ImportReport:
+    """Outcome of an import: how many rows loaded and why the others did not"""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    def error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+    @property
+    def rows_per_second(self):
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+
+def _normalize_header(name):
+    key = "".join(ch for ch in str(name or "").lower() if ch.isalnum())
+    return HEADER_ALIASES.get(key)
+
+
+def _cell(value):
+    """Cell value as the string a form field would receive"""
+
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _is_employee_header(names):
+    return "username" in names and "email" in names
+
+
+def _records(rows, is_header = _is_employee_header):
+    """Yield (row_number, dict) pairs, starting after the first header row found"""
+
+    header = None
+    for row_number, row in enumerate(rows, start = 1):
+        if header is None:
+            names = [_normalize_header(cell) for cell in row]
+            if is_header(names):
+                header = names
+            continue
+        values = [_cell(cell) for cell in row]
+        if not any(values):
+            continue
+        yield row_number, {name: value for name, value in zip(header, values) if name}
+
+
+def read_rows(stream, filename, is_header = _is_employee_header):
+    """Stream (row_number, dict) pairs out of a CSV or XLSX file object.
+
+    is_header decides, from a row's normalized column names, whether it is the
+    header row; the rows before it are skipped.
+    """
+
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            import openpyxl
+        except ImportError:
+            raise RuntimeError("Importing .xlsx files requires openpyxl (pip install openpyxl)")
+        workbook = openpyxl.load_workbook(stream, read_only = True, data_only = True)
+        return _records(workbook.active.iter_rows(values_only = True), is_header)
+
+    if isinstance(stream, io.TextIOBase):
+        lines = stream
+    else:
+        lines = codecs.iterdecode(stream, "utf-8-sig")
+    return _records(csv.reader(lines), is_header)
+
+
+def _validate(record):
+    """Run the SignUp_Form rules over one record; returns (data, error message)"""
+
+    formdata = MultiDict(record)
+    if formdata.get("is_admin", "").lower() in TRUE_VALUES:
+        formdata["is_admin"] = "y"
+    else:
+        formdata.pop("is_admin", None)
+
+    form = SignUp_Form(formdata = formdata, meta = {"csrf": False})
+    if not form.validate():
+        return None, "; ".join(f"{field}: {', '.join(errors)}" for field, errors in form.errors.items())
+
+    return form.data, None
+
+
+def _import_chunk(chunk, report, pool, rounds, locations, certs):
+    """Validate, hash and bulk insert one chunk of (row_number, record) pairs"""
+
+    valid = []
+    for row_number, record in chunk:
+        data, error = _validate(record)
+        if error:
+            report.error(row_number, error)
+            continue
+
+        location_name = record.get("location")
+        if location_name and location_name not in locations:
+            report.error(row_number, f"Unknown location {location_name!r}")
+            continue
+
+        cert_name = record.get("cert")
+        received = None
+        if cert_name:
+            if cert_name not in certs:
+                report.error(row_number, f"Unknown certification {cert_name!r}")
+                continue
+            try:
+                received = date.fromisoformat(record.get("received") or "")
+            except ValueError:
+                report.error(row_number, "received: Not a valid date value")
+                continue
+
+        valid.append((row_number, record, data, received))
+
+    # usernames and emails must be unique both inside the chunk and against the table
+    usernames = [data["username"] for _, _, data, _ in valid]
+    emails = [data["email"] for _, _, data, _ in valid]
+    taken = set()
+    if valid:
+        for username, email in (db.session.query(Employee.username, Employee.email)
+                .filter(db.or_(Employee.username.in_(usernames), Employee.email.in_(emails)))):
+            taken.update((("username", username), ("email", email)))
+
+    rows = []
+    for row_number, record, data, received in valid:
+        keys = (("username", data["username"]), ("email", data["email"]))
+        duplicate = [value for kind, value in keys if (kind, value) in taken]
+        if duplicate:
+            report.error(row_number, f"Already in use: {', '.join(duplicate)}")
+            continue
+        taken.update(keys)
+        rows.append((record, data, received))
+
+    if not rows:
+        return
+
+    hashes = pool.map(passwords.hash_with_cost, [data["password"] for _, data, _ in rows], [rounds] * len(rows),
+        chunksize = max(1, len(rows) // (os.cpu_count() or 1)))
+
+    db.session.execute(Employee.__table__.insert(), [{
+        "username": data["username"],
+        "password": hashed,
+        "email": data["email"],
+        "first_name": data["first_name"],
+        "last_name": data["last_name"],
+        "hire_date": data["hire_date"],
+        "is_admin": data["is_admin"],
+        } for (_, data, _), hashed in zip(rows, hashes)])
+
+    ids = dict(db.session.query(Employee.email, Employee.id).filter(Employee.email.in_([data["email"] for _, data, _ in rows])))
+
+    employee_locations = [{"employee_id": ids[data["email"]], "location_id": locations[record["location"]]}
+        for record, data, _ in rows if record.get("location")]
+    if employee_locations:
+        db.session.execute(employee_location.insert(), employee_locations)
+
+    # the employees are new, so each certified one at a site adds one to a single summary bucket
+    employee_certs, ledger, summary = [], [], Counter()
+    for record, data, received in rows:
+        if record.get("cert"):
+            cert = certs[record["cert"]]
+            due_date = due_dates.due_date_for(cert, received)
+            employee_certs.append({
+                "employee_id": ids[data["email"]],
+                "cert_id": cert.id,
+                "received": received,
+                "due_date": due_date})
+            if record.get("location"):
+                summary[locations[record["location"]], cert.id, compliance.bucket_for(due_date)] += 1
+            if cert.hours:
+                ledger.append({"employee_id": ids[data["email"]], "hours": cert.hours, "earned_on": received,
+                    "source": hours.CERT, "cert_id": cert.id})
+    if employee_certs:
+        db.session.execute(employee_certification.__table__.insert(), employee_certs)
+    hours.record_many(ledger, new_employees = True)
+
+    for (location_id, cert_id, bucket), count in summary.items():
+        compliance.bump(location_id, cert_id, bucket, count)
+
+    db.session.commit()
+    report.imported += len(rows)
+
+
+def import_employees(stream, filename, rounds = None, workers = None, chunk_size = CHUNK_SIZE, progress = None):
+    """Import employees from an open CSV/XLSX file; returns an ImportReport.
+
+    progress, if given, is called with the number of rows read after each chunk.
+    """
+
+    from flask import current_app
+
+    rounds = rounds or current_app.config.get("BCRYPT_LOG_ROUNDS", 12)
+    report = ImportReport()
+    started = time.perf_counter()
+
+    locations = dict(db.session.query(Location.site_name, Location.id))
+    certs = {cert.cert_name: cert for cert in Cert.query}
+    pool = _hash_pool.get(workers or current_app.config["IMPORT_HASH_WORKERS"])
+
+    chunk = []
+    read = 0
+    for item in read_rows(stream, filename):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, report, pool, rounds, locations, certs)
+            read += len(chunk)
+            chunk = []
+            if progress:
+                progress(read)
+    if chunk:
+        _import_chunk(chunk, report, pool, rounds, locations, certs)
+
+    report.elapsed = time.perf_counter() - started
+    report.errors.sort()
+
+    return report
+
+
+def save_upload(upload):
+    """Keep an uploaded file under JOBS_OUTPUT_DIR for the import job; returns its path"""
+
+    from flask import current_app
+
+    folder = os.path.join(current_app.config["JOBS_OUTPUT_DIR"], "uploads")
+    os.makedirs(folder, exist_ok = True)
+    path = os.path.join(folder, f"{uuid.uuid4().hex}{os.path.splitext(upload.filename)[1].lower()}")
+    upload.save(path)
+
+    return path
+
+
+def init_app(app):
+    app.config.setdefault("IMPORT_HASH_WORKERS", int(os.environ.get("IMPORT_HASH_WORKERS", os.cpu_count() or 1)))
+
+    @app.cli.command("import-employees")
+    @click.argument("path", type = click.Path(exists = True, dir_okay = False))
+    @click.option("--rounds", type = int, help = "bcrypt cost for the imported passwords; raised to BCRYPT_LOG_ROUNDS on first login.")
+    @click.option("--workers", type = int, help = "Hashing processes (default: one per CPU).")
+    def import_employees_command(path, rounds, workers):
+        """Bulk import employees from a CSV or XLSX file."""
+
+        with open(path, "rb") as stream:
+            report = import_employees(stream, path, rounds = rounds, workers = workers)
+
+        for row_number, message in report.errors:
+            click.echo(f"row {row_number}: {message}", err = True)
+        click.echo(f"Imported {report.imported} employees in {report.elapsed:.1f}s "
+            f"({report.rows_per_second:.0f}/s), {len(report.errors)} rows rejected")
@@ -0,0 +1,802 @@
+"""Background jobs.
+
+Work too slow for a request (due-date recomputes of very large certs, large
+bulk assignments, report exports, the nightly compliance and archive scans)
+is queued with enqueue(), which adds a row to the jobs table in the caller's
+transaction, as mailer.queue_email() does for email. Workers claim due rows and run the
+task registered for their kind with @task. In production run them as their
+own processes next to gunicorn:
+
+    flask jobs-worker --concurrency 2
+
+(the same command as `flask jobs work`). JOBS_WORKER_THREAD starts a worker
+thread inside the web process instead; it is on only in the development
+profile, or wherever JOBS_WORKER_THREAD=1 is set.
+
+Claiming a job is one short transaction. On Postgres it is SELECT ... FOR
+UPDATE SKIP LOCKED, so workers never wait on each other's rows; elsewhere
+(SQLite) a worker picks candidates and claims one with a conditional
+UPDATE ... WHERE status = 'queued', which only one worker can win. The task
+then runs in its own transactions while a heartbeat thread records its
+progress. A job whose heartbeat stops for JOBS_STALE_SECONDS, because its
+worker died, is queued again, so tasks must be safe to run twice. Failures
+retry with exponential backoff up to the job's max_attempts and then stay
+failed with the error. On SQLite a task's open write transaction holds the
+database lock, so the heartbeat thread cannot write while it is open; the
+lease is then renewed inside the task's own transaction just before each of
+its commits, so a task that writes for longer than JOBS_STALE_SECONDS is not
+taken for dead the moment it releases the lock.
+
+JOBS_SCHEDULE maps a name to a cron expression ("minute hour day month
+weekday", weekday 0 is Sunday, times in UTC), a kind and its args. Workers
+check it every JOBS_SCHEDULE_INTERVAL seconds and queue each due slot once:
+the unique (schedule, scheduled_for) key lets only one of them insert it.
+Slots missed while no worker ran are caught up with a single run.
+
+Caches are process-local unless CACHE_REDIS_URL is set, so web workers only
+see a job's cache invalidations through Redis or after the TTL.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Cert, Job, employee_certification
+import cache
+import cert_archive
+import cert_assignment
+import compliance
+import due_dates
+import forecast
+import hours
+import importer
+import replicas
+import reports
+
+log = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# due jobs a worker tries to claim per poll where SKIP LOCKED is unavailable
+CLAIM_CANDIDATES = 5
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# session.info key of the Heartbeat that renews its job's lease in each of the session's commits
+LEASE_KEY = "jobs.lease"
+EXPORT_FORMATS = ("csv", "xlsx")
+# rejected rows an import job keeps in its result for the import page
+IMPORT_ERRORS_KEPT = 500
+
+DEFAULTS = {
+    # the development profile turns this on; production runs `flask jobs-worker`
+    "JOBS_WORKER_THREAD": os.environ.get("JOBS_WORKER_THREAD") == "1",
+    "JOBS_POLL_INTERVAL": 2.0,
+    "JOBS_HEARTBEAT_SECONDS": 5,
+    "JOBS_STALE_SECONDS": 300,
+    "JOBS_MAX_ATTEMPTS": 3,
+    "JOBS_RETRY_BASE": 30,
+    "JOBS_RETRY_MAX": 3600,
+    "JOBS_SCHEDULE_INTERVAL": 30,
+    "JOBS_KEEP_DAYS": 30,
+    "JOBS_METRICS_HOURS": 24,
+    # bulk assignments to more employees than this go to a job instead of running in the request
+    "JOBS_ASSIGN_INLINE_LIMIT": 2000,
+    # due dates of certs held more times than this are recomputed by a job instead of in the request
+    "JOBS_RECOMPUTE_INLINE_LIMIT": 200000,
+    "JOBS_SCHEDULE": {
+        "reconcile-compliance": {"cron": "0 2 * * *", "kind": "reconcile-compliance"},
+        "archive-certs": {"cron": "30 2 * * *", "kind": "archive-certs"},
+        "prune-jobs": {"cron": "0 4 * * *", "kind": "prune-jobs"},
+    },
+}
+
+# what an admin can start from /administrator/jobs: action -> (label, kind, args)
+ADMIN_ACTIONS = {
+    "export-csv": ("Export certifications as CSV", "export-compliance", {"fmt": "csv"}),
+    "export-xlsx": ("Export certifications as Excel", "export-compliance", {"fmt": "xlsx"}),
+    "forecast-csv": ("Weekly renewal forecast as CSV", "forecast-csv", {"by": "location"}),
+    "reconcile-compliance": ("Rebuild the compliance summary", "reconcile-compliance", {}),
+    "rebuild-hours": ("Rebuild the training-hours rollups", "rebuild-hours", {}),
+    "archive-certs": ("Archive old certification records", "archive-certs", {}),
+}
+
+TASKS = {}
+
+
+def task(kind, max_attempts = None):
+    """Register function(run, **args) as the task for kind; its return value is stored as the job's result"""
+
+    def register(function):
+        TASKS[kind] = (function, max_attempts)
+        return function
+
+    return register
+
+
+def _new_job(kind, args, **fields):
+    if kind not in TASKS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    max_attempts = TASKS[kind][1] or current_app.config["JOBS_MAX_ATTEMPTS"]
+
+    return Job(kind, json.dumps(args, default = str), max_attempts = max_attempts, **fields)
+
+
+def enqueue(kind, run_at = None, created_by = None, **args):
+    """Queue a job of kind with keyword args. Nothing runs until the caller commits."""
+
+    job = _new_job(kind, args, run_at = run_at, created_by = created_by)
+    db.session.add(job)
+
+    return job
+
+
+def output_path(job_id, extension):
+    """Where a job writes its report file"""
+
+    return os.path.join(current_app.config["JOBS_OUTPUT_DIR"], f"job-{job_id}.{extension}")
+
+
+def result_of(job):
+    return json.loads(job.result) if job.result else None
+
+
+def describe(job):
+    """A job as JSON for the status endpoints"""
+
+    return {"id": job.id, "kind": job.kind, "args": json.loads(job.args), "status": job.status,
+        "progress": job.progress, "message": job.message, "attempts": job.attempts, "max_attempts": job.max_attempts,
+        "result": result_of(job), "error": job.last_error, "schedule": job.schedule,
+        "created_at": job.created_at, "run_at": job.run_at, "started_at": job.started_at,
+        "finished_at": job.finished_at}
+
+
+class JobRun:
+    """What a running task sees: its job id and a way to report progress"""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.attempt = job.attempts
+        self.percent = 0
+        self.message = None
+        self._lock = threading.Lock()
+
+    def progress(self, done, total = None, message = None):
+        """Record progress as done out of total, or as a percentage when total is None"""
+
+        percent = done if total is None else (100 * done // total if total else 100)
+        with self._lock:
+            # 100 is kept for the moment the job is recorded as done
+            self.percent = max(0, min(99, int(percent)))
+            if message is not None:
+                self.message = message[:200]
+
+    def snapshot(self):
+        with self._lock:
+            return self.percent, self.message
+
+
+class Heartbeat(threading.Thread):
+    """Writes a running job's heartbeat and progress every few seconds on a connection of its own"""
+
+    def __init__(self, engine, job_id, worker, job_run, interval):
+        super().__init__(name = f"job-{job_id}-heartbeat", daemon = True)
+        self.engine = engine
+        self.job_id = job_id
+        self.worker = worker
+        self.job_run = job_run
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def update(self):
+        percent, message = self.job_run.snapshot()
+        table = Job.__table__
+        return (table.update()
+            .where(and_(table.c.id == self.job_id, table.c.worker == self.worker, table.c.status == RUNNING))
+            .values(heartbeat_at = datetime.utcnow(), progress = percent, message = message))
+
+    def beat(self):
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.update())
+        except Exception as exc:
+            log.warning("Heartbeat for job %s failed: %s", self.job_id, exc)
+
+    def renew(self, session):
+        """Beats inside session's transaction, for when it holds SQLite's write lock"""
+        session.execute(self.update())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _skip_locked():
+    return db.engine.dialect.name in ("postgresql", "mysql")
+
+
+def claim(worker, kinds = None):
+    """Claim the next due job for worker and commit; returns the Job or None"""
+
+    now = datetime.utcnow()
+    table = Job.__table__
+    due = Job.query.with_entities(Job.id).filter(Job.status == QUEUED, Job.run_at <= now)
+    if kinds:
+        due = due.filter(Job.kind.in_(kinds))
+    due = due.order_by(Job.run_at, Job.id)
+
+    if _skip_locked():
+        # the row stays locked until the commit below, and other workers skip it
+        candidates = [job_id for (job_id,) in due.limit(1).with_for_update(skip_locked = True)]
+    else:
+        candidates = [job_id for (job_id,) in due.limit(CLAIM_CANDIDATES)]
+
+    for job_id in candidates:
+        claimed = db.session.execute(table.update()
+            .where(and_(table.c.id == job_id, table.c.status == QUEUED))
+            .values(status = RUNNING, worker = worker, attempts = table.c.attempts + 1, progress = 0, message = None,
+                started_at = now, heartbeat_at = now, finished_at = None))
+        db.session.commit()
+        if claimed.rowcount:
+            return Job.query.get(job_id)
+
+    db.session.rollback()
+    return None
+
+
+def _record(job_id, worker, values):
+    """Write a finished run's outcome, unless the job was meanwhile given to another worker"""
+
+    table = Job.__table__
+    db.session.execute(table.update()
+        .where(and_(table.c.id == job_id, table.c.worker == worker, table.c.status == RUNNING))
+        .values(values))
+    db.session.commit()
+
+
+@event.listens_for(Session, "before_commit")
+def _renew_lease(session):
+    heartbeat = session.info.get(LEASE_KEY)
+    if heartbeat is not None and not session.transaction.nested:
+        heartbeat.renew(session)
+
+
+def requeue_stale(now = None):
+    """Queue again, or fail when out of attempts, the running jobs whose worker stopped heartbeating"""
+
+    now = now or datetime.utcnow()
+    table = Job.__table__
+    stale = and_(table.c.status == RUNNING,
+        table.c.heartbeat_at < now - timedelta(seconds = current_app.config["JOBS_STALE_SECONDS"]))
+    error = "Worker stopped responding"
+
+    retried = db.session.execute(table.update()
+        .where(and_(stale, table.c.attempts < table.c.max_attempts))
+        .values(status = QUEUED, worker = None, run_at = now, last_error = error)).rowcount
+    failed = db.session.execute(table.update()
+        .where(stale)
+        .values(status = FAILED, finished_at = now, last_error = error)).rowcount
+    db.session.commit()
+
+    if retried or failed:
+        log.warning("Requeued %s and failed %s jobs whose worker stopped responding", retried, failed)
+    return retried + failed
+
+
+class Cron:
+    """A five-field cron expression: minute hour day month weekday"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression!r} needs five fields")
+
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS))
+        # 0 and 7 are both Sunday
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start, end = (int(value) for value in spec.split("-", 1))
+            else:
+                # "5/15" runs from 5 to the end of the range
+                start = int(spec)
+                end = high if step else start
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Cron field {field!r} is out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+
+        return values
+
+    def matches_day(self, day):
+        weekday = (day.weekday() + 1) % 7
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return weekday in self.weekdays
+        if self.any_weekday:
+            return day.day in self.days
+        # as in cron, restricting both matches either
+        return day.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """The first matching minute after moment"""
+
+        moment = moment.replace(second = 0, microsecond = 0) + timedelta(minutes = 1)
+        limit = moment + timedelta(days = 5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+            elif not self.matches_day(moment):
+                moment = datetime(moment.year, moment.month, moment.day) + timedelta(days = 1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute = 0) + timedelta(hours = 1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes = 1)
+            else:
+                return moment
+
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+
+def due_slot(cron, previous, now, grace):
+    """The latest slot of cron after previous (or in the last grace seconds) that is due by now, or None"""
+
+    slot = cron.next_after(previous or now - timedelta(seconds = grace))
+    if slot > now:
+        return None
+    following = cron.next_after(slot)
+    while following <= now:
+        slot, following = following, cron.next_after(following)
+
+    return slot
+
+
+def schedule_due(now = None):
+    """Queue each JOBS_SCHEDULE entry's due slot; returns the jobs this call queued"""
+
+    now = now or datetime.utcnow()
+    config = current_app.config
+    entries = config["JOBS_SCHEDULE"]
+    if not entries:
+        return []
+
+    last = dict(db.session.query(Job.schedule, func.max(Job.scheduled_for))
+        .filter(Job.schedule.in_(list(entries)))
+        .group_by(Job.schedule))
+    db.session.rollback()
+
+    queued = []
+    for name, entry in entries.items():
+        slot = due_slot(Cron(entry["cron"]), last.get(name), now, 2 * config["JOBS_SCHEDULE_INTERVAL"])
+        if slot is None:
+            continue
+        job = _new_job(entry["kind"], entry.get("args", {}), schedule = name, scheduled_for = slot)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker queued this slot first
+            db.session.rollback()
+            continue
+        queued.append(job)
+        log.info("Queued %s for the %s slot of schedule %s", job.kind, slot, name)
+
+    return queued
+
+
+class JobWorker:
+    """Claims due jobs one at a time and runs them"""
+
+    def __init__(self, app, name = None, kinds = None, schedule = True):
+        self.app = app
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.kinds = kinds
+        self.schedule = schedule
+        self._next_housekeeping = 0.0
+
+    def retry_delay(self, attempts):
+        """Exponential backoff, capped at JOBS_RETRY_MAX seconds"""
+
+        config = self.app.config
+        return min(config["JOBS_RETRY_BASE"] * 2 ** (attempts - 1), config["JOBS_RETRY_MAX"])
+
+    def housekeeping(self):
+        """Requeue stale jobs and queue scheduled ones, at most every JOBS_SCHEDULE_INTERVAL seconds"""
+
+        if time.monotonic() < self._next_housekeeping:
+            return
+        self._next_housekeeping = time.monotonic() + self.app.config["JOBS_SCHEDULE_INTERVAL"]
+        requeue_stale()
+        if self.schedule:
+            schedule_due()
+
+    def run_one(self):
+        """Claim and run one due job. Returns its id, or None when nothing was due."""
+
+        job = claim(self.name, self.kinds)
+        if job is None:
+            return None
+
+        job_id, kind, attempts, max_attempts = job.id, job.kind, job.attempts, job.max_attempts
+        args = json.loads(job.args)
+        job_run = JobRun(job)
+        heartbeat = Heartbeat(db.engine, job_id, self.name, job_run, self.app.config["JOBS_HEARTBEAT_SECONDS"])
+        heartbeat.start()
+        if db.engine.dialect.name == "sqlite":
+            db.session.info[LEASE_KEY] = heartbeat
+
+        try:
+            if kind not in TASKS:
+                raise LookupError(f"No task registered for {kind!r}")
+            result = TASKS[kind][0](job_run, **args)
+        except Exception as exc:
+            log.exception("Job %s (%s) failed", job_id, kind)
+            db.session.info.pop(LEASE_KEY, None)
+            db.session.rollback()
+            heartbeat.stop()
+            now = datetime.utcnow()
+            values = {"last_error": f"{type(exc).__name__}: {exc}", "message": job_run.message}
+            if attempts >= max_attempts:
+                values.update(status = FAILED, finished_at = now)
+            else:
+                values.update(status = QUEUED, worker = None, run_at = now + timedelta(seconds = self.retry_delay(attempts)))
+            _record(job_id, self.name, values)
+        else:
+            db.session.info.pop(LEASE_KEY, None)
+            heartbeat.stop()
+            _record(job_id, self.name, {"status": DONE, "progress": 100, "message": job_run.message, "last_error": None,
+                "result": json.dumps(result, default = str) if result is not None else None,
+                "finished_at": datetime.utcnow()})
+
+        return job_id
+
+    def run(self, stop = None, once = False):
+        """Run jobs until stop is set; once stops as soon as nothing is due"""
+
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.housekeeping()
+                    job_id = self.run_one()
+                except Exception:
+                    log.exception("Job worker %s failed", self.name)
+                    db.session.rollback()
+                    job_id = None
+                finally:
+                    db.session.remove()
+
+            if once and job_id is None:
+                break
+            if job_id is None:
+                stop.wait(self.app.config["JOBS_POLL_INTERVAL"])
+
+
+def start_worker_thread(app):
+    """Run a JobWorker in a daemon thread of this process"""
+
+    stop = threading.Event()
+    worker = JobWorker(app, f"{socket.gethostname()}:{os.getpid()}:web")
+    thread = threading.Thread(target = worker.run, kwargs = {"stop": stop}, name = "job-worker", daemon = True)
+    thread.start()
+
+    return stop
+
+
+def _timings(values):
+    """p50, p95 and max of values in milliseconds"""
+
+    if not values:
+        return None
+    values = sorted(values)
+    at = lambda fraction: round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000)
+
+    return {"p50": at(0.5), "p95": at(0.95), "max": round(values[-1] * 1000)}
+
+
+def metrics(window_hours = None, now = None):
+    """Per kind: jobs finished and failed in the last window_hours, throughput, queue wait and run time,
+    and what is queued and running now"""
+
+    now = now or datetime.utcnow()
+    window_hours = window_hours or current_app.config["JOBS_METRICS_HOURS"]
+    kinds = {}
+
+    def entry(kind):
+        return kinds.setdefault(kind, {"kind": kind, "done": 0, "failed": 0, "retries": 0, "queued": 0, "running": 0,
+            "oldest_queued_seconds": None, "waits": [], "runs": []})
+
+    finished = (db.session.query(Job.kind, Job.status, Job.attempts, Job.run_at, Job.started_at, Job.finished_at)
+        .filter(Job.finished_at >= now - timedelta(hours = window_hours)))
+    for kind, status, attempts, run_at, started_at, finished_at in finished:
+        stats = entry(kind)
+        stats[status] = stats.get(status, 0) + 1
+        stats["retries"] += attempts - 1
+        if started_at:
+            stats["waits"].append(max(0.0, (started_at - run_at).total_seconds()))
+            stats["runs"].append((finished_at - started_at).total_seconds())
+
+    waiting = (db.session.query(Job.kind, Job.status, func.count(), func.min(Job.run_at))
+        .filter(Job.status.in_([QUEUED, RUNNING]))
+        .group_by(Job.kind, Job.status))
+    for kind, status, count, oldest in waiting:
+        stats = entry(kind)
+        stats[status] = count
+        if status == QUEUED:
+            stats["oldest_queued_seconds"] = max(0, round((now - oldest).total_seconds()))
+
+    for stats in kinds.values():
+        stats["per_hour"] = round(stats["done"] / window_hours, 2)
+        stats["wait_ms"] = _timings(stats.pop("waits"))
+        stats["run_ms"] = _timings(stats.pop("runs"))
+
+    return {"window_hours": window_hours, "kinds": [kinds[kind] for kind in sorted(kinds)]}
+
+
+def recent(limit = 50):
+    return Job.query.order_by(Job.id.desc()).limit(limit).all()
+
+
+@task("recompute-due-dates")
+def recompute_due_dates(run, cert_id):
+    """Re-derive every due date of a cert too large to recompute in the edit request"""
+
+    cert = Cert.query.get(cert_id)
+    if cert is None:
+        return None
+    run.progress(0, message = f"Recomputing due dates of {cert.cert_name}")
+    rows = due_dates.recompute_due_dates(cert)
+    run.progress(50, message = "Rebuilding the compliance summary")
+    compliance.rebuild(cert_id = cert.id)
+    db.session.commit()
+    cache.invalidate("certs")
+
+    return {"rows": rows}
+
+
+@task("assign-cert")
+def assign_cert(run, cert_id, received, employee_ids):
+    """Bulk assignment too large for the request"""
+
+    cert = Cert.query.get(cert_id)
+    if cert is None:
+        return None
+    progress = lambda done, total: run.progress(done, total, f"{done} of {total} employees")
+    report = cert_assignment.assign(cert, date.fromisoformat(received), employee_ids, progress = progress)
+    db.session.commit()
+    cache.invalidate("certs")
+
+    return {"assigned": report.assigned, "already": report.already, "seconds": round(report.elapsed, 2)}
+
+
+@task("export-compliance")
+def export_compliance(run, fmt = "csv"):
+    """The certification export of /administrator/export, written to a file to download later"""
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+
+    def counted(rows, total):
+        for count, row in enumerate(rows, start = 1):
+            if count % reports.EXPORT_BATCH == 0:
+                run.progress(count, total, f"{count} rows")
+            yield row
+
+    path = output_path(run.job_id, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with replicas.use_replica():
+        # an estimate: employees at several sites get a row per site
+        total = db.session.query(func.count(employee_certification.id)).scalar()
+        rows = counted(reports.compliance_export_rows(), total)
+        body = reports.stream_csv(rows) if fmt == "csv" else reports.stream_xlsx(rows)
+        with open(path + ".part", "wb") as stream:
+            for chunk in body:
+                stream.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    os.replace(path + ".part", path)
+
+    return {"file": os.path.basename(path), "filename": f"certifications-{date.today().isoformat()}.{fmt}",
+        "bytes": os.path.getsize(path)}
+
+
+@task("forecast-csv")
+def forecast_csv(run, by = "location"):
+    """The weekly renewal forecast histogram as a CSV file"""
+
+    if by not in forecast.GROUPS:
+        raise ValueError(f"Unknown forecast grouping {by!r}")
+    config = current_app.config
+
+    with replicas.use_replica():
+        table = forecast.load()
+        run.progress(50, message = f"{len(table)} standings loaded")
+        result = forecast.forecast(table, by, weeks = config["FORECAST_WEEKS"], window = config["FORECAST_WINDOW"])
+
+    path = output_path(run.job_id, "csv")
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w", newline = "") as stream:
+        forecast.write_weekly_csv(result, stream)
+
+    return {"file": os.path.basename(path), "filename": f"forecast-{by}-{date.today().isoformat()}.csv",
+        "groups": len(result.keys)}
+
+
+@task("import-employees", max_attempts = 1)
+def import_employees(run, path, filename):
+    """An uploaded employee file; the upload is deleted once it has been read"""
+
+    size = os.path.getsize(path)
+    try:
+        with open(path, "rb") as stream:
+            progress = lambda rows: run.progress(stream.tell(), size, f"{rows} rows read")
+            report = importer.import_employees(stream, filename, progress = progress)
+    finally:
+        os.remove(path)
+    cache.invalidate("certs")
+
+    return {"imported": report.imported, "rejected": len(report.errors), "seconds": round(report.elapsed, 2),
+        "errors": report.errors[:IMPORT_ERRORS_KEPT]}
+
+
+@task("reconcile-compliance")
+def reconcile_compliance(run):
+    compliance.rebuild()
+    db.session.commit()
+
+
+@task("rebuild-hours")
+def rebuild_hours(run):
+    hours.rebuild()
+    db.session.commit()
+
+
+@task("archive-certs")
+def archive_certs(run):
+    # archive() commits each batch itself
+    return dict(cert_archive.archive())
+
+
+@task("prune-jobs")
+def prune_jobs(run):
+    """Delete finished jobs older than JOBS_KEEP_DAYS, and their files"""
+
+    cutoff = datetime.utcnow() - timedelta(days = current_app.config["JOBS_KEEP_DAYS"])
+    old = Job.query.filter(Job.status.in_([DONE, FAILED]), Job.finished_at < cutoff)
+
+    for (result,) in old.with_entities(Job.result):
+        name = (json.loads(result) or {}).get("file") if result else None
+        if name:
+            try:
+                os.remove(os.path.join(current_app.config["JOBS_OUTPUT_DIR"], name))
+            except FileNotFoundError:
+                pass
+
+    deleted = old.delete(synchronize_session = False)
+    db.session.commit()
+
+    return {"deleted": deleted}
+
+
+def _parse_args(pairs):
+    args = {}
+    for pair in pairs:
+        key, separator, value = pair.partition("=")
+        if not separator:
+            raise click.BadParameter(f"{pair!r} is not key=value")
+        try:
+            args[key] = json.loads(value)
+        except ValueError:
+            args[key] = value
+    return args
+
+
+def init_app(app):
+    """Apply job config defaults, check the schedule, register the CLI commands and start the worker thread"""
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.config.setdefault("JOBS_OUTPUT_DIR", os.environ.get("JOBS_OUTPUT_DIR", os.path.join(app.instance_path, "jobs")))
+
+    for name, entry in app.config["JOBS_SCHEDULE"].items():
+        Cron(entry["cron"])
+        if entry["kind"] not in TASKS:
+            raise ValueError(f"Schedule {name!r} runs unknown job kind {entry['kind']!r}")
+
+    @app.cli.group("jobs")
+    def jobs_command():
+        """Background jobs."""
+
+    @jobs_command.command("work")
+    @click.option("--concurrency", "-c", type = int, default = 1, show_default = True, help = "Worker threads.")
+    @click.option("--kind", "kinds", multiple = True, help = "Only run jobs of this kind (repeatable).")
+    @click.option("--once", is_flag = True, help = "Run what is due and exit.")
+    @click.option("--no-schedule", is_flag = True, help = "Do not queue JOBS_SCHEDULE runs.")
+    def work(concurrency, kinds, once, no_schedule):
+        """Run queued jobs until interrupted; the production job runner."""
+
+        stop = threading.Event()
+        # finish the running job and exit on SIGTERM, as on Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        base = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [threading.Thread(target = JobWorker(app, f"{base}:{number}", kinds, not no_schedule).run,
+                kwargs = {"stop": stop, "once": once}, name = f"job-worker-{number}")
+            for number in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout = 1)
+        except KeyboardInterrupt:
+            click.echo("Stopping after the running jobs finish")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    # the name deployments start the runner by, next to gunicorn
+    app.cli.add_command(work, "jobs-worker")
+
+    @jobs_command.command("enqueue")
+    @click.argument("kind", type = click.Choice(sorted(TASKS)))
+    @click.argument("args", nargs = -1)
+    def enqueue_command(kind, args):
+        """Queue a job; ARGS are key=value pairs, values parsed as JSON where they can be."""
+
+        job = enqueue(kind, **_parse_args(args))
+        db.session.commit()
+        click.echo(f"Queued job {job.id} ({kind})")
+
+    @jobs_command.command("stats")
+    def stats_command():
+        """Queue depth, throughput and timings per job kind."""
+
+        summary = metrics()
+        click.echo(f"Last {summary['window_hours']} hours")
+        click.echo(f"{'kind':<22} {'queued':>6} {'running':>7} {'done':>6} {'failed':>6} {'per hr':>7} "
+            f"{'wait p50':>9} {'wait p95':>9} {'run p50':>9} {'run p95':>9}")
+        ms = lambda timings, key: f"{timings[key]}ms" if timings else "-"
+        for stats in summary["kinds"]:
+            click.echo(f"{stats['kind']:<22} {stats['queued']:>6} {stats['running']:>7} {stats['done']:>6} "
+                f"{stats['failed']:>6} {stats['per_hour']:>7} {ms(stats['wait_ms'], 'p50'):>9} "
+                f"{ms(stats['wait_ms'], 'p95'):>9} {ms(stats['run_ms'], 'p50'):>9} {ms(stats['run_ms'], 'p95'):>9}")
+
+    @jobs_command.command("schedule")
+    def schedule_command():
+        """List JOBS_SCHEDULE with each entry's next run."""
+
+        now = datetime.utcnow()
+        for name, entry in app.config["JOBS_SCHEDULE"].items():
+            click.echo(f"{name:<24} {entry['cron']:<16} {entry['kind']:<22} next {Cron(entry['cron']).next_after(now)} UTC")
+
+    if app.config["JOBS_WORKER_THREAD"] and not app.config.get("TESTING"):
+        # started on the first request, for the same reason as the mail sender thread
+        @app.before_first_request
+        def start_worker():
+            app.extensions["job_worker"] = start_worker_thread(app)
@@ -0,0 +1,284 @@
+"""Outbound email.
+
+Routes never talk to SMTP. They call queue_email(), which adds a row to the
+outbox table in the same transaction as the change that triggered it. A
+background sender claims pending rows in batches and delivers them over one
+reusable, authenticated SMTP connection, retrying failures with backoff.
+
+Claiming a batch marks its rows "sending" with a lease of MAIL_LEASE_SECONDS
+(kept in next_attempt_at) and commits, so no transaction or row lock is held
+while SMTP is slow. Each row is then marked sent, failed or pending again in
+its own short transaction. Rows whose lease runs out, because their sender
+died mid-batch, are claimed again. The sender only starts when mail is
+configured (MAIL_SERVER and MAIL_DEFAULT_SENDER).
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+
+from sqlalchemy import and_
+
+from models import db, Outbox
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+DEFAULTS = {
+    "MAIL_SERVER": os.environ.get("MAIL_SERVER", "smtp.gmail.com"),
+    "MAIL_PORT": int(os.environ.get("MAIL_PORT", 587)),
+    "MAIL_USE_TLS": os.environ.get("MAIL_USE_TLS", "1") != "0",
+    "MAIL_USERNAME": os.environ.get("EMAIL_USER"),
+    "MAIL_PASSWORD": os.environ.get("EMAIL_PASS"),
+    "MAIL_DEFAULT_SENDER": os.environ.get("EMAIL_USER"),
+    "MAIL_TIMEOUT": 10,
+    "MAIL_BATCH_SIZE": 50,
+    "MAIL_POLL_INTERVAL": 2.0,
+    "MAIL_MAX_ATTEMPTS": 8,
+    "MAIL_RETRY_BASE": 30,
+    "MAIL_RETRY_MAX": 3600,
+    "MAIL_LEASE_SECONDS": 300,
+    "MAIL_SENDER_THREAD": os.environ.get("MAIL_SENDER_THREAD", "1") != "0",
+}
+
+
+def is_configured(config):
+    """True when there is a server to send through and an address to send from"""
+
+    return bool(config["MAIL_SERVER"] and config["MAIL_DEFAULT_SENDER"])
+
+
+def queue_email(recipient, subject, text_body, html_body = None):
+    """Add an email to the outbox. Nothing is sent until the caller commits."""
+
+    message = Outbox(recipient = recipient, subject = subject, text_body = text_body, html_body = html_body)
+    db.session.add(message)
+
+    return message
+
+
+class SMTPSender:
+    """Keeps one authenticated SMTP connection open across batches"""
+
+    def __init__(self, host, port, username = None, password = None, use_tls = True, sender = None, timeout = 10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender or username
+        self.timeout = timeout
+        self._smtp = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            host = config["MAIL_SERVER"],
+            port = config["MAIL_PORT"],
+            username = config["MAIL_USERNAME"],
+            password = config["MAIL_PASSWORD"],
+            use_tls = config["MAIL_USE_TLS"],
+            sender = config["MAIL_DEFAULT_SENDER"],
+            timeout = config["MAIL_TIMEOUT"])
+
+    def _connect(self):
+        import smtplib
+
+        smtp = smtplib.SMTP(self.host, self.port, timeout = self.timeout)
+        smtp.ehlo()
+        if self.use_tls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+
+        return smtp
+
+    def build(self, message):
+        """Turn an outbox row into an EmailMessage"""
+
+        msg = EmailMessage()
+        msg["Subject"] = message.subject
+        msg["From"] = self.sender
+        msg["To"] = message.recipient
+        msg.set_content(message.text_body)
+        if message.html_body:
+            msg.add_alternative(message.html_body, subtype = "html")
+
+        return msg
+
+    def send(self, message):
+        """Send one outbox row, reconnecting once if the server dropped us"""
+
+        import smtplib
+
+        msg = self.build(message)
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class OutboxWorker:
+    """Claims pending outbox rows in batches and delivers them"""
+
+    def __init__(self, app, sender = None):
+        self.app = app
+        self.sender = sender or SMTPSender.from_config(app.config)
+
+    def retry_delay(self, attempts):
+        """Exponential backoff, capped at MAIL_RETRY_MAX seconds"""
+
+        config = self.app.config
+        return min(config["MAIL_RETRY_BASE"] * 2 ** (attempts - 1), config["MAIL_RETRY_MAX"])
+
+    def claim(self, now):
+        """Lease up to MAIL_BATCH_SIZE due rows to this sender and commit; returns their ids"""
+
+        config = self.app.config
+        table = Outbox.__table__
+        due = and_(table.c.status.in_([PENDING, SENDING]), table.c.next_attempt_at <= now)
+        lease = {"status": SENDING, "next_attempt_at": now + timedelta(seconds = config["MAIL_LEASE_SECONDS"]),
+            "attempts": table.c.attempts + 1}
+
+        # a lease that ran out on its last attempt is given up rather than sent again
+        db.session.execute(table.update()
+            .where(and_(due, table.c.status == SENDING, table.c.attempts >= config["MAIL_MAX_ATTEMPTS"]))
+            .values(status = FAILED, last_error = "Sender stopped before finishing"))
+
+        query = (Outbox.query.with_entities(Outbox.id)
+            .filter(due)
+            .order_by(Outbox.next_attempt_at, Outbox.id)
+            .limit(config["MAIL_BATCH_SIZE"]))
+
+        if db.engine.dialect.name in ("postgresql", "mysql"):
+            # locked until the commit below, and other senders skip them
+            claimed = [message_id for (message_id,) in query.with_for_update(skip_locked = True)]
+            if claimed:
+                db.session.execute(table.update().where(table.c.id.in_(claimed)).values(lease))
+        else:
+            # another sender may lease a candidate first; the conditional update then changes nothing
+            candidates = [message_id for (message_id,) in query]
+            claimed = [message_id for message_id in candidates
+                if db.session.execute(table.update().where(and_(table.c.id == message_id, due)).values(lease)).rowcount]
+
+        db.session.commit()
+
+        return claimed
+
+    def mark(self, message, values):
+        """Record how sending a claimed row went, unless its lease ran out and another sender took it"""
+
+        table = Outbox.__table__
+        db.session.execute(table.update()
+            .where(and_(table.c.id == message.id, table.c.status == SENDING, table.c.attempts == message.attempts))
+            .values(values))
+        db.session.commit()
+
+    def send_batch(self):
+        """Deliver one batch of due messages. Returns how many rows were handled."""
+
+        config = self.app.config
+        claimed = self.claim(datetime.utcnow())
+        if not claimed:
+            return 0
+
+        batch = Outbox.query.filter(Outbox.id.in_(claimed)).order_by(Outbox.id).all()
+        # detach the rows and end the transaction before talking to SMTP
+        db.session.close()
+
+        for message in batch:
+            try:
+                self.sender.send(message)
+            except Exception as exc:
+                log.warning("Sending outbox message %s failed: %s", message.id, exc)
+                self.sender.close()
+                if message.attempts >= config["MAIL_MAX_ATTEMPTS"]:
+                    values = {"status": FAILED}
+                else:
+                    delay = timedelta(seconds = self.retry_delay(message.attempts))
+                    values = {"status": PENDING, "next_attempt_at": datetime.utcnow() + delay}
+                self.mark(message, dict(values, last_error = str(exc)))
+            else:
+                self.mark(message, {"status": SENT, "sent_at": datetime.utcnow(), "last_error": None})
+
+        return len(batch)
+
+    def run(self, stop = None, once = False):
+        """Keep sending until stop is set. The SMTP connection is dropped while idle."""
+
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            with self.app.app_context():
+                try:
+                    handled = self.send_batch()
+                except Exception:
+                    log.exception("Outbox batch failed")
+                    db.session.rollback()
+                    handled = 0
+                finally:
+                    db.session.remove()
+
+            if once and not handled:
+                break
+            if not handled:
+                self.sender.close()
+                stop.wait(self.app.config["MAIL_POLL_INTERVAL"])
+
+        self.sender.close()
+
+
+def start_sender_thread(app):
+    """Run an OutboxWorker in a daemon thread of this process"""
+
+    stop = threading.Event()
+    worker = OutboxWorker(app)
+    thread = threading.Thread(target = worker.run, kwargs = {"stop": stop}, name = "outbox-sender", daemon = True)
+    thread.start()
+
+    return stop
+
+
+def init_app(app):
+    """Apply mail config defaults, register the CLI command and start the sender"""
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.command("send-mail")
+    @click.option("--once", is_flag = True, help = "Drain the outbox and exit.")
+    def send_mail(once):
+        """Deliver queued outbox email."""
+
+        if not is_configured(app.config):
+            raise click.ClickException("Mail is not configured; set MAIL_SERVER and EMAIL_USER.")
+        OutboxWorker(app).run(once = once)
+
+    if not is_configured(app.config):
+        log.info("Mail is not configured; queued email stays in the outbox")
+    elif app.config["MAIL_SENDER_THREAD"] and not app.config.get("TESTING"):
+        # started on the first request rather than here: under gunicorn --preload
+        # the app is built in the master, and a thread started there would not
+        # survive the fork into the workers
+        @app.before_first_request
+        def start_sender():
+            app.extensions["outbox_sender"] = start_sender_thread(app)
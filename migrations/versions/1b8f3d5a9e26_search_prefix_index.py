@@ -0,0 +1,32 @@
+"""last-name prefix index for one- and two-letter searches
+
+Postgres: lower(last_name) with text_pattern_ops, so LIKE 'sm%' is a range
+scan. SQLite: last_name COLLATE NOCASE, which serves its case-insensitive
+LIKE and the name order. Other databases are left alone.
+
+Revision ID: 1b8f3d5a9e26
+Revises: 6e2d9a4b7c13
+Create Date: 2026-10-18 23:58:12.403917
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '1b8f3d5a9e26'
+down_revision = '6e2d9a4b7c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_employees_last_name_prefix ON employees (lower(last_name) text_pattern_ops)")
+    elif dialect == 'sqlite':
+        op.execute("CREATE INDEX ix_employees_last_name_prefix ON employees (last_name COLLATE NOCASE, first_name, id)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('postgresql', 'sqlite'):
+        op.execute("DROP INDEX ix_employees_last_name_prefix")
@@ -0,0 +1,93 @@
+"""baseline schema
+
+Existing databases built with db.create_all() should be marked with
+`flask db stamp 3f1c9a2b7d10` instead of running this revision.
+
+Revision ID: 3f1c9a2b7d10
+Revises: 
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a2b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('employees',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('username', sa.String(length=25), nullable=False),
+    sa.Column('password', sa.Text(), nullable=True),
+    sa.Column('email', sa.String(length=50), nullable=False),
+    sa.Column('first_name', sa.String(length=25), nullable=False),
+    sa.Column('last_name', sa.String(length=30), nullable=False),
+    sa.Column('hire_date', sa.Date(), nullable=False),
+    sa.Column('is_admin', sa.Boolean(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=True),
+    sa.Column('required', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    op.create_table('locations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('site_name', sa.String(length=30), nullable=False),
+    sa.Column('city', sa.String(length=25), nullable=True),
+    sa.Column('state', sa.String(length=2), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('site_name')
+    )
+    op.create_table('certs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('cert_name', sa.Text(), nullable=False),
+    sa.Column('hours', sa.Integer(), nullable=False),
+    sa.Column('is_required', sa.Boolean(), nullable=False),
+    sa.Column('expire', sa.Boolean(), nullable=False),
+    sa.Column('good_for_time', sa.Integer(), nullable=True),
+    sa.Column('good_for_unit', sa.String(length=10), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('cert_name')
+    )
+    op.create_table('trainings',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.Text(), nullable=False),
+    sa.Column('city', sa.String(length=30), nullable=True),
+    sa.Column('state', sa.String(length=2), nullable=False),
+    sa.Column('room', sa.String(length=30), nullable=False),
+    sa.Column('hours', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('time', sa.Time(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('employee_certification',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=True),
+    sa.Column('cert_id', sa.Integer(), nullable=True),
+    sa.Column('received', sa.Date(), nullable=False),
+    sa.Column('due_date', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['cert_id'], ['certs.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('emp_loc',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=True),
+    sa.Column('location_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('emp_loc')
+    op.drop_table('employee_certification')
+    op.drop_table('trainings')
+    op.drop_table('certs')
+    op.drop_table('locations')
+    op.drop_table('employees')
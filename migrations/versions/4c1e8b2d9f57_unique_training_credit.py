@@ -0,0 +1,36 @@
+"""one ledger credit per employee and training
+
+uq_hours_ledger_training_credit lets an employee be credited for a training
+only once, so two admins recording the same attendance cannot both add the
+hours. Entries without a training (certs, adjustments, opening balances)
+leave training_id NULL, which never conflicts. The index leads with
+training_id, so it also takes over from ix_hours_ledger_training.
+
+It fails if duplicate credits already exist; find them with
+    SELECT training_id, employee_id, source FROM hours_ledger WHERE training_id IS NOT NULL
+    GROUP BY training_id, employee_id, source HAVING count(*) > 1
+and correct them (then run `flask rebuild-hours`) before upgrading.
+
+Revision ID: 4c1e8b2d9f57
+Revises: a7c3e59d0b18
+Create Date: 2026-10-18 23:48:06.215937
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1e8b2d9f57'
+down_revision = 'a7c3e59d0b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('uq_hours_ledger_training_credit', 'hours_ledger', ['training_id', 'employee_id', 'source'], unique=True)
+    op.drop_index('ix_hours_ledger_training', table_name='hours_ledger')
+
+
+def downgrade():
+    op.create_index('ix_hours_ledger_training', 'hours_ledger', ['training_id'], unique=False)
+    op.drop_index('uq_hours_ledger_training_credit', table_name='hours_ledger')
@@ -0,0 +1,34 @@
+"""compliance summary table
+
+Run `flask reconcile-compliance` once after upgrading to fill it.
+
+Revision ID: 5d9e1b7c3a48
+Revises: c47a0e9f5b21
+Create Date: 2026-10-18 10:05:51.330812
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9e1b7c3a48'
+down_revision = 'c47a0e9f5b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('compliance_summary',
+    sa.Column('location_id', sa.Integer(), nullable=False),
+    sa.Column('cert_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.String(length=10), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['cert_id'], ['certs.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('location_id', 'cert_id', 'bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('compliance_summary')
@@ -0,0 +1,35 @@
+"""one emp_cert row per employee, cert and day received
+
+uq_emp_cert_employee_cert_received replaces ix_emp_cert_employee_cert on the
+same columns, so the archive job's lookups keep their index. It backs the
+ON CONFLICT DO NOTHING / INSERT OR IGNORE of bulk assignments.
+
+It fails if duplicate records already exist; find them with
+    SELECT employee_id, cert_id, received FROM emp_cert
+    GROUP BY employee_id, cert_id, received HAVING count(*) > 1
+and delete the extra rows (then run `flask reconcile-compliance`) before
+upgrading.
+
+Revision ID: 6e2d9a4b7c13
+Revises: 4c1e8b2d9f57
+Create Date: 2026-10-18 23:57:31.604228
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2d9a4b7c13'
+down_revision = '4c1e8b2d9f57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('uq_emp_cert_employee_cert_received', 'emp_cert', ['employee_id', 'cert_id', 'received'], unique=True)
+    op.drop_index('ix_emp_cert_employee_cert', table_name='emp_cert')
+
+
+def downgrade():
+    op.create_index('ix_emp_cert_employee_cert', 'emp_cert', ['employee_id', 'cert_id', 'received'], unique=False)
+    op.drop_index('uq_emp_cert_employee_cert_received', table_name='emp_cert')
@@ -0,0 +1,47 @@
+"""outbox table and list view sort indexes
+
+Revision ID: 8b2e4d6a1c35
+Revises: 3f1c9a2b7d10
+Create Date: 2026-10-18 09:20:02.540771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6a1c35'
+down_revision = '3f1c9a2b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('recipient', sa.String(length=50), nullable=False),
+    sa.Column('subject', sa.Text(), nullable=False),
+    sa.Column('text_body', sa.Text(), nullable=False),
+    sa.Column('html_body', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_status_next_attempt', 'outbox', ['status', 'next_attempt_at'], unique=False)
+    op.create_index('ix_employees_name', 'employees', ['last_name', 'first_name', 'id'], unique=False)
+    op.create_index('ix_employees_hire_date', 'employees', ['hire_date', 'id'], unique=False)
+    op.create_index('ix_locations_state', 'locations', ['state', 'site_name', 'id'], unique=False)
+    op.create_index('ix_trainings_date', 'trainings', ['date', 'time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trainings_date', table_name='trainings')
+    op.drop_index('ix_locations_state', table_name='locations')
+    op.drop_index('ix_employees_hire_date', table_name='employees')
+    op.drop_index('ix_employees_name', table_name='employees')
+    op.drop_index('ix_outbox_status_next_attempt', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,58 @@
+"""employee search indexes
+
+Postgres: pg_trgm GIN indexes for substring search (needs permission to
+CREATE EXTENSION). SQLite: an FTS5 table over employees kept current by
+triggers. Other databases are left alone and search with LIKE.
+
+Revision ID: 9a4f6c2e8d13
+Revises: 5d9e1b7c3a48
+Create Date: 2026-10-18 14:22:09.518304
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f6c2e8d13'
+down_revision = '5d9e1b7c3a48'
+branch_labels = None
+depends_on = None
+
+DOCUMENT = "lower(first_name || ' ' || last_name || ' ' || username || ' ' || email)"
+
+FTS_COLUMNS = "first_name, last_name, username, email"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(f"CREATE INDEX ix_employees_search_trgm ON employees USING gin (({DOCUMENT}) gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_locations_site_name_trgm ON locations USING gin (lower(site_name) gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        op.execute(f"CREATE VIRTUAL TABLE employee_search USING fts5({FTS_COLUMNS}, "
+            "content='employees', content_rowid='id', prefix='1 2 3')")
+        op.execute("CREATE TRIGGER employee_search_insert AFTER INSERT ON employees BEGIN "
+            f"INSERT INTO employee_search(rowid, {FTS_COLUMNS}) "
+            "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END")
+        op.execute("CREATE TRIGGER employee_search_delete AFTER DELETE ON employees BEGIN "
+            f"INSERT INTO employee_search(employee_search, rowid, {FTS_COLUMNS}) "
+            "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); END")
+        op.execute("CREATE TRIGGER employee_search_update AFTER UPDATE ON employees BEGIN "
+            f"INSERT INTO employee_search(employee_search, rowid, {FTS_COLUMNS}) "
+            "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); "
+            f"INSERT INTO employee_search(rowid, {FTS_COLUMNS}) "
+            "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END")
+        op.execute("INSERT INTO employee_search(employee_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_locations_site_name_trgm")
+        op.execute("DROP INDEX ix_employees_search_trgm")
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER employee_search_update")
+        op.execute("DROP TRIGGER employee_search_delete")
+        op.execute("DROP TRIGGER employee_search_insert")
+        op.execute("DROP TABLE employee_search")
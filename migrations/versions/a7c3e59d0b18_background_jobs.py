@@ -0,0 +1,56 @@
+"""background jobs
+
+jobs holds the queue of jobs.py. Workers find due rows through
+ix_jobs_status_run_at; ix_jobs_finished_at serves the per-kind metrics and
+pruning. uq_jobs_schedule_slot lets only one worker queue each slot of a
+JOBS_SCHEDULE entry; ad hoc jobs leave both columns NULL, which never
+conflict.
+
+Revision ID: a7c3e59d0b18
+Revises: f36b9d1e4a70
+Create Date: 2026-10-18 23:02:51.480913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e59d0b18'
+down_revision = 'f36b9d1e4a70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('args', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('message', sa.String(length=200), nullable=True),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('worker', sa.String(length=100), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('schedule', sa.String(length=50), nullable=True),
+    sa.Column('scheduled_for', sa.DateTime(), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('schedule', 'scheduled_for', name='uq_jobs_schedule_slot')
+    )
+    op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'], unique=False)
+    op.create_index('ix_jobs_finished_at', 'jobs', ['finished_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_finished_at', table_name='jobs')
+    op.drop_index('ix_jobs_status_run_at', table_name='jobs')
+    op.drop_table('jobs')
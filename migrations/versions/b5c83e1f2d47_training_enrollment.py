@@ -0,0 +1,40 @@
+"""training capacity and enrollments
+
+Revision ID: b5c83e1f2d47
+Revises: e2b7d4f90a16
+Create Date: 2026-10-18 16:52:41.630915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c83e1f2d47'
+down_revision = 'e2b7d4f90a16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('trainings', sa.Column('capacity', sa.Integer(), nullable=True))
+    op.add_column('trainings', sa.Column('seats_taken', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('enrollments',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('training_id', sa.Integer(), nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('enrolled_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['training_id'], ['trainings.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('training_id', 'employee_id', name='uq_enrollments_training_employee')
+    )
+    op.create_index('ix_enrollments_employee', 'enrollments', ['employee_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_enrollments_employee', table_name='enrollments')
+    op.drop_table('enrollments')
+    with op.batch_alter_table('trainings') as batch_op:
+        batch_op.drop_column('seats_taken')
+        batch_op.drop_column('capacity')
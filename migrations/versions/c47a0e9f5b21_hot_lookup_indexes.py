@@ -0,0 +1,42 @@
+"""hot lookup indexes, unique usernames, emp_cert table name
+
+The unique username index fails if duplicate usernames already exist; find
+them with
+    SELECT username FROM employees GROUP BY username HAVING count(*) > 1
+and resolve them before upgrading.
+
+trainings(date) is already covered by ix_trainings_date (date, time, id).
+
+Revision ID: c47a0e9f5b21
+Revises: 8b2e4d6a1c35
+Create Date: 2026-10-18 09:41:17.902614
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a0e9f5b21'
+down_revision = '8b2e4d6a1c35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.rename_table('employee_certification', 'emp_cert')
+    op.create_index('ix_emp_cert_employee_due', 'emp_cert', ['employee_id', 'due_date'], unique=False)
+    op.create_index('ix_emp_cert_due', 'emp_cert', ['due_date'], unique=False)
+    op.create_index('ix_emp_cert_cert', 'emp_cert', ['cert_id'], unique=False)
+    op.create_index('ix_emp_loc_employee', 'emp_loc', ['employee_id'], unique=False)
+    op.create_index('ix_emp_loc_location', 'emp_loc', ['location_id'], unique=False)
+    op.create_index('ix_employees_username', 'employees', ['username'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_employees_username', table_name='employees')
+    op.drop_index('ix_emp_loc_location', table_name='emp_loc')
+    op.drop_index('ix_emp_loc_employee', table_name='emp_loc')
+    op.drop_index('ix_emp_cert_cert', table_name='emp_cert')
+    op.drop_index('ix_emp_cert_due', table_name='emp_cert')
+    op.drop_index('ix_emp_cert_employee_due', table_name='emp_cert')
+    op.rename_table('emp_cert', 'employee_certification')
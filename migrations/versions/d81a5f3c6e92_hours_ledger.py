@@ -0,0 +1,128 @@
+"""training-hours ledger and rollups replace employees.completed
+
+The hand-edited completed count of every employee becomes one "opening
+balance" ledger entry dated today, and hours_rollup is filled from those
+entries, both with INSERT ... SELECT. `required` stays, now read as the hours
+required per calendar year.
+
+On SQLite dropping the column copies employees into a new table, which loses
+the employee_search triggers, so they are created again afterwards. Their DDL
+is copied here rather than imported, so later changes to search.py cannot
+change what this revision does.
+
+Revision ID: d81a5f3c6e92
+Revises: b5c83e1f2d47
+Create Date: 2026-10-18 19:05:12.408114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81a5f3c6e92'
+down_revision = 'b5c83e1f2d47'
+branch_labels = None
+depends_on = None
+
+SEARCH_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS employee_search_insert AFTER INSERT ON employees BEGIN "
+    "INSERT INTO employee_search(rowid, first_name, last_name, username, email) "
+    "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END",
+    "CREATE TRIGGER IF NOT EXISTS employee_search_delete AFTER DELETE ON employees BEGIN "
+    "INSERT INTO employee_search(employee_search, rowid, first_name, last_name, username, email) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); END",
+    "CREATE TRIGGER IF NOT EXISTS employee_search_update AFTER UPDATE ON employees BEGIN "
+    "INSERT INTO employee_search(employee_search, rowid, first_name, last_name, username, email) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); "
+    "INSERT INTO employee_search(rowid, first_name, last_name, username, email) "
+    "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END",
+]
+
+
+def _restore_search_triggers():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    if bind.execute(sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_search'")).first():
+        for statement in SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def _period_sql(kind):
+    """The rollup period of a ledger row's earned_on: 'all', its year or its month"""
+
+    if kind == 'all':
+        return "'all'"
+    if op.get_bind().dialect.name == 'postgresql':
+        return {'year': "to_char(hours_ledger.earned_on, 'YYYY')", 'month': "to_char(hours_ledger.earned_on, 'YYYY-MM')"}[kind]
+    return {'year': "strftime('%Y', hours_ledger.earned_on)", 'month': "strftime('%Y-%m', hours_ledger.earned_on)"}[kind]
+
+
+def _fill_rollups():
+    for kind in ('all', 'year', 'month'):
+        period = _period_sql(kind)
+        # a constant cannot appear in GROUP BY on Postgres
+        grouping = '' if kind == 'all' else f', {period}'
+        op.execute(
+            "INSERT INTO hours_rollup (scope, scope_id, period, hours, entries) "
+            f"SELECT 'employee', hours_ledger.employee_id, {period}, SUM(hours_ledger.hours), COUNT(*) "
+            f"FROM hours_ledger GROUP BY hours_ledger.employee_id{grouping}")
+        op.execute(
+            "INSERT INTO hours_rollup (scope, scope_id, period, hours, entries) "
+            f"SELECT 'location', emp_loc.location_id, {period}, SUM(hours_ledger.hours), COUNT(*) "
+            "FROM hours_ledger JOIN emp_loc ON emp_loc.employee_id = hours_ledger.employee_id "
+            f"GROUP BY emp_loc.location_id{grouping}")
+
+
+def upgrade():
+    op.create_table('hours_ledger',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('hours', sa.Integer(), nullable=False),
+    sa.Column('earned_on', sa.Date(), nullable=False),
+    sa.Column('source', sa.String(length=20), nullable=False),
+    sa.Column('training_id', sa.Integer(), nullable=True),
+    sa.Column('cert_id', sa.Integer(), nullable=True),
+    sa.Column('note', sa.String(length=200), nullable=True),
+    sa.Column('recorded_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['cert_id'], ['certs.id'], ondelete='set null'),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['training_id'], ['trainings.id'], ondelete='set null'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_hours_ledger_employee_earned', 'hours_ledger', ['employee_id', 'earned_on', 'id'], unique=False)
+    op.create_index('ix_hours_ledger_training', 'hours_ledger', ['training_id'], unique=False)
+    op.create_table('hours_rollup',
+    sa.Column('scope', sa.String(length=10), nullable=False),
+    sa.Column('scope_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=7), nullable=False),
+    sa.Column('hours', sa.Integer(), nullable=False),
+    sa.Column('entries', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'scope_id', 'period')
+    )
+
+    op.execute(
+        "INSERT INTO hours_ledger (employee_id, hours, earned_on, source, note, recorded_at) "
+        "SELECT id, completed, CURRENT_DATE, 'opening balance', 'Hours completed before the ledger', CURRENT_TIMESTAMP "
+        "FROM employees WHERE completed > 0")
+    _fill_rollups()
+
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.drop_column('completed')
+    _restore_search_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.add_column(sa.Column('completed', sa.Integer(), nullable=True))
+    _restore_search_triggers()
+
+    op.execute(
+        "UPDATE employees SET completed = "
+        "(SELECT SUM(hours) FROM hours_ledger WHERE hours_ledger.employee_id = employees.id)")
+
+    op.drop_table('hours_rollup')
+    op.drop_index('ix_hours_ledger_training', table_name='hours_ledger')
+    op.drop_index('ix_hours_ledger_employee_earned', table_name='hours_ledger')
+    op.drop_table('hours_ledger')
@@ -0,0 +1,32 @@
+"""training updated_at and calendar indexes
+
+Revision ID: e2b7d4f90a16
+Revises: 9a4f6c2e8d13
+Create Date: 2026-10-18 15:40:27.104522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7d4f90a16'
+down_revision = '9a4f6c2e8d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('trainings', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE trainings SET updated_at = CURRENT_TIMESTAMP")
+    with op.batch_alter_table('trainings') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+    op.create_index('ix_trainings_place', 'trainings', ['state', 'city', 'date'], unique=False)
+    op.create_index('ix_trainings_updated_at', 'trainings', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trainings_updated_at', table_name='trainings')
+    op.drop_index('ix_trainings_place', table_name='trainings')
+    with op.batch_alter_table('trainings') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,67 @@
+"""certification history archive
+
+emp_cert_history receives the superseded and long-expired emp_cert rows moved
+by `flask archive-certs`. On Postgres it is partitioned by due_date: the job
+adds one partition per year as rows arrive, and rows of certs that never
+expire land in emp_cert_history_default. A partitioned table cannot have a
+primary key that leaves out the (nullable) partition column, so there it has
+none; ids are unique because they come from emp_cert. Needs Postgres 11 or
+later for the default partition and the partitioned index.
+
+ix_emp_cert_employee_cert serves the job's "is there a newer record" check
+and compliance.latest_due_date().
+
+Revision ID: f36b9d1e4a70
+Revises: d81a5f3c6e92
+Create Date: 2026-10-18 21:14:37.162580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f36b9d1e4a70'
+down_revision = 'd81a5f3c6e92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE TABLE emp_cert_history ("
+            "id integer NOT NULL, "
+            "employee_id integer REFERENCES employees (id) ON DELETE CASCADE, "
+            "cert_id integer REFERENCES certs (id) ON DELETE CASCADE, "
+            "received date NOT NULL, "
+            "due_date date, "
+            "reason varchar(10) NOT NULL, "
+            "archived_at timestamp without time zone NOT NULL"
+            ") PARTITION BY RANGE (due_date)")
+        op.execute("CREATE TABLE emp_cert_history_default PARTITION OF emp_cert_history DEFAULT")
+    else:
+        op.create_table('emp_cert_history',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('employee_id', sa.Integer(), nullable=True),
+        sa.Column('cert_id', sa.Integer(), nullable=True),
+        sa.Column('received', sa.Date(), nullable=False),
+        sa.Column('due_date', sa.Date(), nullable=True),
+        sa.Column('reason', sa.String(length=10), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['cert_id'], ['certs.id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_emp_cert_history_employee', 'emp_cert_history', ['employee_id', 'cert_id'], unique=False)
+    op.create_index('ix_emp_cert_employee_cert', 'emp_cert', ['employee_id', 'cert_id', 'received'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_emp_cert_employee_cert', table_name='emp_cert')
+    op.execute(
+        "INSERT INTO emp_cert (id, employee_id, cert_id, received, due_date) "
+        "SELECT id, employee_id, cert_id, received, due_date FROM emp_cert_history")
+    op.drop_index('ix_emp_cert_history_employee', table_name='emp_cert_history')
+    # on Postgres this drops every partition with it
+    op.drop_table('emp_cert_history')
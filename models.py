@@ -1,12 +1,16 @@
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+import os
+from datetime import datetime
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
+import passwords
+from replicas import RoutingSQLAlchemy
 
 
-db = SQLAlchemy()
-bcrypt = Bcrypt()
+# reads may go to the replica bind, see replicas.py
+db = RoutingSQLAlchemy()
 
 class employee_certification(db.Model):
-    ___tablename__ = "emp_cert", 
+    __tablename__ = "emp_cert"
 
     id = db.Column(db.Integer, primary_key = True, autoincrement = True) 
     employee_id = db.Column(db.Integer, db.ForeignKey("employees.id", ondelete = "cascade")) 
@@ -14,16 +18,42 @@ class employee_certification(db.Model):
     received = db.Column(db.Date, nullable = False)
     due_date = db.Column(db.Date)
 
+    __table_args__ = (
+        db.Index("ix_emp_cert_employee_due", "employee_id", "due_date"),
+        db.Index("ix_emp_cert_due", "due_date"),
+        db.Index("ix_emp_cert_cert", "cert_id"),
+        # one record per employee, cert and day received; bulk assignments skip conflicts
+        db.Index("uq_emp_cert_employee_cert_received", "employee_id", "cert_id", "received", unique = True),
+    )
+
     def __init__(self, employee_id, cert_id, received, due_date):
         self.employee_id = employee_id
         self.cert_id = cert_id
         self.received = received
         self.due_date = due_date
 
+class CertHistory(db.Model):
+    """An emp_cert row moved out by cert_archive: superseded by a renewal or expired long ago"""
+    __tablename__ = "emp_cert_history"
+
+    # keeps the id it had in emp_cert; on Postgres the table is partitioned by
+    # due_date, which cannot carry a primary key, so this one is mapper-only there
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    employee_id = db.Column(db.Integer, db.ForeignKey("employees.id", ondelete = "cascade"))
+    cert_id = db.Column(db.Integer, db.ForeignKey("certs.id", ondelete = "cascade"))
+    received = db.Column(db.Date, nullable = False)
+    due_date = db.Column(db.Date)
+    reason = db.Column(db.String(10), nullable = False) ## superseded or expired
+    archived_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_emp_cert_history_employee", "employee_id", "cert_id"),)
+
 employee_location = db.Table("emp_loc", 
 db.Column("id", db.Integer, primary_key = True, autoincrement = True),
 db.Column("employee_id", db.Integer, db.ForeignKey("employees.id", ondelete = "cascade")), 
-db.Column("location_id", db.Integer, db.ForeignKey("locations.id", ondelete = "cascade")))
+db.Column("location_id", db.Integer, db.ForeignKey("locations.id", ondelete = "cascade")),
+db.Index("ix_emp_loc_employee", "employee_id"),
+db.Index("ix_emp_loc_location", "location_id"))
 
 
 class Employee(db.Model):
@@ -38,19 +68,24 @@ class Employee(db.Model):
     last_name = db.Column(db.String(30), nullable = False)
     hire_date = db.Column(db.Date, nullable = False)
     is_admin = db.Column(db.Boolean, nullable = False)
-    completed = db.Column(db.Integer)
-    required = db.Column(db.Integer)
+    required = db.Column(db.Integer) ## training hours required per calendar year
+
+    __table_args__ = (
+        db.Index("ix_employees_username", "username", unique = True),
+        db.Index("ix_employees_name", "last_name", "first_name", "id"),
+        db.Index("ix_employees_hire_date", "hire_date", "id"),
+    )
     
     
     locations = db.relationship("Location", secondary = employee_location, cascade = "all, delete")
-    certs = db.relationship("Cert", secondary = "employee_certification",  cascade = "all, delete")
+    certs = db.relationship("Cert", secondary = "emp_cert",  cascade = "all, delete")
 
     
 
     @classmethod
     def register(cls, username, password, email, first_name, last_name, hire_date, is_admin): ## do i need to add location and permissions?
         """Register user with hashed password and return user"""
-        hashed_pwd = bcrypt.generate_password_hash(password).decode("UTF-8")
+        hashed_pwd = passwords.hash_password(password)
 
         employee = Employee(
             username=username, 
@@ -69,7 +104,7 @@ class Employee(db.Model):
     def password_reset(username, password):
         """Password RESET"""
         
-        hashed_pwd = bcrypt.generate_password_hash(password).decode("UTF-8")
+        hashed_pwd = passwords.hash_password(password)
 
         employee = Employee(
             username = username,
@@ -80,12 +115,16 @@ class Employee(db.Model):
 
     
     def authenticate(username, password):
-        """Validate that user and password are correct"""
+        """Validate that user and password are correct.
+        A hash made with an outdated bcrypt cost is upgraded on the way in."""
         employee = Employee.query.filter_by(username=username).first()
 
         if employee:
-            is_auth = bcrypt.check_password_hash(employee.password, password)
+            is_auth, new_hash = passwords.verify(employee.password, password)
             if is_auth:
+                if new_hash:
+                    employee.password = new_hash
+                    db.session.commit()
                 return employee
         
         return False 
@@ -108,6 +147,8 @@ class Location(db.Model):
     site_name = db.Column(db.String(30), nullable = False, unique = True)
     city = db.Column(db.String(25))
     state = db.Column(db.String(2), nullable = False) 
+
+    __table_args__ = (db.Index("ix_locations_state", "state", "site_name", "id"),)
     
     employees = db.relationship("Employee", secondary = employee_location, cascade = "all, delete")
      
@@ -128,7 +169,7 @@ class Cert(db.Model):
     good_for_unit = db.Column(db.String (10))
     
     
-    employees = db.relationship("Employee", secondary = "employee_certification", cascade = "all, delete")
+    employees = db.relationship("Employee", secondary = "emp_cert", cascade = "all, delete")
     
     def __init__(self, cert_name, hours, is_required, expire, good_for_time, good_for_unit):
         self.cert_name = cert_name
@@ -148,8 +189,18 @@ class Training(db.Model):
     hours = db.Column(db.Integer, nullable = False)
     date = db.Column(db.Date, nullable = False)
     time = db.Column(db.Time, nullable = False)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow, onupdate = datetime.utcnow)
+    # None means unlimited; seats_taken is only changed by enrollment.enroll() and cancel()
+    capacity = db.Column(db.Integer)
+    seats_taken = db.Column(db.Integer, nullable = False, default = 0, server_default = "0")
+
+    __table_args__ = (
+        db.Index("ix_trainings_date", "date", "time", "id"),
+        db.Index("ix_trainings_place", "state", "city", "date"),
+        db.Index("ix_trainings_updated_at", "updated_at"),
+    )
 
-    def __init__(self, name, city, state, room, hours, date, time):
+    def __init__(self, name, city, state, room, hours, date, time, capacity = None):
         self.name = name
         self.city = city
         self.state = state
@@ -157,11 +208,183 @@ class Training(db.Model):
         self.hours = hours
         self.date = date
         self.time = time
+        self.capacity = capacity
+        self.seats_taken = 0
+
+    @property
+    def seats_left(self):
+        return None if self.capacity is None else max(0, self.capacity - self.seats_taken)
+
+class Enrollment(db.Model):
+    """An employee's seat in a training"""
+    __tablename__ = "enrollments"
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = True)
+    training_id = db.Column(db.Integer, db.ForeignKey("trainings.id", ondelete = "cascade"), nullable = False)
+    employee_id = db.Column(db.Integer, db.ForeignKey("employees.id", ondelete = "cascade"), nullable = False)
+    enrolled_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("training_id", "employee_id", name = "uq_enrollments_training_employee"),
+        db.Index("ix_enrollments_employee", "employee_id"),
+    )
+
+    def __init__(self, training_id, employee_id):
+        self.training_id = training_id
+        self.employee_id = employee_id
+
+class ComplianceSummary(db.Model):
+    """Count of employees per location, certification and due-date bucket"""
+    __tablename__ = "compliance_summary"
+
+    location_id = db.Column(db.Integer, db.ForeignKey("locations.id", ondelete = "cascade"), primary_key = True)
+    cert_id = db.Column(db.Integer, db.ForeignKey("certs.id", ondelete = "cascade"), primary_key = True)
+    bucket = db.Column(db.String(10), primary_key = True)
+    count = db.Column(db.Integer, nullable = False, default = 0)
+
+    def __init__(self, location_id, cert_id, bucket, count):
+        self.location_id = location_id
+        self.cert_id = cert_id
+        self.bucket = bucket
+        self.count = count
+
+class HoursEntry(db.Model):
+    """One line of the training-hours ledger; entries are never edited, corrections are new entries"""
+    __tablename__ = "hours_ledger"
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = True)
+    employee_id = db.Column(db.Integer, db.ForeignKey("employees.id", ondelete = "cascade"), nullable = False)
+    hours = db.Column(db.Integer, nullable = False)
+    earned_on = db.Column(db.Date, nullable = False)
+    source = db.Column(db.String(20), nullable = False) ## training, cert, adjustment or opening balance
+    training_id = db.Column(db.Integer, db.ForeignKey("trainings.id", ondelete = "set null"))
+    cert_id = db.Column(db.Integer, db.ForeignKey("certs.id", ondelete = "set null"))
+    note = db.Column(db.String(200))
+    recorded_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_hours_ledger_employee_earned", "employee_id", "earned_on", "id"),
+        # one credit per employee and training; entries without a training never conflict
+        db.Index("uq_hours_ledger_training_credit", "training_id", "employee_id", "source", unique = True),
+    )
+
+    training = db.relationship("Training")
+    cert = db.relationship("Cert")
+
+    def __init__(self, employee_id, hours, earned_on, source, training_id = None, cert_id = None, note = None):
+        self.employee_id = employee_id
+        self.hours = hours
+        self.earned_on = earned_on
+        self.source = source
+        self.training_id = training_id
+        self.cert_id = cert_id
+        self.note = note
+
+class HoursRollup(db.Model):
+    """Ledger hours summed per employee or location and period ("all", "2026" or "2026-10")"""
+    __tablename__ = "hours_rollup"
+
+    scope = db.Column(db.String(10), primary_key = True) ## employee or location
+    scope_id = db.Column(db.Integer, primary_key = True)
+    period = db.Column(db.String(7), primary_key = True)
+    hours = db.Column(db.Integer, nullable = False, default = 0)
+    entries = db.Column(db.Integer, nullable = False, default = 0)
+
+    def __init__(self, scope, scope_id, period, hours, entries):
+        self.scope = scope
+        self.scope_id = scope_id
+        self.period = period
+        self.hours = hours
+        self.entries = entries
+
+class Outbox(db.Model):
+    """Outgoing email, written in the same transaction as the change that triggered it"""
+    __tablename__ = "outbox"
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = True)
+    recipient = db.Column(db.String(50), nullable = False)
+    subject = db.Column(db.Text, nullable = False)
+    text_body = db.Column(db.Text, nullable = False)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable = False, default = "pending")
+    attempts = db.Column(db.Integer, nullable = False, default = 0)
+    next_attempt_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),)
+
+    def __init__(self, recipient, subject, text_body, html_body = None):
+        self.recipient = recipient
+        self.subject = subject
+        self.text_body = text_body
+        self.html_body = html_body
+        self.status = "pending"
+        self.attempts = 0
+        self.next_attempt_at = datetime.utcnow()
+
+class Job(db.Model):
+    """A unit of background work, claimed and run by `flask jobs-worker` (see jobs.py)"""
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = True)
+    kind = db.Column(db.String(50), nullable = False)
+    # JSON keyword arguments for the task
+    args = db.Column(db.Text, nullable = False, default = "{}")
+    status = db.Column(db.String(10), nullable = False, default = "queued")
+    run_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable = False, default = 0)
+    max_attempts = db.Column(db.Integer, nullable = False, default = 3)
+    progress = db.Column(db.Integer, nullable = False, default = 0)
+    message = db.Column(db.String(200))
+    result = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+    worker = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+    # set for runs of a JOBS_SCHEDULE entry; unique together, so a slot is queued once
+    schedule = db.Column(db.String(50))
+    scheduled_for = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_jobs_status_run_at", "status", "run_at"),
+        db.Index("ix_jobs_finished_at", "finished_at"),
+        db.UniqueConstraint("schedule", "scheduled_for", name = "uq_jobs_schedule_slot"),
+    )
+
+    def __init__(self, kind, args = "{}", run_at = None, max_attempts = 3, schedule = None, scheduled_for = None, created_by = None):
+        self.kind = kind
+        self.args = args
+        self.status = "queued"
+        self.run_at = run_at or datetime.utcnow()
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.progress = 0
+        self.schedule = schedule
+        self.scheduled_for = scheduled_for
+        self.created_by = created_by
 
 def connect_db(app):
     """Connect to the database"""
-    db.app = app
     db.init_app(app) 
 
 
+@event.listens_for(Pool, "connect")
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(Pool, "checkout")
+def _refuse_inherited_connection(dbapi_connection, connection_record, connection_proxy):
+    # with gunicorn --preload a worker inherits the master's pool; sharing its
+    # sockets would interleave two processes' traffic on one connection
+    if connection_record.info.get("pid") != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError("Connection was opened in a different process")
+
+
 
@@ -0,0 +1,148 @@
+"""Keyset (seek) pagination and query-string filters for the admin list views.
+
+Pages are addressed by a cursor holding the sort key of the last row shown,
+so fetching page 500 costs the same indexed range scan as fetching page 1.
+"""
+
+import base64
+import json
+from datetime import date, datetime, time
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+class Page:
+    """One page of rows plus the cursor for the next one"""
+
+    def __init__(self, items, next_cursor, per_page, sort = None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self.sort = sort
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def next_url(self):
+        """URL of the following page, keeping the current filters"""
+
+        args = request.args.to_dict()
+        args["after"] = self.next_cursor
+        return url_for(request.endpoint, **dict(request.view_args, **args))
+
+    def first_url(self):
+        args = request.args.to_dict()
+        args.pop("after", None)
+        return url_for(request.endpoint, **dict(request.view_args, **args))
+
+
+def _dump(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+
+def _load(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type in (date, datetime, time):
+        return python_type.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps([_dump(value) for value in values]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into typed sort-key values, or None if it is malformed"""
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if len(values) != len(columns):
+            return None
+        return [_load(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def paginate(query, columns, cursor = None, per_page = DEFAULT_PER_PAGE):
+    """Return the Page of query that follows cursor.
+
+    columns is the sort key; its last column must be unique (normally the
+    primary key) so every row has a distinct position.
+    """
+
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        if values is not None:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    rows = query.order_by(*columns).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+
+    return Page(rows, next_cursor, per_page)
+
+
+def paginate_request(query, sorts, default):
+    """paginate() using the sort, after and per_page query-string arguments.
+
+    sorts maps a sort name to its key columns; unknown names fall back to default.
+    """
+
+    sort = sort_arg(sorts, default)
+    per_page = arg_int("per_page") or DEFAULT_PER_PAGE
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+
+    page = paginate(query, sorts[sort], cursor = request.args.get("after"), per_page = per_page)
+    page.sort = sort
+
+    return page
+
+
+def sort_arg(sorts, default):
+    """The sort query-string argument if it names one of sorts, else default"""
+
+    sort = request.args.get("sort", default)
+    return sort if sort in sorts else default
+
+
+def arg_int(name):
+    """Integer query-string argument, or None if missing or invalid"""
+
+    try:
+        return int(request.args[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def arg_date(name):
+    """ISO date query-string argument, or None if missing or invalid"""
+
+    try:
+        return date.fromisoformat(request.args[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def arg_bool(name):
+    """'1'/'0' query-string argument as True/False, or None if missing"""
+
+    value = request.args.get(name)
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    return None
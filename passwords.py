@@ -0,0 +1,152 @@
+"""Password hashing and verification.
+
+bcrypt is deliberately slow, so hashes and checks do not run on the request
+thread: each web worker sends them to its own pool of BCRYPT_POOL_WORKERS
+processes, so a host never runs more than gunicorn's workers times that many
+at once. At most BCRYPT_MAX_PENDING more may queue behind them; a login that
+cannot get in within BCRYPT_QUEUE_TIMEOUT seconds, or whose check takes longer
+than BCRYPT_CHECK_TIMEOUT, fails fast with PasswordCheckBusy rather than tying
+up a worker that page views need. Capacity is counted per process, so a
+worker killed mid-hash takes its count with it, and a pool process that dies
+is replaced on the next call; pool processes exit when their worker does.
+Hashes made with a cost other than BCRYPT_LOG_ROUNDS are re-hashed on the
+next successful login.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt as bcrypt_lib
+from flask import current_app
+
+DEFAULTS = {
+    "BCRYPT_LOG_ROUNDS": int(os.environ.get("BCRYPT_LOG_ROUNDS", 12)),
+    "BCRYPT_POOL_WORKERS": int(os.environ.get("BCRYPT_POOL_WORKERS", 1)),
+    "BCRYPT_MAX_PENDING": 4,
+    "BCRYPT_QUEUE_TIMEOUT": 5.0,
+    "BCRYPT_CHECK_TIMEOUT": 10.0,
+}
+
+
+class PasswordCheckBusy(Exception):
+    """The worker's bcrypt pool stayed full for BCRYPT_QUEUE_TIMEOUT seconds, or the check failed to finish"""
+
+
+def hash_with_cost(password, rounds):
+    """bcrypt hash of password at the given cost, in Flask-Bcrypt's format"""
+
+    return bcrypt_lib.hashpw(password.encode("utf-8"), bcrypt_lib.gensalt(rounds)).decode("utf-8")
+
+
+def check(hashed, password):
+    """True if password matches the bcrypt hash"""
+
+    try:
+        return bcrypt_lib.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        return False
+
+
+def cost_of(hashed):
+    """Work factor recorded in a bcrypt hash ($2b$12$... -> 12)"""
+
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _exit_with_parent(parent_pid):
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target = watch, name = "bcrypt-parent-watch", daemon = True).start()
+
+
+class _Pool:
+    """The process's bcrypt pool and the count of calls in or waiting for it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._key = None
+
+    def get(self, workers, pending):
+        with self._lock:
+            # a pool inherited across fork is unusable in the child
+            if self._executor is None or self._key != (os.getpid(), workers, pending):
+                if self._executor is not None and self._key[0] == os.getpid():
+                    self._executor.shutdown(wait = False)
+                self._executor = ProcessPoolExecutor(max_workers = workers,
+                    initializer = _exit_with_parent, initargs = (os.getpid(),))
+                self._slots = threading.BoundedSemaphore(workers + pending)
+                self._key = (os.getpid(), workers, pending)
+            return self._executor, self._slots
+
+    def discard(self, executor):
+        """Drop a broken pool so the next call starts a fresh one"""
+
+        with self._lock:
+            if self._executor is executor:
+                executor.shutdown(wait = False)
+                self._executor = None
+
+
+_pool = _Pool()
+
+
+def _run(func, *args):
+    config = current_app.config
+    if not config["BCRYPT_POOL_WORKERS"]:
+        return func(*args)
+
+    executor, slots = _pool.get(config["BCRYPT_POOL_WORKERS"], config["BCRYPT_MAX_PENDING"])
+    if not slots.acquire(timeout = config["BCRYPT_QUEUE_TIMEOUT"]):
+        raise PasswordCheckBusy()
+    try:
+        future = executor.submit(func, *args)
+        return future.result(timeout = config["BCRYPT_CHECK_TIMEOUT"])
+    except BrokenProcessPool:
+        _pool.discard(executor)
+        raise PasswordCheckBusy()
+    except TimeoutError:
+        future.cancel()
+        raise PasswordCheckBusy()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    """Hash a password at the configured cost"""
+
+    return _run(hash_with_cost, password, current_app.config["BCRYPT_LOG_ROUNDS"])
+
+
+def verify(hashed, password):
+    """Check a password in the worker's bcrypt pool.
+
+    Returns (matches, new_hash); new_hash is set when the stored hash used a
+    different cost than BCRYPT_LOG_ROUNDS and should replace it.
+    """
+
+    if not hashed or not _run(check, hashed, password):
+        return False, None
+
+    rounds = current_app.config["BCRYPT_LOG_ROUNDS"]
+    if cost_of(hashed) != rounds:
+        return True, _run(hash_with_cost, password, rounds)
+
+    return True, None
+
+
+def init_app(app):
+    if app.config.get("TESTING"):
+        app.config.setdefault("BCRYPT_POOL_WORKERS", 0)
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
@@ -0,0 +1,214 @@
+"""Read-replica routing.
+
+With DATABASE_REPLICA_URL set, the "replica" entry of SQLALCHEMY_BINDS points
+at a read-only copy of the database and the session picks an engine per
+statement:
+
+- GET and HEAD requests, and code inside use_replica() (report jobs, the
+  CLI exports), read from the replica
+- anything that writes - a flush, an INSERT/UPDATE/DELETE, SELECT ... FOR
+  UPDATE, raw SQL that is not a SELECT - goes to the primary, and so does
+  every later statement of the same session, so a request reads its own writes
+- after a request that wrote, the browser's session sticks to the primary for
+  REPLICA_STICKY_SECONDS, so the redirect that follows a form post does not
+  show the page from before the change
+
+Each worker checks the replica at most every REPLICA_LAG_CHECK_SECONDS. If it
+is unreachable, or on Postgres more than REPLICA_MAX_LAG seconds behind the
+primary, reads go to the primary until the next check says otherwise.
+Without DATABASE_REPLICA_URL everything runs on the primary as before.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm, text
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+import cache
+import sqlstats
+
+log = logging.getLogger(__name__)
+
+REPLICA = "replica"
+STICKY_KEY = "_db_primary_until"
+
+
+class ReplicaHealth:
+    """Per-worker result of the last replica check"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_at = None
+        self.healthy = False
+        self.lag = None
+
+    def reset(self):
+        with self._lock:
+            self.checked_at = None
+
+
+health = ReplicaHealth()
+
+
+def configured(app = None):
+    app = app or current_app
+    return REPLICA in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+def _replica_engine(app):
+    engine = get_state(app).db.get_engine(app, bind = REPLICA)
+    if not event.contains(engine, "connect", _read_only):
+        event.listen(engine, "connect", _read_only)
+    return engine
+
+
+def _read_only(dbapi_connection, connection_record):
+    # a real standby refuses writes by itself; this makes a plain copy do the same
+    cursor = dbapi_connection.cursor()
+    if "sqlite" in type(dbapi_connection).__module__:
+        cursor.execute("PRAGMA query_only = ON")
+    else:
+        cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+    cursor.close()
+
+
+def measure_lag(engine):
+    """Seconds the replica is behind the primary; 0 where the database cannot tell"""
+
+    with engine.connect() as connection:
+        if engine.dialect.name != "postgresql":
+            connection.execute(text("SELECT 1"))
+            return 0.0
+        lag = connection.execute(text(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END")).scalar()
+        return float(lag)
+
+
+def replica_healthy(app):
+    """Whether reads may go to the replica right now; re-checked every REPLICA_LAG_CHECK_SECONDS"""
+
+    now = time.monotonic()
+    with health._lock:
+        if health.checked_at is not None and now - health.checked_at < app.config["REPLICA_LAG_CHECK_SECONDS"]:
+            return health.healthy
+        # the other threads keep the old answer while this one checks
+        health.checked_at = now
+
+    try:
+        # housekeeping, not part of whatever request happens to trigger it
+        with sqlstats.unaccounted():
+            lag = measure_lag(_replica_engine(app))
+        healthy = lag <= app.config["REPLICA_MAX_LAG"]
+    except Exception as exc:
+        log.warning("replica check failed, reading from the primary: %s", exc)
+        lag, healthy = None, False
+
+    if lag is not None and not healthy and health.healthy:
+        log.warning("replica %.1fs behind, reading from the primary", lag)
+    health.lag, health.healthy = lag, healthy
+
+    return healthy
+
+
+def _writes(clause):
+    if clause is None:
+        return False
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith("SELECT")
+    return getattr(clause, "_for_update_arg", None) is not None
+
+
+def _reads_allowed():
+    return g.get("_db_replica", False)
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends reads to the replica bind and everything else to the primary"""
+
+    def __init__(self, db, **options):
+        self.wrote = False
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper = None, clause = None):
+        if self.wrote or self._flushing or not self._is_clean() or _writes(clause) or mapper is not None and clause is None:
+            self.wrote = True
+            return super().get_bind(mapper, clause)
+
+        if not configured(self.app) or not _reads_allowed():
+            return super().get_bind(mapper, clause)
+        if not replica_healthy(self.app):
+            cache.state.stats["replica.fallback"] += 1
+            return super().get_bind(mapper, clause)
+
+        cache.state.stats["replica.read"] += 1
+        return _replica_engine(self.app)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_ = RoutingSession, db = self, **options)
+
+
+@contextmanager
+def use_replica():
+    """Send this block's reads to the replica, e.g. in a report job or CLI command"""
+
+    previous = g.get("_db_replica", False)
+    g._db_replica = True
+    try:
+        yield
+    finally:
+        g._db_replica = previous
+
+
+@contextmanager
+def use_primary():
+    """Keep this block's reads on the primary, e.g. a GET that must see the latest data"""
+
+    previous = g.get("_db_replica", False)
+    g._db_replica = False
+    try:
+        yield
+    finally:
+        g._db_replica = previous
+
+
+def _route_request():
+    # static files never query, and reading the session would add Vary: Cookie to them
+    if not configured() or request.endpoint in ("static", "assets"):
+        return
+    sticky_until = session.get(STICKY_KEY)
+    if sticky_until is not None and sticky_until <= time.time():
+        session.pop(STICKY_KEY)
+        sticky_until = None
+    g._db_replica = request.method in ("GET", "HEAD") and sticky_until is None
+
+
+def _remember_writes(response):
+    from models import db
+
+    if configured() and db.session.registry.has() and db.session().wrote:
+        session[STICKY_KEY] = time.time() + current_app.config["REPLICA_STICKY_SECONDS"]
+    return response
+
+
+def init_app(app):
+    if app.config.get("DATABASE_REPLICA_URL"):
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.setdefault(REPLICA, app.config["DATABASE_REPLICA_URL"])
+        app.config["SQLALCHEMY_BINDS"] = binds
+    app.config.setdefault("REPLICA_MAX_LAG", 5.0)
+    app.config.setdefault("REPLICA_LAG_CHECK_SECONDS", 5.0)
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 10)
+
+    app.before_request(_route_request)
+    app.after_request(_remember_writes)
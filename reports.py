@@ -0,0 +1,170 @@
+"""Read queries behind the admin reporting views"""
+
+import csv
+import io
+import tempfile
+from collections import defaultdict
+
+from sqlalchemy.orm import selectinload
+
+from models import db, Cert, Employee, Location, Training, employee_certification, employee_location
+
+
+def dashboard_rows(employees):
+    """Return (employee, [(cert_name, due_date), ...]) for a page of employees.
+
+    The page comes from employee_list_query() through paginate_request(), with
+    locations preloaded; their certifications are one more query, so the
+    dashboard never loads more than a page of employees or their rows.
+    """
+
+    certs = (db.session.query(employee_certification.employee_id, Cert.cert_name, employee_certification.due_date)
+        .join(Cert, Cert.id == employee_certification.cert_id)
+        .filter(employee_certification.employee_id.in_([employee.id for employee in employees]))
+        .order_by(employee_certification.employee_id, employee_certification.due_date)
+        .all()) if employees else []
+
+    certs_by_employee = defaultdict(list)
+    for employee_id, cert_name, due_date in certs:
+        certs_by_employee[employee_id].append((cert_name, due_date))
+
+    return [(employee, certs_by_employee[employee.id]) for employee in employees]
+
+
+#######################################################################
+# admin list views: filters are applied in SQL, sort keys end in the primary key
+
+EMPLOYEE_SORTS = {
+    "name": (Employee.last_name, Employee.first_name, Employee.id),
+    "hired": (Employee.hire_date, Employee.id),
+}
+
+LOCATION_SORTS = {
+    "name": (Location.site_name, Location.id),
+    "state": (Location.state, Location.site_name, Location.id),
+}
+
+CERT_SORTS = {
+    "name": (Cert.cert_name, Cert.id),
+}
+
+TRAINING_SORTS = {
+    "date": (Training.date, Training.time, Training.id),
+    "name": (Training.name, Training.id),
+}
+
+
+def employee_list_query(location_id = None, cert_id = None, is_admin = None, hired_from = None, hired_to = None):
+    """Employees matching the admin list filters, locations preloaded"""
+
+    query = Employee.query.options(selectinload(Employee.locations))
+
+    if location_id is not None:
+        query = query.filter(Employee.id.in_(
+            db.session.query(employee_location.c.employee_id).filter(employee_location.c.location_id == location_id)))
+    if cert_id is not None:
+        query = query.filter(Employee.id.in_(
+            db.session.query(employee_certification.employee_id).filter(employee_certification.cert_id == cert_id)))
+    if is_admin is not None:
+        query = query.filter(Employee.is_admin == is_admin)
+    if hired_from is not None:
+        query = query.filter(Employee.hire_date >= hired_from)
+    if hired_to is not None:
+        query = query.filter(Employee.hire_date <= hired_to)
+
+    return query
+
+
+def location_list_query(state = None):
+    query = Location.query
+    if state:
+        query = query.filter(Location.state == state.upper())
+    return query
+
+
+def cert_list_query(expire = None, is_required = None):
+    query = Cert.query
+    if expire is not None:
+        query = query.filter(Cert.expire == expire)
+    if is_required is not None:
+        query = query.filter(Cert.is_required == is_required)
+    return query
+
+
+def training_list_query(date_from = None, date_to = None, state = None):
+    query = Training.query
+    if date_from is not None:
+        query = query.filter(Training.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Training.date <= date_to)
+    if state:
+        query = query.filter(Training.state == state.upper())
+    return query
+
+
+#######################################################################
+# compliance export: employees x certs x locations x due dates, streamed
+
+EXPORT_HEADER = ["Employee ID", "First Name", "Last Name", "Email", "Certification", "Received", "Due Date", "Location"]
+EXPORT_BATCH = 2000
+
+
+def compliance_export_rows():
+    """Every employee certification with its employee and locations.
+
+    yield_per streams the result (a server-side cursor on Postgres), so memory
+    stays flat however many rows there are.
+    """
+
+    return (db.session.query(
+            Employee.id, Employee.first_name, Employee.last_name, Employee.email,
+            Cert.cert_name, employee_certification.received, employee_certification.due_date, Location.site_name)
+        .join(employee_certification, employee_certification.employee_id == Employee.id)
+        .join(Cert, Cert.id == employee_certification.cert_id)
+        .outerjoin(employee_location, employee_location.c.employee_id == Employee.id)
+        .outerjoin(Location, Location.id == employee_location.c.location_id)
+        .order_by(Employee.id, employee_certification.due_date)
+        .yield_per(EXPORT_BATCH))
+
+
+def stream_csv(rows):
+    """Yield CSV text a batch of rows at a time"""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+
+    for count, row in enumerate(rows, start = 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def stream_xlsx(rows, chunk_size = 64 * 1024):
+    """Yield an XLSX workbook of rows.
+
+    A workbook is a zip archive, so it cannot go out before the last row is
+    written; openpyxl's write-only mode spools it to disk instead of memory
+    and the finished file is then streamed in chunks.
+    """
+
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only = True)
+    sheet = workbook.create_sheet("Certifications")
+    sheet.append(EXPORT_HEADER)
+    for row in rows:
+        sheet.append(list(row))
+
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,206 @@
+"""Type-ahead employee search.
+
+Matches every word of the query against an employee's first and last name,
+username and email, then fills up the remaining slots with employees at a
+location whose site name matches. The index depends on the database:
+
+- Postgres: pg_trgm GIN indexes on the lowercased name/username/email text
+  and on site names, so "%mit%" is an index lookup rather than a scan.
+- SQLite: an FTS5 table kept in step with employees by triggers, with
+  prefix indexes so each word matches the start of a name, username or
+  email part ("ann smi" finds Ann Smith). Its best-ranked hits come first.
+
+A one- or two-letter query matches most of the table under either index,
+so it is answered instead from last names starting with it, read off an
+index on last_name in name order.
+
+They are created by the search_indexes and search_prefix_index migrations;
+`flask search-index` creates and refills them on a database built with
+db.create_all(). Without them the search falls back to LIKE scans.
+"""
+
+import re
+
+import click
+from sqlalchemy import case, func, literal_column, or_, text
+from sqlalchemy.orm import selectinload
+
+from models import db, Employee, Location, employee_location
+
+# must match the indexed expression in the migration character for character
+DOCUMENT = "lower(first_name || ' ' || last_name || ' ' || username || ' ' || email)"
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_employees_search_trgm ON employees USING gin (({DOCUMENT}) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_locations_site_name_trgm ON locations USING gin (lower(site_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_employees_last_name_prefix ON employees (lower(last_name) text_pattern_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS employee_search USING fts5("
+    "first_name, last_name, username, email, content='employees', content_rowid='id', prefix='1 2 3')",
+    "CREATE TRIGGER IF NOT EXISTS employee_search_insert AFTER INSERT ON employees BEGIN "
+    "INSERT INTO employee_search(rowid, first_name, last_name, username, email) "
+    "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END",
+    "CREATE TRIGGER IF NOT EXISTS employee_search_delete AFTER DELETE ON employees BEGIN "
+    "INSERT INTO employee_search(employee_search, rowid, first_name, last_name, username, email) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); END",
+    "CREATE TRIGGER IF NOT EXISTS employee_search_update AFTER UPDATE ON employees BEGIN "
+    "INSERT INTO employee_search(employee_search, rowid, first_name, last_name, username, email) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.username, old.email); "
+    "INSERT INTO employee_search(rowid, first_name, last_name, username, email) "
+    "VALUES (new.id, new.first_name, new.last_name, new.username, new.email); END",
+    "CREATE INDEX IF NOT EXISTS ix_employees_last_name_prefix ON employees (last_name COLLATE NOCASE, first_name, id)",
+]
+
+MAX_LIMIT = 50
+FTS_CANDIDATES = 200
+# queries this short or shorter go to the last-name prefix index
+SHORT_QUERY = 2
+
+# database url -> whether it has the FTS table, looked up once per process
+_fts_ready = {}
+
+
+def tokens(query):
+    """Lowercased words of the query, split the way the FTS5 tokenizer splits text"""
+
+    return [token for token in re.split(r"\W+", query.lower()) if token]
+
+
+def _like_escape(token):
+    return token.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _has_fts():
+    url = str(db.engine.url)
+    if url not in _fts_ready:
+        found = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_search'")).first()
+        _fts_ready[url] = found is not None
+    return _fts_ready[url]
+
+
+def _name_matches_prefix(word, limit):
+    pattern = _like_escape(word) + "%"
+    if db.engine.dialect.name == "sqlite":
+        # LIKE is case-insensitive here, so the NOCASE index serves it and the order
+        last_name = Employee.last_name.collate("NOCASE")
+        match = Employee.last_name.like(pattern, escape = "\\")
+    else:
+        last_name = func.lower(Employee.last_name)
+        match = last_name.like(pattern, escape = "\\")
+
+    rows = (db.session.query(Employee.id)
+        .filter(match)
+        .order_by(last_name, Employee.first_name, Employee.id)
+        .limit(limit))
+    return [row[0] for row in rows]
+
+
+def _name_matches_fts(words, limit):
+    match = " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+    # the FTS_CANDIDATES best-ranked hits, best first, then by name among equals
+    rows = db.session.execute(text(
+        "SELECT employees.id FROM "
+        "(SELECT rowid, rank FROM employee_search WHERE employee_search MATCH :match "
+        "ORDER BY rank LIMIT :candidates) AS hits "
+        "JOIN employees ON employees.id = hits.rowid "
+        "ORDER BY hits.rank, employees.last_name, employees.first_name, employees.id LIMIT :limit"),
+        {"match": match, "candidates": FTS_CANDIDATES, "limit": limit})
+    return [row[0] for row in rows]
+
+
+def _name_matches_like(words, limit):
+    document = literal_column(DOCUMENT)
+    first = _like_escape(words[0]) + "%"
+    # names, usernames and emails starting with the first word rank above matches inside them
+    starts = case([(or_(func.lower(Employee.last_name).like(first, escape = "\\"),
+        func.lower(Employee.first_name).like(first, escape = "\\"),
+        func.lower(Employee.username).like(first, escape = "\\"),
+        func.lower(Employee.email).like(first, escape = "\\")), 0)], else_ = 1)
+
+    rows = (db.session.query(Employee.id)
+        .filter(*(document.like(f"%{_like_escape(word)}%", escape = "\\") for word in words))
+        .order_by(starts, Employee.last_name, Employee.first_name, Employee.id)
+        .limit(limit))
+    return [row[0] for row in rows]
+
+
+def _site_matches(query, exclude, limit):
+    pattern = f"%{_like_escape(' '.join(tokens(query)))}%"
+    location_ids = [row[0] for row in
+        db.session.query(Location.id).filter(func.lower(Location.site_name).like(pattern, escape = "\\"))]
+    if not location_ids:
+        return []
+
+    rows = (db.session.query(employee_location.c.employee_id)
+        .filter(employee_location.c.location_id.in_(location_ids))
+        # (location_id, id) is the order of ix_emp_loc_location, so no sort is needed
+        .order_by(employee_location.c.location_id, employee_location.c.id)
+        .limit(limit + len(exclude) + 1))
+
+    ids = []
+    for (employee_id,) in rows:
+        if employee_id not in exclude and employee_id not in ids:
+            ids.append(employee_id)
+    return ids[:limit]
+
+
+def search_employees(query, limit = 10):
+    """Up to limit employees matching query, best matches first, with their locations loaded"""
+
+    words = tokens(query)
+    limit = max(1, min(limit, MAX_LIMIT))
+    if not words:
+        return []
+
+    if len(words) == 1 and len(words[0]) <= SHORT_QUERY:
+        ids = _name_matches_prefix(words[0], limit)
+    elif db.engine.dialect.name == "sqlite" and _has_fts():
+        ids = _name_matches_fts(words, limit)
+    else:
+        ids = _name_matches_like(words, limit)
+    if len(ids) < limit:
+        ids += _site_matches(query, set(ids), limit - len(ids))
+    if not ids:
+        return []
+
+    employees = {employee.id: employee for employee in
+        Employee.query.options(selectinload(Employee.locations)).filter(Employee.id.in_(ids))}
+    return [employees[employee_id] for employee_id in ids if employee_id in employees]
+
+
+def as_json(employee):
+    return {
+        "id": employee.id,
+        "first_name": employee.first_name,
+        "last_name": employee.last_name,
+        "username": employee.username,
+        "email": employee.email,
+        "locations": [location.site_name for location in employee.locations],
+    }
+
+
+def create_indexes():
+    """Create the search indexes for the current database if they are missing"""
+
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    elif dialect == "sqlite":
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO employee_search(employee_search) VALUES ('rebuild')"))
+        _fts_ready[str(db.engine.url)] = True
+
+
+def init_app(app):
+    @app.cli.command("search-index")
+    def search_index():
+        """Create (or refill) the employee search indexes."""
+
+        create_indexes()
+        db.session.commit()
+        click.echo(f"Search indexes ready on {db.engine.dialect.name}")
@@ -0,0 +1,183 @@
+"""Per-request SQL accounting.
+
+SQLAlchemy cursor events count every statement a request runs and how long
+the database spent on it. Each response carries X-Query-Count and X-DB-Time
+headers and one log line; the slowest statements are logged when a request
+goes over SQL_SLOW_REQUEST_MS. Views can declare a budget with
+@query_budget(n); going over it logs a warning, and raises
+QueryBudgetExceeded when SQL_BUDGET_STRICT is on (the default under TESTING)
+so a regression into N+1 fails the test suite (see tests.py).
+
+The stats live in the WSGI environ rather than on g, so the statements a
+streamed body runs after the view returned (exports, iCalendar feeds) are
+counted too. The headers can only carry what ran before the body started;
+the log line, the endpoint totals and the budget check wait until the
+response is closed.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+SLOWEST_KEPT = 5
+ENVIRON_KEY = "mycerts.sql_stats"
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more SQL statements than its declared budget"""
+
+
+class RequestStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        item = (elapsed, self.count, statement)
+        if len(self.slowest) < SLOWEST_KEPT:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def slowest_first(self):
+        return [(elapsed, statement) for elapsed, _, statement in sorted(self.slowest, reverse = True)]
+
+
+class EndpointTotals:
+    """Running totals per endpoint for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, endpoint, stats):
+        with self._lock:
+            totals = self._totals.setdefault(endpoint, {"requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0})
+            totals["requests"] += 1
+            totals["queries"] += stats.count
+            totals["db_ms"] += stats.total * 1000
+            totals["max_queries"] = max(totals["max_queries"], stats.count)
+
+    def summary(self):
+        with self._lock:
+            return {endpoint: dict(totals,
+                    avg_queries = totals["queries"] / totals["requests"],
+                    avg_db_ms = totals["db_ms"] / totals["requests"])
+                for endpoint, totals in self._totals.items()}
+
+
+endpoint_totals = EndpointTotals()
+
+
+def query_budget(limit):
+    """Declare the most SQL statements a view may run per request"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapper.query_budget = limit
+        return wrapper
+
+    return decorator
+
+
+def current_stats():
+    """Stats of the running request, or None outside of one"""
+
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+    return None
+
+
+@contextmanager
+def unaccounted():
+    """Leave this block's statements out of the running request's stats and budget"""
+
+    stats = request.environ.pop(ENVIRON_KEY, None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if stats is not None:
+            request.environ[ENVIRON_KEY] = stats
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_sqlstats_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["_sqlstats_start"].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def _start_request():
+    request.environ[ENVIRON_KEY] = RequestStats()
+
+
+def _finish_request(response):
+    stats = request.environ.get(ENVIRON_KEY)
+    if stats is None:
+        return response
+
+    response.headers["X-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Time"] = f"{stats.total * 1000:.1f}ms"
+
+    # the request context is gone by the time the response closes
+    view = current_app.view_functions.get(request.endpoint)
+    config = current_app.config
+    closing = {"environ": request.environ, "method": request.method, "path": request.path,
+        "endpoint": request.endpoint or "<none>", "budget": getattr(view, "query_budget", None),
+        "slow_ms": config["SQL_SLOW_REQUEST_MS"], "strict": config["SQL_BUDGET_STRICT"]}
+    response.call_on_close(lambda: _close_request(stats, **closing))
+
+    return response
+
+
+def _close_request(stats, environ, method, path, endpoint, budget, slow_ms, strict):
+    """Log, total and check the budget once the body has been sent and every statement counted"""
+
+    environ.pop(ENVIRON_KEY, None)
+    db_ms = stats.total * 1000
+    endpoint_totals.add(endpoint, stats)
+
+    log.info("%s %s [%s] %d queries, %.1fms in database", method, path, endpoint, stats.count, db_ms)
+    if db_ms >= slow_ms:
+        for elapsed, statement in stats.slowest_first():
+            log.warning("slow request %s: %.1fms %s", path, elapsed * 1000, " ".join(statement.split()))
+
+    if budget is not None and stats.count > budget:
+        message = f"{endpoint} ran {stats.count} queries, budget is {budget}"
+        if strict:
+            raise QueryBudgetExceeded(message)
+        log.warning(message)
+
+
+def init_app(app):
+    app.config.setdefault("SQL_SLOW_REQUEST_MS", 250)
+    app.config.setdefault("SQL_BUDGET_STRICT", app.config.get("TESTING", False))
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def summary_response():
+    """Per-endpoint totals for this worker process as JSON"""
+
+    return jsonify(endpoint_totals.summary())
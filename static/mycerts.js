@@ -1 +1,88 @@
 console.log("I'm here!")
+
+// Type-ahead for /api/employees/search: waits for a pause in typing and
+// cancels the request for the previous keystroke so results never arrive out of order
+function employeeTypeahead(input, results) {
+  let timer = null;
+  let pending = null;
+
+  function show(employees) {
+    results.innerHTML = "";
+    for (const employee of employees) {
+      const link = document.createElement("a");
+      link.className = "list-group-item list-group-item-action";
+      link.href = `/ad/edit-user/${employee.id}`;
+      link.textContent = `${employee.first_name} ${employee.last_name} (${employee.username})`;
+      if (employee.locations.length) {
+        const sites = document.createElement("small");
+        sites.className = "text-muted ms-2";
+        sites.textContent = employee.locations.join(", ");
+        link.appendChild(sites);
+      }
+      results.appendChild(link);
+    }
+  }
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    if (pending) pending.abort();
+    const query = input.value.trim();
+    if (!query) return show([]);
+
+    timer = setTimeout(async () => {
+      pending = new AbortController();
+      try {
+        const response = await fetch(`/api/employees/search?q=${encodeURIComponent(query)}`, {signal: pending.signal});
+        if (response.ok) show((await response.json()).results);
+      } catch (err) {
+        if (err.name !== "AbortError") throw err;
+      }
+    }, 150);
+  });
+}
+
+// Line chart of an /api/hours/... series: hours per point and the running total
+// since the start of the range. Drawing again on the same canvas replaces the chart.
+async function hoursChart(canvas, url, title) {
+  const response = await fetch(url, {credentials: "same-origin"});
+  if (!response.ok) return;
+  const series = await response.json();
+  const per = series.width > 1 ? `${series.width} ${series.bucket}s` : series.bucket;
+
+  if (canvas.chart) canvas.chart.destroy();
+  canvas.chart = new Chart(canvas, {
+    type: "line",
+    data: {
+      labels: series.labels,
+      datasets: [
+        {label: `Hours per ${per}`, data: series.hours, borderColor: "#3e95cd", fill: false, pointRadius: 0},
+        {label: "Running total", data: series.cumulative, borderColor: "#8907b1", fill: false, pointRadius: 0}
+      ]
+    },
+    options: {title: {display: true, text: title}}
+  });
+}
+
+// Poll /api/jobs/<id> for every row with a data-job-id, updating its status
+// and progress bar, and reload the page once they have all finished.
+function watchJobs(rows) {
+  const pending = new Set(rows);
+  if (!pending.size) return;
+
+  const poll = async () => {
+    for (const row of [...pending]) {
+      const response = await fetch(`/api/jobs/${row.dataset.jobId}`, {credentials: "same-origin"});
+      if (!response.ok) continue;
+      const job = await response.json();
+      row.querySelector(".job-status").textContent = job.status;
+      row.querySelector(".job-message").textContent = job.message || "";
+      const bar = row.querySelector(".progress-bar");
+      bar.style.width = `${job.progress}%`;
+      bar.textContent = `${job.progress}%`;
+      if (job.status !== "queued" && job.status !== "running") pending.delete(row);
+    }
+    if (pending.size) setTimeout(poll, 2000);
+    else window.location.reload();
+  };
+  setTimeout(poll, 2000);
+}
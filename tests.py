@@ -0,0 +1,919 @@
+"""Tests for MyCerts.
+
+Run with `python -m pytest tests.py`. The app is built from the "testing"
+profile on a temporary SQLite file, so SQL_BUDGET_STRICT is on and any view
+that runs more statements than its @query_budget fails here.
+"""
+
+import gzip
+import importlib
+import io
+import os
+import runpy
+import shutil
+import socket
+from datetime import date, datetime, time, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from flask import Response, current_app, stream_with_context
+
+from app import create_app, CURR_USER_KEY
+from models import db, Cert, CertHistory, ComplianceSummary, Employee, Enrollment, HoursEntry, Job, Location, Outbox, Training, employee_certification, employee_location
+from sqlstats import QueryBudgetExceeded, query_budget
+import assets
+import cache
+import cert_archive
+import cert_assignment
+import compliance
+import config
+import due_dates
+import forecast
+import hours
+import hours_series
+import identity
+import jobs
+import mailer
+import pagination
+import passwords
+import replicas
+import reports
+import search
+import training_calendar
+
+
+@pytest.fixture(scope = "module")
+def app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("mycerts")
+    app = create_app("testing", SQLALCHEMY_DATABASE_URI = f"sqlite:///{folder / 'test.db'}",
+        JOBS_OUTPUT_DIR = str(folder / "jobs"), LOAD_MIGRATE = False)
+
+    with app.app_context():
+        db.create_all()
+        seed()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def seed():
+    """Two sites, three certs, a dozen employees with certs and hours, two trainings and a finished export"""
+
+    today = date.today()
+    sites = [Location("North Plant", "Denver", "CO"), Location("South Plant", "Austin", "TX")]
+    certs = [Cert("First Aid", 4, True, True, 2, "years"), Cert("Forklift", 8, True, True, 3, "years"),
+        Cert("Orientation", 2, False, False, None, None)]
+    admin = Employee("admin", "x", "admin@example.com", "Ada", "Admin", today - timedelta(days = 900), True)
+    staff = [Employee(f"user{number}", "x", f"user{number}@example.com", f"First{number}", f"Last{number}",
+            today - timedelta(days = 30 * number), False)
+        for number in range(11)]
+    db.session.add_all(sites + certs + [admin] + staff)
+    db.session.flush()
+
+    for number, employee in enumerate([admin] + staff):
+        db.session.execute(employee_location.insert().values(employee_id = employee.id, location_id = sites[number % 2].id))
+        for offset, cert in enumerate(certs):
+            received = today - timedelta(days = 200 * (number % 4) + 30 * offset)
+            db.session.add(employee_certification(employee.id, cert.id, received,
+                received + timedelta(days = 365 * cert.good_for_time) if cert.expire else None))
+        hours.record(employee.id, 2 + number % 3, today - timedelta(days = number), hours.ADJUSTMENT)
+
+    db.session.add_all([
+        Training("Forklift Refresher", "Denver", "CO", "Room 1", 4, today + timedelta(days = 7), time(9), capacity = 10),
+        Training("CPR", "Austin", "TX", "Room 2", 2, today + timedelta(days = 14), time(13)),
+    ])
+    compliance.rebuild()
+    db.session.commit()
+
+    jobs.enqueue("export-compliance", fmt = "csv")
+    db.session.commit()
+    jobs.JobWorker(current_app._get_current_object(), "tests", schedule = False).run(once = True)
+
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        admin = Employee.query.filter_by(username = "admin").one()
+        employee = Employee.query.filter_by(username = "user1").one()
+        return {
+            "admin": admin.id,
+            "employee": employee.id,
+            "location": Location.query.first().id,
+            "job": jobs.recent(1)[0].id,
+            "location_token": training_calendar.feed_token("location", Location.query.first().id),
+            "employee_token": training_calendar.feed_token("employee", employee.id),
+            "start": date.today().isoformat(),
+            "end": (date.today() + timedelta(days = 30)).isoformat(),
+        }
+
+
+def client_for(app, employee_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = employee_id
+    return client
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.pop("_flashes", [])]
+
+
+@pytest.fixture
+def admin_client(app, ids):
+    return client_for(app, ids["admin"])
+
+
+def cold():
+    """Forget cached pages and identities, so each request runs every query it can"""
+
+    cache.state.backend.clear()
+    identity.snapshots.clear()
+
+
+BUDGETED = {
+    "mycerts.display_certs": "/mycerts/{employee}",
+    "mycerts.display_cert_history": "/mycerts/{employee}/history",
+    "mycerts.display_hours": "/hours/{employee}",
+    "mycerts.hours_over_time": "/api/hours/location/{location}",
+    "mycerts.list_jobs": "/api/jobs",
+    "mycerts.job_status": "/api/jobs/{job}",
+    "mycerts.display_training": "/training",
+    "mycerts.training_events": "/api/trainings?start={start}&end={end}&location={location}",
+    "mycerts.location_training_feed": "/calendar/location/{location}.ics?token={location_token}",
+    "mycerts.employee_training_feed": "/calendar/employee/{employee}.ics?token={employee_token}",
+    "mycerts.show_all_information": "/administrator",
+    "mycerts.export_certifications": "/administrator/export/csv",
+    "mycerts.show_forecast": "/administrator/forecast",
+    "mycerts.show_jobs": "/administrator/jobs",
+    "mycerts.download_job_output": "/administrator/jobs/{job}/download",
+    "mycerts.search_employees": "/api/employees/search?q=la",
+    "mycerts.show_all_employees": "/employees",
+    "mycerts.show_all_locations": "/locations",
+    "mycerts.show_all_certifications": "/certifications",
+    "mycerts.show_all_training": "/trainings",
+}
+
+EXTRA_URLS = [
+    "/api/hours/employee/{employee}",
+    "/administrator/export/xlsx",
+    "/administrator/forecast?by=cert",
+    "/employees?location={location}",
+]
+
+
+def test_every_budgeted_route_is_covered(app):
+    budgeted = {endpoint for endpoint, view in app.view_functions.items() if hasattr(view, "query_budget")}
+    assert budgeted == set(BUDGETED)
+
+
+@pytest.mark.parametrize("url", list(BUDGETED.values()) + EXTRA_URLS)
+def test_route_stays_within_query_budget(admin_client, ids, url):
+    cold()
+    # buffered closes the response before returning, which is when the budget is checked
+    response = admin_client.get(url.format(**ids), buffered = True)
+
+    assert response.status_code == 200, response.data[:200]
+
+
+@pytest.fixture
+def scratch_app(app, tmp_path):
+    """A second app on an empty database, for routes the tests add themselves"""
+
+    scratch = create_app("testing", SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'scratch.db'}",
+        JOBS_OUTPUT_DIR = str(tmp_path / "jobs"), LOAD_MIGRATE = False)
+    # the scoped session is per thread, not per app: start one bound to the scratch app
+    db.session.remove()
+    with scratch.app_context():
+        db.create_all()
+        yield scratch
+        db.session.remove()
+
+
+def test_over_budget_fails(scratch_app):
+    @query_budget(1)
+    def chatty():
+        return str([Employee.query.count() for _ in range(3)])
+
+    scratch_app.add_url_rule("/_tests/chatty", "chatty", chatty)
+    with pytest.raises(QueryBudgetExceeded):
+        scratch_app.test_client().get("/_tests/chatty", buffered = True)
+
+
+def test_streamed_body_counts_toward_budget(scratch_app):
+    @query_budget(1)
+    def streamed():
+        def body():
+            for _ in range(3):
+                yield f"{Employee.query.count()}\n"
+        return Response(stream_with_context(body()))
+
+    scratch_app.add_url_rule("/_tests/streamed", "streamed", streamed)
+    with pytest.raises(QueryBudgetExceeded):
+        scratch_app.test_client().get("/_tests/streamed", buffered = True)
+
+
+def test_bcrypt_runs_in_a_bounded_pool(app, monkeypatch):
+    monkeypatch.setitem(app.config, "BCRYPT_POOL_WORKERS", 1)
+    monkeypatch.setitem(app.config, "BCRYPT_MAX_PENDING", 0)
+    monkeypatch.setitem(app.config, "BCRYPT_QUEUE_TIMEOUT", 0.01)
+    hashed = passwords.hash_with_cost("secret", 4)
+
+    assert passwords.verify(hashed, "secret") == (True, None)
+    executor, slots = passwords._pool.get(1, 0)
+    slots.acquire()
+    try:
+        with pytest.raises(passwords.PasswordCheckBusy):
+            passwords.verify(hashed, "secret")
+    finally:
+        slots.release()
+
+
+def test_bcrypt_pool_survives_a_killed_slot_holder(app, monkeypatch):
+    monkeypatch.setitem(app.config, "BCRYPT_POOL_WORKERS", 1)
+    monkeypatch.setitem(app.config, "BCRYPT_MAX_PENDING", 0)
+    monkeypatch.setitem(app.config, "BCRYPT_QUEUE_TIMEOUT", 1.0)
+    hashed = passwords.hash_with_cost("secret", 4)
+
+    # the pool process holding the only slot dies mid-call
+    with pytest.raises(passwords.PasswordCheckBusy):
+        passwords._run(os._exit, 1)
+    assert passwords.verify(hashed, "secret") == (True, None)
+    assert passwords.verify(hashed, "wrong") == (False, None)
+
+
+class Mailbox:
+    """aiosmtpd handler that keeps what it receives and refuses one recipient"""
+
+    def __init__(self, refused):
+        self.refused = refused
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == self.refused:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def smtp_server(app, monkeypatch):
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    mailbox = Mailbox(refused = "nobody@example.com")
+    controller = controller_module.Controller(mailbox, hostname = "127.0.0.1", port = port)
+    controller.start()
+    for key, value in {"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": port, "MAIL_USE_TLS": False,
+            "MAIL_USERNAME": None, "MAIL_DEFAULT_SENDER": "mycerts@example.com"}.items():
+        monkeypatch.setitem(app.config, key, value)
+    yield mailbox
+    controller.stop()
+    Outbox.query.delete()
+    db.session.commit()
+
+
+def test_outbox_delivers_over_smtp(app, smtp_server):
+    sent = mailer.queue_email("user1@example.com", "Forklift expires soon", "Renew by Friday.", "<p>Renew by Friday.</p>")
+    refused = mailer.queue_email("nobody@example.com", "Welcome", "Hello.")
+    # a row whose sender died mid-batch: its lease has run out
+    abandoned = mailer.queue_email("user2@example.com", "Reminder", "Training tomorrow.")
+    db.session.flush()
+    abandoned.status, abandoned.attempts, abandoned.next_attempt_at = mailer.SENDING, 1, datetime.utcnow() - timedelta(seconds = 1)
+    db.session.commit()
+    ids = [sent.id, refused.id, abandoned.id]
+
+    mailer.OutboxWorker(app).run(once = True)
+
+    rows = {row.id: row for row in Outbox.query.filter(Outbox.id.in_(ids))}
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp_server.messages) == ["user1@example.com", "user2@example.com"]
+    assert (rows[sent.id].status, rows[sent.id].attempts) == (mailer.SENT, 1)
+    assert (rows[abandoned.id].status, rows[abandoned.id].attempts) == (mailer.SENT, 2)
+    assert rows[refused.id].status == mailer.PENDING
+    assert rows[refused.id].next_attempt_at > datetime.utcnow()
+    assert "No such user" in rows[refused.id].last_error
+
+
+def test_sender_needs_mail_configured(app, monkeypatch):
+    monkeypatch.setitem(app.config, "MAIL_DEFAULT_SENDER", None)
+    assert not mailer.is_configured(app.config)
+
+
+def summary_counts():
+    return {(row.location_id, row.cert_id, row.bucket): row.count
+        for row in ComplianceSummary.query.filter(ComplianceSummary.count > 0)}
+
+
+def test_upload_is_imported_by_a_job(app, admin_client):
+    received = (date.today() - timedelta(days = 700)).isoformat()
+    upload = ("username,password,email,first_name,last_name,hire_date,location,cert,received\n"
+        f"newhire1,password1,newhire1@example.com,New,Hire,2024-01-02,North Plant,First Aid,{received}\n"
+        f"newhire2,password2,newhire2@example.com,Next,Hire,2024-01-03,South Plant,Orientation,{received}\n"
+        f"user1,password3,dupe@example.com,Dupe,Hire,2024-01-04,North Plant,First Aid,{received}\n")
+
+    response = admin_client.post("/ad/import", data = {"file": (io.BytesIO(upload.encode()), "staff.csv")},
+        content_type = "multipart/form-data")
+    job_id = db.session.query(db.func.max(Job.id)).scalar()
+    assert response.status_code == 302 and response.location.endswith(f"/ad/import?job={job_id}")
+    assert Employee.query.filter_by(username = "newhire1").first() is None
+
+    jobs.JobWorker(app, "tests", schedule = False).run(once = True)
+
+    job = Job.query.get(job_id)
+    result = jobs.result_of(job)
+    assert (job.status, result["imported"], result["rejected"]) == (jobs.DONE, 2, 1)
+    assert not os.listdir(os.path.join(app.config["JOBS_OUTPUT_DIR"], "uploads"))
+    # the counts bumped per chunk match a full rebuild
+    bumped = summary_counts()
+    compliance.rebuild()
+    assert bumped == summary_counts()
+    db.session.rollback()
+
+    page = admin_client.get(f"/ad/import?job={job.id}")
+    assert b"Imported 2 employees" in page.data and b"Already in use: user1" in page.data
+
+
+def test_training_is_credited_once(app, ids):
+    training = Training.query.filter_by(name = "Forklift Refresher").one()
+    staff = [employee_id for (employee_id,) in db.session.query(Employee.id).filter(Employee.is_admin == False)
+        .order_by(Employee.id).limit(3)]
+    db.session.add_all([Enrollment(training.id, employee_id) for employee_id in staff])
+    db.session.commit()
+    before = hours.employee_hours(staff[0])["total"]
+
+    # one employee was credited by someone else after this request listed the attendees
+    to_credit = hours.attendees_to_credit(training.id)
+    assert hours.record(staff[0], training.hours, training.date, hours.TRAINING, training_id = training.id)
+    assert hours.record_training(training, to_credit) == 2
+    assert hours.record(staff[0], training.hours, training.date, hours.TRAINING, training_id = training.id) is None
+    db.session.commit()
+
+    assert HoursEntry.query.filter_by(training_id = training.id).count() == 3
+    assert hours.employee_hours(staff[0])["total"] == before + training.hours
+
+
+def test_hours_cache_is_dropped_on_commit(app, ids):
+    tag = hours_series.scope_tag("employee", ids["employee"])
+    generation = cache.generation(tag)
+
+    hours.record(ids["employee"], 1, date.today(), hours.ADJUSTMENT)
+    assert cache.generation(tag) == generation
+    db.session.rollback()
+    db.session.commit()
+    assert cache.generation(tag) == generation
+
+    hours.record(ids["employee"], 1, date.today(), hours.ADJUSTMENT)
+    db.session.commit()
+    assert cache.generation(tag) != generation
+
+
+def test_dashboard_shows_a_page_of_employees(admin_client):
+    page = admin_client.get("/administrator?per_page=5")
+    assert page.status_code == 200 and b"Next Page" in page.data
+    assert b"First9 Last9" not in page.data
+
+    everyone = admin_client.get("/administrator?per_page=200")
+    assert b"First9 Last9" in everyone.data and b"Next Page" not in everyone.data
+
+
+def test_month_series_keeps_partial_months_to_the_range(app, ids):
+    for day, amount in ((date(2020, 1, 10), 1), (date(2020, 1, 20), 2), (date(2020, 2, 5), 4), (date(2020, 3, 3), 8),
+            (date(2020, 3, 25), 16)):
+        hours.record(ids["employee"], amount, day, hours.ADJUSTMENT)
+    db.session.commit()
+
+    series = hours_series.build("employee", ids["employee"], date(2020, 1, 15), date(2020, 3, 10), "month", 120)
+    assert series["labels"] == ["2020-01-01", "2020-02-01", "2020-03-01"]
+    assert series["hours"] == [2, 4, 8]
+    inside = hours_series.build("employee", ids["employee"], date(2020, 1, 5), date(2020, 1, 15), "month", 120)
+    assert inside["hours"] == [1]
+
+
+def test_forecast_counts_each_standing_once(app):
+    today = date.today()
+    cert = Cert.query.filter_by(cert_name = "Forklift").one()
+    north, south = Location.query.order_by(Location.id).all()
+    roaming = Employee("roaming", "x", "roaming@example.com", "Ro", "Aming", today, False)
+    remote = Employee("remote", "x", "remote@example.com", "Re", "Mote", today, False)
+    db.session.add_all([roaming, remote])
+    db.session.flush()
+    db.session.execute(employee_location.insert(), [{"employee_id": roaming.id, "location_id": north.id},
+        {"employee_id": roaming.id, "location_id": south.id}])
+    for employee in (roaming, remote):
+        db.session.add(employee_certification(employee.id, cert.id, today, today + timedelta(days = 10)))
+    db.session.flush()
+
+    table = forecast.load(today)
+    by_cert = forecast.forecast(table, "cert")
+    by_location = forecast.forecast(table, "location")
+    db.session.rollback()
+
+    # roaming has two rows, one per site, but one Forklift standing
+    due_soon = {employee_id for employee_id, cert_id, days in
+        zip(table.employee_id.tolist(), table.cert_id.tolist(), table.days.tolist())
+        if cert_id == cert.id and 0 <= days < compliance.DUE_SOON_DAYS}
+    assert dict(zip(by_cert.names.tolist(), by_cert.due_soon.tolist()))["Forklift"] == len(due_soon)
+    soon = dict(zip(by_location.names.tolist(), by_location.due_soon.tolist()))
+    assert soon[forecast.UNASSIGNED_NAME] == 1
+    assert soon["North Plant"] >= 1 and soon["South Plant"] >= 1
+
+
+def test_forecast_months_follow_the_weeks(app):
+    today = date(2026, 10, 18)
+    assert (forecast.months_for(52), forecast.months_for(8)) == (12, 2)
+    assert forecast.horizon_for(today, 8) == 56
+    # three monthly columns from October reach the end of December, past the eight weeks
+    assert forecast.horizon_for(today, 8, 3) == (date(2027, 1, 1) - today).days
+
+    result = forecast.forecast(forecast.load(today, forecast.horizon_for(today, 8)), weeks = 8)
+    assert result.monthly.shape[1] == 2 and result.month_labels() == ["2026-10", "2026-11"]
+
+
+def test_bulk_assignment_skips_existing_records(app):
+    cert = Cert.query.filter_by(cert_name = "Orientation").one()
+    received = date.today() - timedelta(days = 3)
+    staff = [employee_id for (employee_id,) in db.session.query(Employee.id).filter(Employee.is_admin == False)
+        .order_by(Employee.id).limit(3)]
+
+    assert cert_assignment.assign(cert, received, staff[:1]).assigned == 1
+    report = cert_assignment.assign(cert, received, staff)
+    again = cert_assignment.assign(cert, received, staff)
+    db.session.commit()
+
+    assert (report.assigned, report.already, again.assigned) == (2, 1, 0)
+    assert employee_certification.query.filter_by(cert_id = cert.id, received = received).count() == 3
+    credited = HoursEntry.query.filter_by(cert_id = cert.id, earned_on = received, source = hours.CERT)
+    assert sorted(entry.employee_id for entry in credited) == staff
+
+
+leases = []
+
+
+@jobs.task("test-lease")
+def lease_task(run):
+    # stand in for a task that has held SQLite's write lock past JOBS_STALE_SECONDS
+    stale = datetime.utcnow() - timedelta(hours = 1)
+    Job.query.filter_by(kind = "test-lease", status = jobs.RUNNING).update({"heartbeat_at": stale})
+    db.session.commit()
+    leases.append(db.session.query(Job.heartbeat_at).filter_by(kind = "test-lease").scalar() > stale)
+    assert jobs.requeue_stale() == 0
+
+
+def test_task_commits_renew_the_lease(app):
+    jobs.enqueue("test-lease")
+    db.session.commit()
+    jobs.JobWorker(app, "tests", schedule = False).run(once = True)
+
+    assert leases == [True]
+    assert Job.query.filter_by(kind = "test-lease").one().status == jobs.DONE
+    assert db.session.info.get(jobs.LEASE_KEY) is None
+
+
+def test_worker_runs_outside_the_web_process(app):
+    assert not app.config["JOBS_WORKER_THREAD"]
+    assert "jobs-worker" in app.cli.commands
+
+
+def test_cert_edit_recomputes_due_dates_in_the_request(app, admin_client):
+    cert = Cert.query.filter_by(cert_name = "Forklift").one()
+    queued = Job.query.count()
+    form = {"cert_name": cert.cert_name, "hours": cert.hours, "is_required": "y", "expire": "y"}
+
+    response = admin_client.post(f"/ad/edit-cert/{cert.id}", data = dict(form, good_for_time = 18, good_for_unit = "months"))
+    assert response.status_code == 302 and Job.query.count() == queued
+    db.session.expire_all()
+    held = employee_certification.query.filter_by(cert_id = cert.id).all()
+    assert held and all(row.due_date == due_dates.add_months(row.received, 18) for row in held)
+    recomputed = summary_counts()
+    compliance.rebuild()
+    assert recomputed == summary_counts()
+    db.session.rollback()
+
+    admin_client.post(f"/ad/edit-cert/{cert.id}", data = dict(form, good_for_time = 3, good_for_unit = "years"))
+
+
+def test_short_searches_read_last_names_in_order(app):
+    names = [employee.last_name for employee in search.search_employees("LA", 4)]
+    assert names == ["Last0", "Last1", "Last10", "Last2"]
+    assert search.search_employees("l_", 4) == []
+
+
+def test_search_index_lookup_is_cached(app):
+    url = str(db.engine.url)
+    search._fts_ready.pop(url, None)
+    assert [employee.username for employee in search.search_employees("last10")] == ["user10"]
+    assert search._fts_ready[url] is False
+
+    search.create_indexes()
+    db.session.commit()
+    assert search._fts_ready[url] is True
+    assert [employee.username for employee in search.search_employees("first3 last3")] == ["user3"]
+
+
+def test_admin_flag_change_reaches_the_next_request(app, ids, admin_client):
+    employee = Employee.query.get(ids["employee"])
+    client = client_for(app, employee.id)
+    form = {"email": employee.email, "first_name": employee.first_name, "last_name": employee.last_name,
+        "hire_date": employee.hire_date.isoformat()}
+
+    # the first request caches the employee's snapshot
+    assert client.get("/administrator").status_code == 302
+    admin_client.post(f"/ad/edit-user/{employee.id}", data = dict(form, is_admin = "y"))
+    assert client.get("/administrator").status_code == 200
+
+    admin_client.post(f"/ad/edit-user/{employee.id}", data = form)
+    assert client.get("/administrator").status_code == 302
+    db.session.expire_all()
+    assert Employee.query.get(employee.id).email == form["email"]
+
+
+@pytest.fixture
+def small_class(app):
+    training = Training("Ladder Safety", "Denver", "CO", "Room 3", 1, date.today() + timedelta(days = 10), time(8), capacity = 1)
+    db.session.add(training)
+    db.session.commit()
+    yield training.id
+    Enrollment.query.filter_by(training_id = training.id).delete()
+    Training.query.filter_by(id = training.id).delete()
+    db.session.commit()
+
+
+def seats_taken(training_id):
+    db.session.expire_all()
+    return Training.query.get(training_id).seats_taken
+
+
+def test_enroll_and_cancel(app, ids, small_class):
+    client = client_for(app, ids["employee"])
+    other = Employee.query.filter_by(username = "user2").one()
+
+    client.post(f"/training/{small_class}/enroll")
+    assert flashes(client) == ["You are enrolled!"] and seats_taken(small_class) == 1
+    client.post(f"/training/{small_class}/enroll")
+    assert flashes(client) == ["You are already enrolled in that class"] and seats_taken(small_class) == 1
+
+    full = client_for(app, other.id)
+    full.post(f"/training/{small_class}/enroll")
+    assert flashes(full) == ["Sorry, that class is full"]
+    assert Enrollment.query.filter_by(training_id = small_class).count() == 1
+
+    client.post(f"/training/{small_class}/cancel")
+    assert flashes(client) == ["Your seat has been released"] and seats_taken(small_class) == 0
+    client.post(f"/training/{small_class}/cancel")
+    assert flashes(client) == ["You are not enrolled in that class"]
+
+    full.post(f"/training/{small_class}/enroll")
+    assert flashes(full) == ["You are enrolled!"]
+
+
+def test_expired_enroll_form_says_so(app, ids, small_class, monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    client = client_for(app, ids["employee"])
+
+    response = client.post(f"/training/{small_class}/enroll", data = {"csrf_token": "stale"})
+    assert response.status_code == 302 and flashes(client) == ["That form has expired, please try again"]
+    assert seats_taken(small_class) == 0
+
+
+def test_training_page_etag_follows_the_csrf_window(app, ids, monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    monkeypatch.setitem(app.config, "WTF_CSRF_TIME_LIMIT", 4)
+    client = client_for(app, ids["employee"])
+    # two seconds on, inside the local cache's generation window, as with Redis where they never roll
+    start = (cache.time.time() // 300 + 1) * 300 + 10
+    monkeypatch.setattr(cache.time, "time", lambda: start)
+    client.get("/training")
+
+    etag = client.get("/training").headers["ETag"].strip('"')
+    assert client.get("/training", headers = {"If-None-Match": f'"{etag}"'}).status_code == 304
+
+    monkeypatch.setattr(cache.time, "time", lambda: start + 2)
+    later = client.get("/training", headers = {"If-None-Match": f'"{etag}"'})
+    assert later.status_code == 200 and b"csrf_token" in later.data
+
+
+def test_archive_moves_only_superseded_and_long_expired_records(scratch_app):
+    today = date.today()
+    day = lambda offset: today + timedelta(days = offset)
+    site = Location("West Plant", "Boise", "ID")
+    expiring, lifetime = Cert("Crane", 4, True, True, 1, "years"), Cert("Badge", 1, True, False, None, None)
+    staff = [Employee(f"archive{number}", "x", f"archive{number}@example.com", "Arch", f"Ive{number}", day(-3000), False)
+        for number in range(3)]
+    db.session.add_all([site, expiring, lifetime] + staff)
+    db.session.flush()
+    for employee in staff:
+        db.session.execute(employee_location.insert().values(employee_id = employee.id, location_id = site.id))
+
+    first, second, third = staff
+    records = {
+        "superseded": employee_certification(first.id, expiring.id, day(-1100), day(-735)),
+        "latest": employee_certification(first.id, expiring.id, day(-100), day(265)),
+        # older than the latest but still valid, so it stays
+        "still valid": employee_certification(first.id, expiring.id, day(-300), day(65)),
+        "long expired": employee_certification(second.id, expiring.id, day(-2000), day(-1635)),
+        "lifetime": employee_certification(second.id, lifetime.id, day(-500), None),
+        "old lifetime": employee_certification(second.id, lifetime.id, day(-900), None),
+        # expired, but within CERT_ARCHIVE_EXPIRED_DAYS
+        "recently expired": employee_certification(third.id, expiring.id, day(-500), day(-135)),
+    }
+    db.session.add_all(records.values())
+    compliance.rebuild()
+    db.session.commit()
+    ids = {name: record.id for name, record in records.items()}
+    rows = {name: (record.employee_id, record.cert_id, record.received, record.due_date) for name, record in records.items()}
+
+    assert cert_archive.archive(dry_run = True) == {cert_archive.SUPERSEDED: 2, cert_archive.EXPIRED: 1}
+    assert cert_archive.archive() == {cert_archive.SUPERSEDED: 2, cert_archive.EXPIRED: 1}
+
+    moved = {"superseded": cert_archive.SUPERSEDED, "old lifetime": cert_archive.SUPERSEDED,
+        "long expired": cert_archive.EXPIRED}
+    history = {row.id: row for row in CertHistory.query}
+    assert set(history) == {ids[name] for name in moved}
+    for name, reason in moved.items():
+        row = history[ids[name]]
+        assert ((row.employee_id, row.cert_id, row.received, row.due_date), row.reason) == (rows[name], reason)
+    remaining = {row_id for (row_id,) in db.session.query(employee_certification.id)}
+    assert remaining == {ids[name] for name in records if name not in moved}
+
+    # the summary no longer counts the second employee's long-expired Crane
+    assert summary_counts() == {
+        (site.id, expiring.id, "current"): 1,
+        (site.id, expiring.id, "expired"): 1,
+        (site.id, lifetime.id, "no_expiry"): 1,
+    }
+    assert cert_archive.archive() == {}
+
+
+def replica_app(tmp_path, replica_url):
+    app = create_app("testing", SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'primary.db'}",
+        DATABASE_REPLICA_URL = replica_url, JOBS_OUTPUT_DIR = str(tmp_path / "jobs"), LOAD_MIGRATE = False)
+
+    def sites():
+        return str(Location.query.count())
+
+    def add_site():
+        db.session.add(Location(f"Site {Location.query.count()}", "Reno", "NV"))
+        db.session.commit()
+        return "added"
+
+    app.add_url_rule("/_tests/sites", "sites", sites)
+    app.add_url_rule("/_tests/sites", "add_site", add_site, methods = ["POST"])
+    return app
+
+
+@pytest.fixture
+def routed(app, tmp_path, monkeypatch):
+    """An app whose replica is a copy of its primary taken before a second site was added"""
+
+    routed = replica_app(tmp_path, f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setattr(replicas, "health", replicas.ReplicaHealth())
+    db.session.remove()
+    with routed.app_context():
+        db.create_all(bind = None)
+        db.session.add(Location("Copied", "Reno", "NV"))
+        db.session.commit()
+        shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+        db.session.add(Location("Primary only", "Reno", "NV"))
+        db.session.commit()
+        db.session.remove()
+    # each request pushes its own context, so the session and its writes end with the request
+    yield routed
+    db.session.remove()
+
+
+def test_reads_go_to_the_replica_until_the_session_writes(routed):
+    with routed.test_request_context("/_tests/sites"):
+        routed.preprocess_request()
+        assert Location.query.count() == 1
+        assert db.session.get_bind(clause = Location.__table__.select()).url.database.endswith("replica.db")
+
+        db.session.add(Location("Written", "Reno", "NV"))
+        assert Location.query.count() == 3
+        assert db.session.get_bind(clause = Location.__table__.select()).url.database.endswith("primary.db")
+        db.session.rollback()
+
+
+def test_a_write_sticks_the_browser_to_the_primary(routed, monkeypatch):
+    client = routed.test_client()
+    assert client.get("/_tests/sites").data == b"1"
+    assert client.post("/_tests/sites").data == b"added"
+    assert client.get("/_tests/sites").data == b"3"
+
+    # once the stickiness runs out the replica, which never saw the write, answers again
+    with client.session_transaction() as session:
+        session[replicas.STICKY_KEY] = 0
+    assert client.get("/_tests/sites").data == b"1"
+
+
+def test_reads_fall_back_to_the_primary(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(replicas, "health", replicas.ReplicaHealth())
+    for replica_url in (None, f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"):
+        plain = replica_app(tmp_path, replica_url)
+        db.session.remove()
+        with plain.app_context():
+            db.create_all(bind = None)
+            db.session.remove()
+        fallbacks = cache.state.stats["replica.fallback"]
+        assert plain.test_client().get("/_tests/sites").data == b"0"
+        assert cache.state.stats["replica.fallback"] == fallbacks + (replica_url is not None)
+    db.session.remove()
+
+
+def test_home_page_revalidates_with_its_etag(app, tmp_path, monkeypatch):
+    client = app.test_client()
+    first = client.get("/")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "private, no-cache"
+
+    again = client.get("/", headers = {"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b"" and again.headers["ETag"] == etag
+    assert client.get("/", headers = {"If-None-Match": '"other"'}).status_code == 200
+
+    # a pending flash has to be shown, so the cached copy is not current
+    with client.session_transaction() as session:
+        session["_flashes"] = [("info", "Signed out")]
+    flashed = client.get("/", headers = {"If-None-Match": etag})
+    assert flashed.status_code == 200 and b"Signed out" in flashed.data
+
+    # a logged-in visitor's page differs from an anonymous one
+    assert client_for(app, Employee.query.first().id).get("/").headers["ETag"] != etag
+
+    monkeypatch.setitem(app.config, "ASSETS_DIR", str(tmp_path / "dist"))
+    monkeypatch.setitem(app.extensions, "assets", app.extensions["assets"])
+    assert app.test_cli_runner().invoke(args = ["build-assets"]).exit_code == 0
+    assert client.get("/", headers = {"If-None-Match": etag}).status_code == 200
+
+
+def test_keyset_pages_split_duplicate_sort_keys(scratch_app):
+    hired = date(2020, 5, 1)
+    # seven employees hired the same day, so only the id tells pages apart
+    db.session.add_all([Employee(f"same{number}", "x", f"same{number}@example.com", "Pat", "Same", hired, False)
+        for number in range(7)])
+    db.session.add(Employee("later", "x", "later@example.com", "Lee", "Later", hired + timedelta(days = 1), False))
+    db.session.commit()
+    columns = reports.EMPLOYEE_SORTS["hired"]
+    expected = [row.id for row in Employee.query.order_by(*columns)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = pagination.paginate(Employee.query, columns, cursor = cursor, per_page = 3)
+        seen += [employee.id for employee in page.items]
+        pages += 1
+        if not page.has_next:
+            break
+        assert pagination.decode_cursor(page.next_cursor, columns) == [hired, page.items[-1].id]
+        cursor = page.next_cursor
+    assert seen == expected and pages == 3
+
+    # a last page that is exactly full has no next page
+    after_five = pagination.encode_cursor([hired, expected[4]])
+    last = pagination.paginate(Employee.query, columns, cursor = after_five, per_page = 3)
+    assert [employee.id for employee in last.items] == expected[5:] and not last.has_next
+
+    # a cursor that does not decode starts over
+    assert pagination.decode_cursor("not a cursor", columns) is None
+    assert pagination.decode_cursor(pagination.encode_cursor([hired]), columns) is None
+    assert [employee.id for employee in pagination.paginate(Employee.query, columns, cursor = "junk", per_page = 3).items] \
+        == expected[:3]
+
+    with scratch_app.test_request_context("/employees?sort=hired&per_page=3&location=2&after=junk"):
+        scratch_app.preprocess_request()
+        page = pagination.paginate_request(Employee.query, reports.EMPLOYEE_SORTS, "name")
+        assert page.sort == "hired" and page.per_page == 3
+        args = parse_qs(urlsplit(page.next_url()).query)
+        assert args == {"sort": ["hired"], "per_page": ["3"], "location": ["2"], "after": [page.next_cursor]}
+        assert "after" not in parse_qs(urlsplit(page.first_url()).query)
+
+
+@pytest.fixture
+def late_class(app):
+    training = Training("Night Shift; Lockout, Tagout and Confined Space Entry Refresher for Maintenance Crews",
+        "Denver", "CO", "Bay 2", 3, date.today() + timedelta(days = 5), time(22, 30))
+    db.session.add(training)
+    db.session.commit()
+    yield training
+    Training.query.filter_by(id = training.id).delete()
+    db.session.commit()
+
+
+def unfold(body):
+    lines = body.split("\r\n")
+    assert lines[-1] == "" and all(len(line.encode("utf-8")) <= 75 for line in lines)
+    return "\r\n".join(lines).replace("\r\n ", "").split("\r\n")[:-1]
+
+
+def test_training_feed_writes_floating_times(app, ids, late_class):
+    site = Location.query.filter_by(site_name = "North Plant").one()
+    day, next_day = late_class.date, late_class.date + timedelta(days = 1)
+    client = client_for(app, ids["employee"])
+
+    events = client.get(f"/api/trainings?start={day}&end={day}&location={site.id}").get_json()["events"]
+    event = next(event for event in events if event["id"] == late_class.id)
+    # stored and shown in local time: no offset, and never an all-day date
+    assert (event["start"], event["end"]) == (f"{day}T22:30:00", f"{next_day}T01:30:00")
+
+    url = f"/calendar/location/{site.id}.ics?token={training_calendar.feed_token('location', site.id)}"
+    response = app.test_client().get(url)
+    assert response.status_code == 200 and response.mimetype == "text/calendar"
+    lines = unfold(response.get_data(as_text = True))
+    assert lines[0] == "BEGIN:VCALENDAR" and lines[-1] == "END:VCALENDAR"
+    start = lines.index(f"UID:training-{late_class.id}@localhost")
+    event = dict(line.split(":", 1) for line in lines[start:lines.index("END:VEVENT", start)])
+    assert event["DTSTART"] == day.strftime("%Y%m%dT223000")
+    assert event["DTEND"] == next_day.strftime("%Y%m%dT013000")
+    assert event["DTSTAMP"] == late_class.updated_at.strftime("%Y%m%dT%H%M%SZ")
+    assert event["SUMMARY"] == "Night Shift\\; Lockout\\, Tagout and Confined Space Entry Refresher for Maintenance Crews"
+    assert event["LOCATION"] == "Bay 2\\, Denver\\, CO"
+    assert not any(name.startswith(("DTSTART;", "DTEND;")) for name in event)
+
+    assert app.test_client().get(url, headers = {"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert app.test_client().get(f"/calendar/location/{site.id}.ics?token=forged").status_code == 404
+    employee_url = f"/calendar/employee/{ids['employee']}.ics?token={training_calendar.feed_token('location', site.id)}"
+    assert app.test_client().get(employee_url).status_code == 404
+
+
+def test_assets_fingerprinted_with_static_fallback(app, tmp_path):
+    # testing serves the plain static files
+    assert b'href="/static/mycerts.css"' in app.test_client().get("/").data
+
+    missing = create_app("testing", SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'assets.db'}",
+        ASSETS_FINGERPRINT = True, ASSETS_DIR = str(tmp_path / "none"), LOAD_MIGRATE = False)
+    assert b'href="/static/mycerts.css"' in missing.test_client().get("/").data
+
+    manifest = assets.build(app.static_folder, str(tmp_path / "dist"))
+    built = create_app("testing", SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'assets.db'}",
+        ASSETS_FINGERPRINT = True, ASSETS_DIR = str(tmp_path / "dist"), LOAD_MIGRATE = False)
+    client = built.test_client()
+    url = "/assets/" + manifest["mycerts.css"]["path"]
+    assert url != "/assets/mycerts.css" and f'href="{url}"'.encode() in client.get("/").data
+
+    with open(os.path.join(app.static_folder, "mycerts.css"), "rb") as stream:
+        original = stream.read()
+    plain = client.get(url)
+    assert plain.status_code == 200 and plain.data == original and "Content-Encoding" not in plain.headers
+    assert plain.headers["Cache-Control"] == assets.IMMUTABLE and plain.headers["Vary"] == "Accept-Encoding"
+    packed = client.get(url, headers = {"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip" and gzip.decompress(packed.data) == original
+    assert packed.headers["Cache-Control"] == assets.IMMUTABLE
+
+    assert client.get("/assets/mycerts.css").status_code == 404
+
+
+@pytest.mark.parametrize("profile, expected", [
+    ("development", {"DEBUG_TOOLBAR": True, "ASSETS_FINGERPRINT": False, "LOAD_MIGRATE": True, "TESTING": False}),
+    ("testing", {"DEBUG_TOOLBAR": False, "ASSETS_FINGERPRINT": False, "TESTING": True, "WTF_CSRF_ENABLED": False,
+        "BCRYPT_LOG_ROUNDS": 4, "MAIL_SENDER_THREAD": False, "JOBS_WORKER_THREAD": False}),
+    ("production", {"DEBUG_TOOLBAR": False, "ASSETS_FINGERPRINT": True, "LOAD_MIGRATE": False, "TESTING": False}),
+])
+def test_profile_settings(profile, expected, tmp_path):
+    built = create_app(profile, SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'profile.db'}")
+    assert {key: built.config[key] for key in expected} == expected
+    # SQLite keeps SQLAlchemy's own pools
+    assert built.config["SQLALCHEMY_ENGINE_OPTIONS"] == {}
+
+
+def test_profile_chosen_from_environment(monkeypatch):
+    monkeypatch.delenv("MYCERTS_CONFIG", raising = False)
+    monkeypatch.delenv("FLASK_ENV", raising = False)
+    assert config.default_profile() == "production"
+    monkeypatch.setenv("FLASK_ENV", "development")
+    assert config.default_profile() == "development"
+    monkeypatch.setenv("MYCERTS_CONFIG", "testing")
+    assert config.default_profile() == "testing"
+
+
+def test_pool_settings_read_from_environment(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "12")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "600")
+    try:
+        profile = importlib.reload(config).ProductionConfig
+        settings = {key: getattr(profile, key) for key in dir(profile) if key.isupper()}
+        options = config.engine_options(dict(settings, SQLALCHEMY_DATABASE_URI = "postgresql:///mycerts"))
+    finally:
+        monkeypatch.undo()
+        importlib.reload(config)
+
+    assert options == {"pool_size": 12, "max_overflow": 10, "pool_timeout": 10, "pool_recycle": 600,
+        "pool_pre_ping": True, "executemany_mode": "values"}
+
+
+def test_gunicorn_settings_read_from_environment(monkeypatch):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    for name in ["WEB_CONCURRENCY", "GUNICORN_THREADS", "GUNICORN_PRELOAD", "GUNICORN_MAX_REQUESTS"]:
+        monkeypatch.delenv(name, raising = False)
+    defaults = runpy.run_path(path)
+    assert defaults["threads"] == 4 and defaults["preload_app"] is True and defaults["workers"] >= 3
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.setenv("GUNICORN_THREADS", "8")
+    monkeypatch.setenv("GUNICORN_PRELOAD", "0")
+    monkeypatch.setenv("GUNICORN_MAX_REQUESTS", "500")
+    settings = runpy.run_path(path)
+    assert (settings["workers"], settings["threads"], settings["preload_app"]) == (3, 8, False)
+    assert (settings["max_requests"], settings["max_requests_jitter"]) == (500, 50)
@@ -0,0 +1,195 @@
+"""Training calendar: date-range queries, JSON events and iCalendar feeds.
+
+Trainings are tied to places by city and state, so a location's calendar is
+the trainings held in its city, and an employee's is the trainings at any of
+their locations. Every query is bounded by date and served from
+ix_trainings_date / ix_trainings_place.
+
+Calendar clients poll, so responses carry an ETag and Last-Modified built from
+the newest Training.updated_at. That timestamp is cached for
+CALENDAR_STAMP_TTL seconds per worker (and dropped at once by a local training
+write), so a poll that finds nothing new answers 304 after one small indexed
+lookup at most.
+
+Feed URLs carry a signed token instead of a login, since calendar apps cannot
+hold a session.
+"""
+
+from datetime import date, datetime, timedelta
+
+from flask import current_app, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, exists, func
+
+import cache
+from models import db, Location, Training, employee_location
+
+EPOCH = datetime(1970, 1, 1)
+FEED_SALT = "training-feed"
+FEED_BATCH = 500
+
+
+def trainings_between(start, end):
+    """Trainings from start to end inclusive, in date and time order"""
+
+    return (Training.query
+        .filter(Training.date >= start, Training.date <= end)
+        .order_by(Training.date, Training.time, Training.id))
+
+
+def upcoming():
+    return Training.query.filter(Training.date >= date.today()).order_by(Training.date, Training.time, Training.id)
+
+
+def at_place(query, city, state):
+    return query.filter(Training.state == state, Training.city == city)
+
+
+def for_employee(query, employee_id):
+    """Only trainings in the city of one of the employee's locations"""
+
+    return query.filter(exists().where(and_(
+        employee_location.c.employee_id == employee_id,
+        Location.id == employee_location.c.location_id,
+        Location.state == Training.state,
+        Location.city == Training.city)))
+
+
+def employee_places(employee_id):
+    """Sorted (city, state) pairs of the employee's locations; part of their feed's ETag"""
+
+    return sorted(db.session.query(Location.city, Location.state)
+        .join(employee_location, employee_location.c.location_id == Location.id)
+        .filter(employee_location.c.employee_id == employee_id)
+        .distinct())
+
+
+def latest_change():
+    """updated_at of the most recently added or edited training"""
+
+    return cache.cached("calendar:stamp", ["trainings"],
+        lambda: db.session.query(func.max(Training.updated_at)).scalar() or EPOCH,
+        ttl = current_app.config["CALENDAR_STAMP_TTL"])
+
+
+def feed_window():
+    today = date.today()
+    return (today - timedelta(days = current_app.config["CALENDAR_FEED_PAST_DAYS"]),
+        today + timedelta(days = current_app.config["CALENDAR_FEED_FUTURE_DAYS"]))
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt = FEED_SALT)
+
+
+def feed_token(kind, object_id):
+    """Token for the ?token= of the kind ("location" or "employee") feed of object_id"""
+
+    return _serializer().dumps([kind, object_id])
+
+
+def feed_url(kind, object_id):
+    """Subscribable URL of a feed; available in templates"""
+
+    return url_for(f"mycerts.{kind}_training_feed", token = feed_token(kind, object_id), _external = True,
+        **{f"{kind}_id": object_id})
+
+
+def check_feed_token(token, kind, object_id):
+    try:
+        return _serializer().loads(token or "") == [kind, object_id]
+    except BadSignature:
+        return False
+
+
+def ends_at(training):
+    return datetime.combine(training.date, training.time) + timedelta(hours = training.hours)
+
+
+def as_json(training):
+    """A training as a calendar event (the shape FullCalendar reads)"""
+
+    return {
+        "id": training.id,
+        "title": training.name,
+        "start": datetime.combine(training.date, training.time).isoformat(),
+        "end": ends_at(training).isoformat(),
+        "city": training.city,
+        "state": training.state,
+        "room": training.room,
+        "hours": training.hours,
+    }
+
+
+#######################################################################
+# iCalendar (RFC 5545)
+
+def _escape(value):
+    return (str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _line(name, value):
+    """One content line, folded at 75 octets"""
+
+    line = f"{name}:{value}".encode("utf-8")
+    folded = []
+    while len(line) > 75:
+        cut = 75 if not folded else 74
+        # never split a multi-byte character
+        while cut and (line[cut] & 0xC0) == 0x80:
+            cut -= 1
+        folded.append(line[:cut])
+        line = line[cut:]
+    folded.append(line)
+
+    return b"\r\n ".join(folded).decode("utf-8") + "\r\n"
+
+
+def _stamp(moment):
+    return moment.strftime("%Y%m%dT%H%M%SZ")
+
+
+def _event(training, host):
+    start = datetime.combine(training.date, training.time)
+    return "".join([
+        "BEGIN:VEVENT\r\n",
+        _line("UID", f"training-{training.id}@{host}"),
+        _line("DTSTAMP", _stamp(training.updated_at)),
+        _line("LAST-MODIFIED", _stamp(training.updated_at)),
+        # trainings are stored in local time, so they are written as floating times
+        _line("DTSTART", start.strftime("%Y%m%dT%H%M%S")),
+        _line("DTEND", ends_at(training).strftime("%Y%m%dT%H%M%S")),
+        _line("SUMMARY", _escape(training.name)),
+        _line("LOCATION", _escape(", ".join(part for part in (training.room, training.city, training.state) if part))),
+        "END:VEVENT\r\n",
+    ])
+
+
+def stream_ics(name, trainings, host):
+    """Yield an iCalendar document for trainings a batch of events at a time"""
+
+    yield "".join([
+        "BEGIN:VCALENDAR\r\n",
+        "VERSION:2.0\r\n",
+        "PRODID:-//MyCerts//Training Calendar//EN\r\n",
+        "CALSCALE:GREGORIAN\r\n",
+        _line("X-WR-CALNAME", _escape(name)),
+    ])
+
+    events = []
+    for training in trainings.yield_per(FEED_BATCH):
+        events.append(_event(training, host))
+        if len(events) >= FEED_BATCH:
+            yield "".join(events)
+            events = []
+
+    yield "".join(events) + "END:VCALENDAR\r\n"
+
+
+def init_app(app):
+    app.add_template_global(feed_url, "training_feed_url")
+    app.config.setdefault("CALENDAR_STAMP_TTL", 30)
+    app.config.setdefault("CALENDAR_FEED_PAST_DAYS", 30)
+    app.config.setdefault("CALENDAR_FEED_FUTURE_DAYS", 365)
+    app.config.setdefault("CALENDAR_MAX_RANGE_DAYS", 366)